@@ -11,10 +11,16 @@
 
 import os
 import sys
+import shutil
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 from .specs import     from_xml as specs_from_xml
 from .evaluator import from_specs as evaluator_from_specs
-from .pdflog import encrypt_pdf, build as pdf_build
+from . import reporters
+from .cache import BuildCache, ResultStore, ReportIndex
+from .common import parsesize, workspace
+
+COMMANDS = ['enqueue', 'worker', 'collect', 'serve', 'submit']
 
 
 def fetch_args():
@@ -29,10 +35,37 @@ def fetch_args():
 	                    help='the XML evaluation file that specifies how to build and evaluate the program')
 
 	parser.add_argument('-o', '--output', metavar='path', type=str, nargs=1,
-	                    help='the path of the output file with evaluation results')
+	                    help='the path of the output file with evaluation results '
+	                         '(output directory when evaluating a directory)')
 
-	parser.add_argument('source', type=str,
-	                    help='the source code of the program to be evaluated')
+	parser.add_argument('-f', '--format', type=str, choices=reporters.FORMATS, default='pdf',
+	                    help='the format of the report (default: pdf)')
+
+	parser.add_argument('-j', '--jobs', metavar='N', type=int, default=None,
+	                    help='number of submissions evaluated in parallel when '
+	                         'source is a directory (default: number of CPUs)')
+
+	parser.add_argument('--build-jobs', metavar='N', type=int, default=None,
+	                    help='number of submissions built in parallel before evaluating '
+	                         'them when source is a directory (default: number of CPUs)')
+
+	add_evaluation_options(parser)
+
+	parser.add_argument('--watch', metavar='dir', type=str, default=None,
+	                    help='evaluate the submissions written to dir as they arrive, '
+	                         'until interrupted')
+
+	parser.add_argument('--debounce', metavar='secs', type=float, default=None,
+	                    help='with --watch, seconds a submission must be left unchanged '
+	                         'before it is evaluated (default: 2)')
+
+	parser.add_argument('--poll', action='store_true',
+	                    help='with --watch, scan the directory periodically instead of using '
+	                         'inotify (e.g. on network filesystems)')
+
+	parser.add_argument('source', type=str, nargs='?',
+	                    help='the source code of the program to be evaluated, '
+	                         'or a directory of submissions to evaluate in batch')
 
 	# parser.add_argument("-v", "--verbosity", type=int, choices=[0, 1, 2],
 	#                     help='sets the increase output verbosity')
@@ -43,10 +76,143 @@ def fetch_args():
 	# parser.add_argument('--sum', dest='accumulate', action='store_const',
 	#                     const=sum, default=max,
 	#                     help='sum the integers (default: find the max)')
+	args = parser.parse_args()
+	if not args.source and not args.watch:
+		parser.error('the following arguments are required: source')
+	return args
+#end def
+
+
+def fetch_command_args():
+	parser = argparse.ArgumentParser(prog='evaluator', description='Distributes evaluations among '
+	                                 'worker processes, through a job broker or a daemon.')
+	commands = parser.add_subparsers(dest='command', metavar='command')
+	commands.required = True
+
+	enqueue = commands.add_parser('enqueue', help='adds evaluation jobs to the broker')
+	broker_option(enqueue)
+	enqueue.add_argument('-f', '--format', type=str, choices=reporters.FORMATS, default='pdf',
+	                    help='the format of the reports (default: pdf)')
+	enqueue.add_argument('--max-attempts', metavar='N', type=int, default=None,
+	                    help='evaluations of a job (e.g. when its worker dies) before it is '
+	                         'given up (default: 3)')
+	enqueue.add_argument('specs_file', type=str,
+	                    help='the XML evaluation file that specifies how to build and evaluate the program')
+	enqueue.add_argument('source', type=str,
+	                    help='the source code of the program to be evaluated, '
+	                         'or a directory of submissions')
+
+	worker = commands.add_parser('worker', help='evaluates the jobs of the broker')
+	broker_option(worker)
+	worker.add_argument('-j', '--jobs', metavar='N', type=int, default=1,
+	                    help='number of worker processes (default: 1)')
+	worker.add_argument('--lease', metavar='secs', type=float, default=None,
+	                    help='seconds a job is kept by a worker which stopped responding '
+	                         'before it is given to another worker (default: 60)')
+	worker.add_argument('--wait', action='store_true',
+	                    help='wait for new jobs instead of exiting once the queue is empty')
+	add_evaluation_options(worker)
+
+	collect = commands.add_parser('collect', help='writes the reports and scores of finished jobs')
+	broker_option(collect)
+	collect.add_argument('-o', '--output', metavar='path', type=str, default='.',
+	                    help='the output directory (default: current directory)')
+
+	serve = commands.add_parser('serve', help='evaluates the requests of submit as a daemon')
+	socket_option(serve)
+	serve.add_argument('-j', '--jobs', metavar='N', type=int, default=None,
+	                    help='number of evaluations run at a time (default: number of CPUs)')
+	add_evaluation_options(serve)
+
+	submit = commands.add_parser('submit', help='evaluates a program with the daemon')
+	socket_option(submit)
+	submit.add_argument('-o', '--output', metavar='path', type=str, default=None,
+	                    help='the path of the output file with evaluation results')
+	submit.add_argument('-f', '--format', type=str, choices=reporters.FORMATS, default='pdf',
+	                    help='the format of the report (default: pdf)')
+	submit.add_argument('specs_file', type=str,
+	                    help='the XML evaluation file that specifies how to build and evaluate the program')
+	submit.add_argument('source', type=str,
+	                    help='the source code of the program to be evaluated')
 	return parser.parse_args()
 #end def
 
 
+def broker_option(parser):
+	parser.add_argument('--broker', metavar='path', type=str, default=None,
+	                    help='the SQLite file of the job queue (default: progeval-jobs.db)')
+#end def
+
+
+def socket_option(parser):
+	parser.add_argument('--socket', metavar='path', type=str, default=None,
+	                    help='the unix socket of the daemon (default: progeval-UID.sock '
+	                         'in $XDG_RUNTIME_DIR or /tmp)')
+#end def
+
+
+def add_evaluation_options(parser):
+	parser.add_argument('-p', '--parallel-tests', action='store_true',
+	                    help='run the testruns of each testbed concurrently')
+
+	parser.add_argument('--test-jobs', metavar='N', type=int, default=None,
+	                    help='with --parallel-tests, number of testruns run at a time '
+	                         '(default: number of CPUs). Implies --parallel-tests')
+
+	parser.add_argument('--output-limit', metavar='size', type=str, default=None,
+	                    help='maximum size of the stdout and stderr of each testrun, '
+	                         'e.g. 512K or 16M (default: 16M)')
+
+	parser.add_argument('--cpu-limit', metavar='secs', type=float, default=None,
+	                    help='maximum CPU time of each testrun in seconds')
+
+	parser.add_argument('--memory-limit', metavar='size', type=str, default=None,
+	                    help='maximum address space of each testrun, e.g. 256M')
+
+	parser.add_argument('--process-limit', metavar='N', type=int, default=None,
+	                    help='maximum number of processes of the user running each testrun')
+
+	parser.add_argument('--file-limit', metavar='size', type=str, default=None,
+	                    help='maximum size of the files written by each testrun, e.g. 1M')
+
+	parser.add_argument('--cache', action='store_true',
+	                    help='reuse built programs across evaluations, caching them '
+	                         'in ~/.cache/progeval (see --cache-dir)')
+
+	parser.add_argument('--cache-dir', metavar='dir', type=str, default=None,
+	                    help='directory of the cache instead of ~/.cache/progeval. '
+	                         'Implies --cache')
+
+	parser.add_argument('--cache-size', metavar='MB', type=int, default=256,
+	                    help='maximum size of the cached programs, and of the cached results '
+	                         'and reports, in megabytes (default: 256)')
+
+	parser.add_argument('--no-memo', action='store_true',
+	                    help='with --cache, always execute testruns instead of reusing '
+	                         'results of previous runs of the same program')
+
+	parser.add_argument('--no-spec-cache', action='store_true',
+	                    help='always parse the XML specification file instead of loading '
+	                         'it from the cache of parsed specifications')
+
+	parser.add_argument('--fork-server', action='store_true',
+	                    help='run Python programs in children forked from a pre-started '
+	                         'interpreter instead of starting the interpreter for each testrun')
+
+	parser.add_argument('--workspace', metavar='dir', type=str, default=None,
+	                    help='directory where the programs of each evaluation are built '
+	                         '(default: /dev/shm when available)')
+
+	parser.add_argument('--pch', action='store_true',
+	                    help='build C++ programs with a precompiled <bits/stdc++.h>, '
+	                         'generated once per compiler and flags')
+
+	parser.add_argument('--no-early-reject', action='store_true',
+	                    help='let programs run to completion even when their output '
+	                         'is already known to be wrong')
+#end def
+
+
 def test_xml(parser):
 	options, remainder = parser.parse_known_args()
 	if options.test_xml and len(options.test_xml) > 0:
@@ -54,7 +220,7 @@ def test_xml(parser):
 			s = specs_from_xml(options.test_xml[0])
 			print(f'Successfully loaded {len(s.testbeds)} testbeds from {options.test_xml[0]}')
 			for t in s.testbeds:
-				print(f'\t{ t }: {len(t.testruns)} testruns, {t.score} points')
+				print(f'\t{ t }: {len(t)} testruns, {t.score} points')
 			sys.exit(0)
 		except Exception as err:
 			print(f'Unexpected {err=}, {type(err)=}', file=sys.stderr)
@@ -63,14 +229,67 @@ def test_xml(parser):
 #end def
 
 
+def evaluator_options(args):
+	options = { 'limits': {},
+		'early': not args.no_early_reject, 'forkserver': args.fork_server,
+		'workspace': args.workspace, 'pch': args.pch }
+	if args.output_limit:
+		options['limits']['cout'] = parsesize(args.output_limit)
+		options['limits']['cerr'] = parsesize(args.output_limit)
+	if args.cpu_limit:
+		options['limits']['cpu'] = args.cpu_limit
+	if args.memory_limit:
+		options['limits']['memory'] = parsesize(args.memory_limit)
+	if args.process_limit:
+		options['limits']['processes'] = args.process_limit
+	if args.file_limit:
+		options['limits']['filesize'] = parsesize(args.file_limit)
+	if args.parallel_tests or args.test_jobs:
+		options['parallel'] = True
+		options['jobs'] = args.test_jobs
+	if args.cache or args.cache_dir:
+		directory = args.cache_dir
+		maxsize = args.cache_size * 1024 * 1024
+		builddir = os.path.join(directory, 'build') if directory else None
+		options['buildcache'] = BuildCache(builddir, maxsize=maxsize)
+		if not args.no_memo:
+			resultsdir = os.path.join(directory, 'results') if directory else None
+			options['results'] = ResultStore(resultsdir, maxsize=maxsize)
+			reportsdir = os.path.join(directory, 'reports') if directory else None
+			options['index'] = ReportIndex(reportsdir, maxsize=maxsize)
+	return options
+#end def
+
+
 def main():
+	if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+		main_command()
+		return
 	args = fetch_args()
 	print(args)
-	s = specs_from_xml(args.specs_file)
+	s = specs_from_xml(args.specs_file, cache=not args.no_spec_cache)
+	if args.watch:
+		main_watch(s, args)
+		return
+	if os.path.isdir(args.source):
+		main_batch(s, args)
+		return
 	# print(s.__dict__)
-	e = evaluator_from_specs(s)
-	e.evaluate(args.source)
-	report = pdf_build()
+	output = args.output[0] if args.output and len(args.output) > 0 else None
+	if not output and args.format != 'pdf':
+		output = os.path.splitext(os.path.basename(args.source))[0] + \
+			reporters.from_format(args.format).extension
+	# JSON events are written to the report as they occur
+	stream = open(output, 'w', encoding='utf-8') if args.format == 'json' else None
+	kwargs = { 'stream': stream } if stream else {}
+	try:
+		e = evaluator_from_specs(s, reporter=reporters.from_format(args.format, **kwargs),
+			**evaluator_options(args))
+		e.evaluate(args.source)
+		report = e.reporter.build(output)
+	finally:
+		if stream:
+			stream.close()
 	# print(f'args: {args}')
 	if not report:
 		print('Failed to generate report file.', file=sys.stderr)
@@ -78,15 +297,121 @@ def main():
 		sys.exit(-1)
 
 	print('Evaluation complete')
-	print('Encrypting...')
-	encrypt_pdf(report)
+	print(report)
+#end def
 
-	if args.output and len(args.output) > 0:
-		print(f'Moving {report} to {args.output[0]}')
-		os.rename(report, args.output[0])
-		report = args.output[0]
 
-	print(report)
+def main_batch(specs, args):
+	from . import batch
+	sources = batch.find_sources(args.source, specs.language)
+	if len(sources) < 1:
+		print(f'No {specs.language} source files found in {args.source}', file=sys.stderr)
+		sys.exit(-1)
+
+	outdir = args.output[0] if args.output and len(args.output) > 0 else '.'
+	print(f'Evaluating {len(sources)} submissions from {args.source}')
+	options = evaluator_options(args)
+	options['reporter'] = reporters.from_format(args.format)
+	# Programs are built first, then fetched from the build cache
+	tmpcache = None
+	if not options.get('buildcache'):
+		tmpcache = workspace(args.workspace)
+		options['buildcache'] = BuildCache(tmpcache, maxsize=sys.maxsize)
+	try:
+		built = batch.prebuild(specs, sources, options['buildcache'], jobs=args.build_jobs,
+			pch=args.pch, workspace=args.workspace)
+		if built:
+			print(f'Built {built} programs')
+		results = batch.evaluate_all(specs, sources, outdir, jobs=args.jobs, options=options)
+	finally:
+		if tmpcache:
+			shutil.rmtree(tmpcache, ignore_errors=True)
+
+	summary = os.path.join(outdir, 'scores.csv')
+	batch.write_summary(results, summary)
+	print('Evaluation complete')
+	batch.print_summary(results)
+	print(summary)
+#end def
+
+def main_watch(specs, args):
+	if not os.path.isdir(args.watch):
+		print(f'{args.watch} is not a directory', file=sys.stderr)
+		sys.exit(-1)
+
+	from . import batch, watch
+	outdir = args.output[0] if args.output and len(args.output) > 0 else '.'
+	options = evaluator_options(args)
+	options['reporter'] = reporters.from_format(args.format)
+	debounce = args.debounce if args.debounce is not None else watch.DEFAULT_DEBOUNCE
+	results = watch.watch(specs, args.watch, outdir, jobs=args.jobs, options=options,
+		debounce=debounce, poll=args.poll)
+	if len(results) > 0:
+		batch.print_summary(results)
+		print(os.path.join(outdir, 'scores.csv'))
+#end def
+
+
+def main_command():
+	args = fetch_command_args()
+	if args.command == 'enqueue':
+		from . import batch, broker
+		path = args.broker or broker.DEFAULT_BROKER
+		s = specs_from_xml(args.specs_file)
+		sources = batch.find_sources(args.source, s.language) \
+			if os.path.isdir(args.source) else [ args.source ]
+		maxtries = args.max_attempts if args.max_attempts is not None else broker.DEFAULT_ATTEMPTS
+		ids = broker.enqueue(path, args.specs_file, sources, args.format, maxtries)
+		print(f'Enqueued {len(ids)} jobs in {path}')
+
+	elif args.command == 'worker':
+		from . import broker
+		path = args.broker or broker.DEFAULT_BROKER
+		lease = args.lease if args.lease is not None else broker.DEFAULT_LEASE
+		options = evaluator_options(args)
+		options['workers'] = args.jobs
+		with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+			futures = [ pool.submit(broker.work, path, options, lease, args.wait,
+				not args.no_spec_cache) for i in range(args.jobs) ]
+			count = sum([ f.result() for f in futures ])
+		print(f'Processed {count} jobs')
+
+	elif args.command == 'collect':
+		from . import batch, broker
+		path = args.broker or broker.DEFAULT_BROKER
+		results = broker.collect(path, args.output)
+		pending = broker.pending(path)
+		if pending:
+			print(f'{pending} jobs pending', file=sys.stderr)
+		if len(results) < 1:
+			return
+		summary = os.path.join(args.output, 'scores.csv')
+		batch.write_summary(results, summary)
+		batch.print_summary(results)
+		print(summary)
+
+	elif args.command == 'serve':
+		from . import daemon
+		d = daemon.Daemon(args.socket or daemon.DEFAULT_SOCKET, args.jobs, evaluator_options(args),
+			not args.no_spec_cache)
+		try:
+			d.serve()
+		except OSError as err:
+			print(err, file=sys.stderr)
+			sys.exit(-1)
+
+	elif args.command == 'submit':
+		from . import daemon
+		try:
+			score, report = daemon.submit(args.specs_file, args.source, args.format,
+				args.output, args.socket or daemon.DEFAULT_SOCKET)
+		except (OSError, RuntimeError) as err:
+			print(err, file=sys.stderr)
+			print('Aborted.', file=sys.stderr)
+			sys.exit(-1)
+		print('Evaluation complete')
+		print(report)
+#end def
 
 if __name__ == '__main__':
 	main()
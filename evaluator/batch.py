@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ## ###############################################################
+# evaluator/batch.py
+#
+# Author:  Mauricio Matamoros
+# License: MIT
+#
+# ## ###############################################################
+
+import os
+import csv
+import sys
+import signal
+import shutil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from . import common
+from .common import warn
+from .evaluator import from_specs as evaluator_from_specs, builder
+
+SOURCE_EXTENSIONS = {
+	'C'      : ['.c'],
+	'C++'    : ['.cpp', '.cc', '.cxx', '.c++'],
+	'Python' : ['.py'],
+}
+
+__evaluator = None
+
+
+def find_sources(directory, language):
+	'''Lists the source files in directory written in the given language'''
+	extensions = SOURCE_EXTENSIONS.get(language, [])
+	sources = []
+	for f in sorted(os.listdir(directory)):
+		path = os.path.join(directory, f)
+		if not os.path.isfile(path):
+			continue
+		if os.path.splitext(f)[1].lower() in extensions:
+			sources.append(path)
+	return sources
+# end def
+
+
+
+def evaluate_all(specs, sources, outdir='.', jobs=None, options=None):
+	'''Evaluates all sources against specs using up to jobs worker processes.
+	options are passed as keyword arguments to each worker's Evaluator.
+	Returns a list of (source, score, report) tuples sorted by source.'''
+	if not os.path.exists(outdir):
+		os.makedirs(outdir)
+
+	results = []
+	with worker_pool(specs, jobs, options) as pool:
+		futures = [ schedule(pool, src, outdir) for src in sources ]
+		try:
+			for f in as_completed(futures):
+				source, score, report = f.result()
+				print(f'[{len(results)+1}/{len(sources)}] {source}: {_fmtscore(score)}')
+				results.append( (source, score, report) )
+		except KeyboardInterrupt:
+			for f in futures:
+				f.cancel()
+			raise
+	results.sort(key=lambda r: r[0])
+	return results
+# end def
+
+
+
+def prebuild(specs, sources, buildcache, jobs=None, pch=False, workspace=None):
+	'''Builds sources concurrently, up to jobs at a time, storing the programs
+	in buildcache so their evaluations find them already built.
+	Returns the number of programs built'''
+	build = builder(specs, pch)
+	if not specs.buildTool or not build:
+		return 0
+
+	def prebuild_one(source):
+		key = buildcache.key(source, specs.language, specs.buildFlags, specs.buildTool)
+		if buildcache.contains(key):
+			return False
+		workdir = common.workspace(workspace)
+		try:
+			outfile = os.path.join(workdir, os.path.basename(common.outname(source)))
+			outfile = build(specs.buildTool, source, flags=specs.buildFlags, outfile=outfile)
+			if outfile:
+				buildcache.store(key, outfile)
+			return bool(outfile)
+		finally:
+			shutil.rmtree(workdir, ignore_errors=True)
+
+	with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+		return sum(pool.map(prebuild_one, sources))
+# end def
+
+
+
+def worker_pool(specs, jobs=None, options=None):
+	'''Creates a pool of up to jobs worker processes evaluating submissions
+	against specs (see schedule). options are passed as keyword arguments to
+	each worker's Evaluator'''
+	options = dict(options or {})
+	options['workers'] = jobs or os.cpu_count()
+	return ProcessPoolExecutor(max_workers=jobs,
+		initializer=_init_worker, initargs=(specs, options))
+# end def
+
+
+
+def schedule(pool, source, outdir='.'):
+	'''Schedules the evaluation of source in a worker_pool, writing its report
+	to outdir. Returns the future of its (source, score, report) tuple'''
+	return pool.submit(_evaluate_one, source, outdir)
+# end def
+
+
+
+def write_summary(results, file):
+	'''Writes the scores of a batch evaluation as a CSV file'''
+	with open(file, 'w', encoding='utf-8', newline='') as f:
+		writer = csv.writer(f)
+		writer.writerow(['source', 'score', 'report'])
+		for source, score, report in results:
+			writer.writerow([os.path.basename(source), _fmtscore(score), report or ''])
+# end def
+
+
+
+def print_summary(results, file=sys.stdout):
+	width = max([ len(os.path.basename(r[0])) for r in results ] + [6])
+	print(f'{"Source":<{width}}  Score', file=file)
+	for source, score, report in results:
+		print(f'{os.path.basename(source):<{width}}  {_fmtscore(score):>5}', file=file)
+# end def
+
+
+
+def _init_worker(specs, options):
+	global __evaluator
+	# Interruptions are handled by the parent, which cancels pending work
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	__evaluator = evaluator_from_specs(specs, **(options or {}))
+# end def
+
+
+
+def _evaluate_one(source, outdir):
+	reporter = __evaluator.reporter
+	name = os.path.splitext(os.path.basename(source))[0]
+	try:
+		__evaluator.evaluate(source)
+		report = reporter.build(os.path.join(outdir, f'{name}{reporter.extension}'))
+	except Exception as err:
+		warn(f'Failed to evaluate {source}: {err}')
+		return source, None, None
+
+	if not report:
+		warn(f'Failed to generate report file for {source}.')
+	return source, __evaluator.score, report
+# end def
+
+
+
+def _fmtscore(score):
+	return 'ERROR' if score is None else f'{score:0.1f}'
+# end def
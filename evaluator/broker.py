@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ## ###############################################################
+# evaluator/broker.py
+#
+# Author:  Mauricio Matamoros
+# License: MIT
+#
+# ## ###############################################################
+
+import os
+import time
+import socket
+import shutil
+import sqlite3
+import threading
+from .common import warn, workspace
+from .specs import from_xml as specs_from_xml
+from .evaluator import from_specs as evaluator_from_specs
+from . import reporters
+
+DEFAULT_BROKER = 'progeval-jobs.db'
+# Seconds a job is leased to a worker before another worker may take it
+DEFAULT_LEASE = 60
+# Evaluations of a job before it is given up as failed
+DEFAULT_ATTEMPTS = 3
+# Seconds between checks for new jobs of waiting workers
+POLL_INTERVAL = 2
+
+QUEUED  = 'queued'
+LEASED  = 'leased'
+DONE    = 'done'
+FAILED  = 'failed'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+	id       INTEGER PRIMARY KEY AUTOINCREMENT,
+	specs    TEXT NOT NULL,
+	source   TEXT NOT NULL,
+	format   TEXT NOT NULL,
+	state    TEXT NOT NULL,
+	attempts INTEGER NOT NULL DEFAULT 0,
+	maxtries INTEGER NOT NULL,
+	worker   TEXT,
+	expires  REAL,
+	score    REAL,
+	report   BLOB,
+	error    TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, expires);
+'''
+
+
+class Job():
+	'''A (specs, submission) pair leased by a worker'''
+	def __init__(self, id, specs, source, format, attempts):
+		self.id = id
+		self.specs = specs
+		self.source = source
+		self.format = format
+		self.attempts = attempts
+	# end def
+
+	def __str__(self):
+		return f'#{self.id} {self.source}'
+	# end def
+# end class
+
+
+
+class Broker():
+	'''Queue of evaluation jobs kept in a SQLite database, so producers and
+	workers need no server. The database must be on a local filesystem of
+	the machine running them all: SQLite locking is not reliable over NFS
+	and other network filesystems, where jobs could be lost or leased twice.
+	Workers lease jobs for a while and must renew the lease while evaluating;
+	jobs whose lease expired (e.g. the worker died) are leased again until
+	they have been attempted maxtries times.
+	Connections are not shared among threads, each thread needs a Broker'''
+	def __init__(self, path=DEFAULT_BROKER):
+		self._path = path
+		self._db = sqlite3.connect(path, timeout=60, isolation_level=None)
+		self._db.executescript(SCHEMA)
+	# end def
+
+	@property
+	def path(self):
+		return self._path
+	# end def
+
+	def close(self):
+		self._db.close()
+	# end def
+
+	def enqueue(self, specs, source, format='pdf', maxtries=DEFAULT_ATTEMPTS):
+		'''Adds a job evaluating source against the specs file. Paths are
+		stored as absolute paths, workers must be able to reach them.
+		Returns the id of the job'''
+		cur = self._db.execute('INSERT INTO jobs (specs, source, format, state, maxtries) '
+			'VALUES (?, ?, ?, ?, ?)', (os.path.abspath(specs), os.path.abspath(source),
+			format, QUEUED, maxtries))
+		return cur.lastrowid
+	# end def
+
+	def lease(self, worker, duration=DEFAULT_LEASE):
+		'''Leases the next pending job to worker for duration seconds.
+		Returns the Job, or None if there is none'''
+		now = time.time()
+		with self._transaction():
+			self._expire(now)
+			row = self._db.execute('SELECT id, specs, source, format, attempts FROM jobs '
+				'WHERE state = ? ORDER BY id LIMIT 1', (QUEUED,)).fetchone()
+			if row is None:
+				return None
+			self._db.execute('UPDATE jobs SET state = ?, worker = ?, expires = ?, '
+				'attempts = attempts + 1 WHERE id = ?', (LEASED, worker, now + duration, row[0]))
+		return Job(row[0], row[1], row[2], row[3], row[4] + 1)
+	# end def
+
+	def renew(self, job, worker, duration=DEFAULT_LEASE):
+		'''Extends the lease of job. Returns False if worker lost it'''
+		cur = self._db.execute('UPDATE jobs SET expires = ? WHERE id = ? AND state = ? '
+			'AND worker = ?', (time.time() + duration, job.id, LEASED, worker))
+		return cur.rowcount > 0
+	# end def
+
+	def complete(self, job, worker, score, report=None):
+		'''Posts the score and report (the contents of the file) of job'''
+		cur = self._db.execute('UPDATE jobs SET state = ?, score = ?, report = ?, '
+			'error = NULL, expires = NULL WHERE id = ? AND state = ? AND worker = ?',
+			(DONE, score, report, job.id, LEASED, worker))
+		return cur.rowcount > 0
+	# end def
+
+	def fail(self, job, worker, error):
+		'''Returns job to the queue, or gives it up once out of attempts'''
+		cur = self._db.execute('UPDATE jobs SET state = CASE WHEN attempts < maxtries '
+			'THEN ? ELSE ? END, error = ?, worker = NULL, expires = NULL '
+			'WHERE id = ? AND state = ? AND worker = ?',
+			(QUEUED, FAILED, str(error), job.id, LEASED, worker))
+		return cur.rowcount > 0
+	# end def
+
+	def counts(self):
+		'''Returns the number of jobs in each state'''
+		with self._transaction():
+			self._expire(time.time())
+			rows = self._db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall()
+		counts = { s: 0 for s in [QUEUED, LEASED, DONE, FAILED] }
+		counts.update(dict(rows))
+		return counts
+	# end def
+
+	def results(self):
+		'''Yields the (source, format, score, report, error) of finished jobs'''
+		cur = self._db.execute('SELECT source, format, score, report, error FROM jobs '
+			'WHERE state IN (?, ?) ORDER BY source, id', (DONE, FAILED))
+		for row in cur:
+			yield row
+	# end def
+
+	def _expire(self, now):
+		# Leases of dead workers
+		self._db.execute('UPDATE jobs SET state = CASE WHEN attempts < maxtries '
+			'THEN ? ELSE ? END, error = \'Worker \' || worker || \' lost the job\', '
+			'worker = NULL, expires = NULL WHERE state = ? AND expires < ?',
+			(QUEUED, FAILED, LEASED, now))
+	# end def
+
+	def _transaction(self):
+		return _Transaction(self._db)
+	# end def
+# end class
+
+
+
+class _Transaction():
+	'''Write transaction taking the lock upfront, so concurrent workers never
+	lease the same job'''
+	def __init__(self, db):
+		self._db = db
+	# end def
+
+	def __enter__(self):
+		self._db.execute('BEGIN IMMEDIATE')
+	# end def
+
+	def __exit__(self, kind, value, tb):
+		self._db.execute('COMMIT' if kind is None else 'ROLLBACK')
+	# end def
+# end class
+
+
+
+class Worker():
+	'''Evaluates the jobs of a Broker until there are none left (or forever
+	with wait). options are passed as keyword arguments to each Evaluator.
+	Specs are loaded from the cache of parsed specs when speccache is set'''
+	def __init__(self, path=DEFAULT_BROKER, options=None, lease=DEFAULT_LEASE,
+		wait=False, speccache=True, name=None):
+		self._path = path
+		self._options = dict(options or {})
+		self._lease = lease
+		self._wait = wait
+		self._speccache = speccache
+		self._name = name if name else f'{socket.gethostname()}:{os.getpid()}'
+		self._evaluators = {}
+	# end def
+
+	@property
+	def name(self):
+		return self._name
+	# end def
+
+	def run(self):
+		'''Processes jobs. Returns the number of jobs leased'''
+		broker = Broker(self._path)
+		count = 0
+		try:
+			while True:
+				job = broker.lease(self._name, self._lease)
+				if job is None:
+					counts = broker.counts()
+					# Leased jobs may come back if their worker dies
+					if not self._wait and counts[LEASED] == 0 and counts[QUEUED] == 0:
+						break
+					time.sleep(POLL_INTERVAL)
+					continue
+				self._process(broker, job)
+				count+= 1
+		finally:
+			broker.close()
+		return count
+	# end def
+
+	def _process(self, broker, job):
+		print(f'[{self._name}] Evaluating {job} (attempt {job.attempts})')
+		stop = threading.Event()
+		heartbeat = threading.Thread(target=self._heartbeat, args=(job, stop), daemon=True)
+		heartbeat.start()
+		try:
+			score, report = self._evaluate(job)
+		except (Exception, SystemExit) as err:
+			# Errors loading the specs exit (see common.error) once reported
+			reason = 'evaluation aborted' if isinstance(err, SystemExit) else err
+			warn(f'[{self._name}] Failed to evaluate {job}: {reason}')
+			stop.set()
+			heartbeat.join()
+			broker.fail(job, self._name, reason)
+			return
+		stop.set()
+		heartbeat.join()
+		if not broker.complete(job, self._name, score, report):
+			warn(f'[{self._name}] Lease of {job} expired, results discarded')
+	# end def
+
+	def _evaluate(self, job):
+		'''Returns the score of job and the contents of its report'''
+		e = self._evaluator(job)
+		e.evaluate(job.source)
+		name = os.path.splitext(os.path.basename(job.source))[0]
+		workdir = workspace(self._options.get('workspace'))
+		try:
+			report = e.reporter.build(os.path.join(workdir, name + e.reporter.extension))
+			if not report:
+				raise RuntimeError('failed to generate report file')
+			with open(report, 'rb') as f:
+				return e.score, f.read()
+		finally:
+			shutil.rmtree(workdir, ignore_errors=True)
+	# end def
+
+	def _evaluator(self, job):
+		'''Evaluators are reused among jobs of the same specs'''
+		key = (job.specs, job.format)
+		if key not in self._evaluators:
+			specs = specs_from_xml(job.specs, cache=self._speccache)
+			options = dict(self._options)
+			options['reporter'] = reporters.from_format(job.format)
+			self._evaluators[key] = evaluator_from_specs(specs, **options)
+		return self._evaluators[key]
+	# end def
+
+	def _heartbeat(self, job, stop):
+		broker = Broker(self._path)
+		try:
+			while not stop.wait(self._lease / 3):
+				if not broker.renew(job, self._name, self._lease):
+					return
+		finally:
+			broker.close()
+	# end def
+# end class
+
+
+
+def enqueue(path, specs, sources, format='pdf', maxtries=DEFAULT_ATTEMPTS):
+	'''Enqueues the evaluation of each source against specs. Returns the ids'''
+	broker = Broker(path)
+	try:
+		return [ broker.enqueue(specs, src, format, maxtries) for src in sources ]
+	finally:
+		broker.close()
+# end def
+
+
+
+def work(path, options=None, lease=DEFAULT_LEASE, wait=False, speccache=True):
+	'''Runs a Worker, suitable as target of a worker process'''
+	return Worker(path, options, lease, wait, speccache).run()
+# end def
+
+
+
+def collect(path, outdir='.'):
+	'''Writes the reports of finished jobs to outdir. Returns a list of
+	(source, score, report) tuples as batch.evaluate_all does'''
+	os.makedirs(outdir, exist_ok=True)
+	broker = Broker(path)
+	results = []
+	try:
+		for source, format, score, data, error in broker.results():
+			if data is None:
+				warn(f'Failed to evaluate {source}: {error}')
+				results.append( (source, None, None) )
+				continue
+			name = os.path.splitext(os.path.basename(source))[0]
+			report = os.path.join(outdir, name + reporters.from_format(format).extension)
+			with open(report, 'wb') as f:
+				f.write(data)
+			results.append( (source, score, report) )
+	finally:
+		broker.close()
+	return results
+# end def
+
+
+
+def pending(path):
+	'''Returns the number of jobs not finished yet'''
+	broker = Broker(path)
+	try:
+		counts = broker.counts()
+	finally:
+		broker.close()
+	return counts[QUEUED] + counts[LEASED]
+# end def
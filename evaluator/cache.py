@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ## ###############################################################
+# evaluator/cache.py
+#
+# Author:  Mauricio Matamoros
+# License: MIT
+#
+# ## ###############################################################
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from .common import cachedir, toolid, Completed, Usage
+
+DEFAULT_BUILD_CACHE_SIZE = 256 * 1024 * 1024
+DEFAULT_STORE_SIZE = 256 * 1024 * 1024
+PYCACHE_DIR = 'pycache'
+# Stores check their size once this fraction of maxsize was written since
+# the last check (and on their first write)
+EVICT_FRACTION = 16
+
+
+def filedigest(file, algorithm='sha256'):
+	h = hashlib.new(algorithm)
+	with open(file, 'rb') as f:
+		while True:
+			data = f.read(65535)
+			if not data:
+				break
+			h.update(data)
+	return h.hexdigest()
+# end def
+
+
+
+class BuildCache():
+	'''Content-addressed store of built programs.
+	Entries are keyed on the source (and its path for compiled languages),
+	language, build flags and build tool and evicted in least-recently-used order when maxsize is exceeded.'''
+
+	def __init__(self, directory=None, maxsize=DEFAULT_BUILD_CACHE_SIZE):
+		self._dir = directory if directory else cachedir('build')
+		self._maxsize = maxsize
+		os.makedirs(self._dir, exist_ok=True)
+	# end def
+
+	@property
+	def directory(self):
+		return self._dir
+	# end def
+
+	@property
+	def maxsize(self):
+		return self._maxsize
+	# end def
+
+	@property
+	def pycache(self):
+		'''Directory where Python caches the bytecode of the modules imported
+		by the programs (see PYTHONPYCACHEPREFIX)'''
+		return os.path.join(self._dir, PYCACHE_DIR)
+	# end def
+
+	def key(self, srcfile, language, flags, buildtool):
+		if isinstance(flags, (list, tuple)):
+			flags = ' '.join(flags)
+		h = hashlib.sha256()
+		h.update(filedigest(srcfile).encode('utf-8'))
+		# Compilers embed the path of the source in programs (e.g. __FILE__ in
+		# failed assertions), while the bytecode of Python scripts is renamed
+		# after the script running it (see pylaunch.load)
+		if not str(language).startswith('Py'):
+			h.update(b'\0')
+			h.update(os.path.abspath(srcfile).encode('utf-8'))
+		for s in [language, flags, buildtool, toolid(buildtool)]:
+			h.update(b'\0')
+			h.update(str(s).encode('utf-8'))
+		return h.hexdigest()
+	# end def
+
+	def contains(self, key):
+		return os.path.exists(self._path(key))
+	# end def
+
+	def fetch(self, key, outfile=None):
+		'''Copies the program cached under key to outfile.
+		Returns outfile, True for entries with no program, or None on miss'''
+		entry = self._path(key)
+		try:
+			if os.path.getsize(entry) == 0:
+				os.utime(entry)
+				return True
+			shutil.copy2(entry, outfile)
+			os.utime(entry)
+		except (OSError, TypeError):
+			return None
+		return outfile
+	# end def
+
+	def store(self, key, artifact=None):
+		'''Stores a copy of artifact under key. When there is no artifact
+		(e.g. a syntax-checked script) an empty entry records the success'''
+		fd, tmp = tempfile.mkstemp(dir=self._dir, prefix='.tmp')
+		try:
+			if isinstance(artifact, str):
+				with os.fdopen(fd, 'wb') as dst, open(artifact, 'rb') as src:
+					shutil.copyfileobj(src, dst)
+				shutil.copymode(artifact, tmp)
+			else:
+				os.close(fd)
+			os.replace(tmp, self._path(key))
+		except OSError:
+			if os.path.exists(tmp):
+				os.remove(tmp)
+			return
+		self.evict()
+	# end def
+
+	def evict(self):
+		entries = []
+		total = 0
+		for f in os.listdir(self._dir):
+			if f.startswith('.tmp') or f == PYCACHE_DIR:
+				continue
+			try:
+				st = os.stat(os.path.join(self._dir, f))
+			except OSError:
+				continue
+			entries.append( (st.st_mtime, st.st_size, f) )
+			total+= st.st_size
+		entries.sort()
+		while total > self._maxsize and len(entries) > 0:
+			mtime, size, f = entries.pop(0)
+			try:
+				os.remove(os.path.join(self._dir, f))
+			except OSError:
+				pass
+			total-= size
+	# end def
+
+	def _path(self, key):
+		return os.path.join(self._dir, key)
+	# end def
+# end class
+
+
+
+class _JsonStore():
+	'''On-disk store of JSON entries in subdirectories named after the first
+	characters of their keys. As in BuildCache, entries are evicted in
+	least-recently-used order when their size exceeds maxsize'''
+
+	def __init__(self, directory, maxsize=DEFAULT_STORE_SIZE):
+		self._dir = directory
+		self._maxsize = maxsize
+		# Bytes written since the size was checked, None before the first write
+		self._written = None
+		os.makedirs(self._dir, exist_ok=True)
+	# end def
+
+	@property
+	def directory(self):
+		return self._dir
+	# end def
+
+	@property
+	def maxsize(self):
+		return self._maxsize
+	# end def
+
+	def evict(self):
+		self._written = 0
+		entries = []
+		total = 0
+		for d in os.listdir(self._dir):
+			try:
+				files = os.listdir(os.path.join(self._dir, d))
+			except OSError:
+				continue
+			for f in files:
+				if f.startswith('.tmp'):
+					continue
+				try:
+					st = os.stat(os.path.join(self._dir, d, f))
+				except OSError:
+					continue
+				entries.append( (st.st_mtime, st.st_size, os.path.join(d, f)) )
+				total+= st.st_size
+		entries.sort()
+		while total > self._maxsize and len(entries) > 0:
+			mtime, size, f = entries.pop(0)
+			try:
+				os.remove(os.path.join(self._dir, f))
+			except OSError:
+				pass
+			total-= size
+	# end def
+
+	def _read(self, key):
+		'''Returns the entry stored under key, marking it as recently used.
+		Raises OSError or ValueError on miss'''
+		path = self._path(key)
+		with open(path, 'r', encoding='utf-8') as f:
+			r = json.load(f)
+		os.utime(path)
+		return r
+	# end def
+
+	def _write(self, key, r):
+		path = self._path(key)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+		try:
+			with os.fdopen(fd, 'w', encoding='utf-8') as f:
+				json.dump(r, f)
+				size = f.tell()
+			os.replace(tmp, path)
+		except (OSError, TypeError, ValueError):
+			if os.path.exists(tmp):
+				os.remove(tmp)
+			return
+		if self._written is None or self._written + size > self._maxsize // EVICT_FRACTION:
+			self.evict()
+		else:
+			self._written+= size
+	# end def
+
+	def _path(self, key):
+		return os.path.join(self._dir, key[:2], f'{key}.json')
+	# end def
+# end class
+
+
+
+class ResultStore(_JsonStore):
+	'''On-disk store of testrun outcomes keyed by the digest of the program
+	under test and the canonical hash of the testrun (see TestRun.key).
+	Timeouts are not stored, they depend on the load of the machine'''
+
+	def __init__(self, directory=None, maxsize=DEFAULT_STORE_SIZE):
+		super().__init__(directory if directory else cachedir('results'), maxsize)
+	# end def
+
+	@staticmethod
+	def key(progdigest, testrun, limits=None):
+		s = f'{progdigest}\0{testrun.key}\0{json.dumps(limits or {}, sort_keys=True)}'
+		return hashlib.sha256(s.encode('utf-8')).hexdigest()
+	# end def
+
+	def fetch(self, key):
+		'''Returns the stored (stdout, stderr, process) triplet, or None on miss'''
+		try:
+			r = self._read(key)
+		except (OSError, ValueError):
+			return None
+		if r.get('timeout'):
+			# Stored by older versions
+			return None
+		return r['stdout'], r['stderr'], Completed(r['returncode'], r.get('verdict'),
+			usage=Usage.fromdict(r.get('usage')))
+	# end def
+
+	def store(self, key, stdout, stderr, proc):
+		'''Stores the outcome of a testrun, unless it timed out (proc is None)'''
+		if proc is None:
+			return
+		r = {
+			'stdout'     : stdout,
+			'stderr'     : stderr,
+			'returncode' : proc.returncode,
+			'verdict'    : proc.verdict,
+			'usage'      : proc.usage.todict() if proc.usage else None,
+		}
+		self._write(key, r)
+	# end def
+# end class
+
+
+
+class ReportIndex(_JsonStore):
+	'''On-disk index of evaluations keyed by the digest of the source and of
+	the specs and settings it was evaluated with (see Evaluator), holding
+	the score, resource usage and report events (see reporters.Recorder)
+	so identical submissions are reported without evaluating them again'''
+
+	def __init__(self, directory=None, maxsize=DEFAULT_STORE_SIZE):
+		super().__init__(directory if directory else cachedir('reports'), maxsize)
+	# end def
+
+	@staticmethod
+	def key(srcdigest, specsdigest, settings=None):
+		s = f'{srcdigest}\0{specsdigest}\0{json.dumps(settings or {}, sort_keys=True)}'
+		return hashlib.sha256(s.encode('utf-8')).hexdigest()
+	# end def
+
+	def fetch(self, key):
+		'''Returns the stored (score, usage, events) triplet, or None on miss'''
+		try:
+			r = self._read(key)
+		except (OSError, ValueError):
+			return None
+		return r['score'], Usage.fromdict(r['usage']), r['events']
+	# end def
+
+	def store(self, key, score, usage, events):
+		r = {
+			'score'  : score,
+			'usage'  : usage.todict() if usage else None,
+			'events' : events,
+		}
+		self._write(key, r)
+	# end def
+# end class
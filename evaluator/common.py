@@ -11,8 +11,21 @@
 import os
 import re
 import sys
+import math
+import time
+import signal
+import shutil
+import codecs
+import hashlib
+import asyncio
+import tempfile
+import select
+import selectors
 import subprocess as sp
-import py_compile as pyc
+try:
+	import resource
+except ImportError:
+	resource = None
 
 def error(s):
 	eprint(s)
@@ -42,16 +55,90 @@ def delete(file):
 
 
 
+def parsesize(s):
+	'''Parses a size in bytes with an optional K, M or G suffix (e.g. 16M)'''
+	s = str(s).strip().upper()
+	if s.endswith('B'):
+		s = s[:-1]
+	mult = { 'K': 1024, 'M': 1024**2, 'G': 1024**3 }.get(s[-1:], 1)
+	if mult > 1:
+		s = s[:-1]
+	return int(float(s) * mult)
+# end def
+
+
+
 def pyver():
 	return int(sys.version_info[0]) + 0.1 * int(sys.version_info[1])
 # end def
 
 
 
+# RAM-backed filesystems where workspaces are preferably created
+RAMDIRS = ['/dev/shm']
+
+def workspace(root=None):
+	'''Creates a private directory for the files of an evaluation (programs,
+	reports and other temporaries) under root, by default on a RAM-backed
+	filesystem when available. Remove it with shutil.rmtree when done'''
+	return tempfile.mkdtemp(prefix='progeval-', dir=root if root else _ramdir())
+# end def
+
+
+
+def _ramdir():
+	for d in RAMDIRS:
+		try:
+			# Built programs must be executable from there
+			if os.access(d, os.W_OK | os.X_OK) and \
+				not os.statvfs(d).f_flag & getattr(os, 'ST_NOEXEC', 0):
+				return d
+		except OSError:
+			continue
+	return None
+# end def
+
+
+
+def cachedir(*subdirs):
+	'''Path of the cache directory of progeval (or a subdirectory of it)'''
+	root = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+	return os.path.join(root, 'progeval', *subdirs)
+# end def
+
+
+
+__toolids = {}
+def toolid(tool):
+	'''Identifies an external tool by its path, modification time and version
+	string so that cached outputs can be invalidated when the tool changes'''
+	if tool in __toolids:
+		return __toolids[tool]
+	path = shutil.which(tool)
+	if not path:
+		return None
+	try:
+		cp = sp.run([path, '--version'], stdout=sp.PIPE, stderr=sp.STDOUT, timeout=5)
+		version = cp.stdout.decode('utf-8', errors='replace').strip().split('\n')[0]
+	except Exception:
+		version = ''
+	__toolids[tool] = f'{path}:{os.path.getmtime(path)}:{version}'
+	return __toolids[tool]
+# end def
+
+
+
+def outname(srcfile):
+	'''Default name of the program built from srcfile'''
+	dot = srcfile.rfind('.')
+	return srcfile[:dot]
+# end def
+
+
+
 def cbuild(buildtool, srcfile, flags=[], outfile=None):
 	if not outfile:
-		dot = srcfile.rfind('.')
-		outfile = srcfile[:dot]
+		outfile = outname(srcfile)
 	if isinstance(flags, str):
 		flags = re.split(r'\s+', flags)
 	args = [buildtool]
@@ -69,13 +156,16 @@ def cbuild(buildtool, srcfile, flags=[], outfile=None):
 
 
 
-def cppbuild(buildtool, srcfile, flags=[], outfile=None):
+def cppbuild(buildtool, srcfile, flags=[], outfile=None, pchdir=None):
+	'''Builds srcfile, using the precompiled headers in pchdir if given (see
+	pchdir)'''
 	if not outfile:
-		dot = srcfile.rfind('.')
-		outfile = srcfile[:dot]
+		outfile = outname(srcfile)
 	if isinstance(flags, str):
 		flags = re.split(r'\s+', flags)
 	args = [buildtool]
+	if pchdir:
+		args.extend(['-I', pchdir])
 	args.extend([srcfile, '-x', 'c++', '-o', outfile])
 	args.extend(flags)
 	if pyver() > 3.6:
@@ -90,43 +180,640 @@ def cppbuild(buildtool, srcfile, flags=[], outfile=None):
 
 
 
+# Headers precompiled for C++ programs (see pchdir)
+PCH_HEADERS = ['bits/stdc++.h']
+
+__pchdirs = {}
+def pchdir(buildtool, flags=[]):
+	'''Directory holding PCH_HEADERS precompiled by buildtool with flags, which
+	g++ picks instead of the headers when passed with -I (see cppbuild).
+	Headers are precompiled once per build tool and flags and kept in the
+	cache directory. Returns None if they could not be precompiled'''
+	if isinstance(flags, str):
+		flags = re.split(r'\s+', flags)
+	flags = [ f for f in flags if f ]
+	key = hashlib.sha256('\0'.join([str(toolid(buildtool))] + flags).encode('utf-8')).hexdigest()
+	if key in __pchdirs:
+		return __pchdirs[key]
+
+	directory = cachedir('pch', key[:16])
+	__pchdirs[key] = directory
+	for header in PCH_HEADERS:
+		pchfile = os.path.join(directory, f'{header}.gch')
+		if os.path.exists(pchfile):
+			continue
+		os.makedirs(os.path.dirname(pchfile), exist_ok=True)
+		tmpdir = tempfile.mkdtemp(dir=directory, prefix='.tmp')
+		try:
+			wrapper = os.path.join(tmpdir, 'pch.h')
+			with open(wrapper, 'w', encoding='utf-8') as f:
+				f.write(f'#include <{header}>\n')
+			tmpfile = os.path.join(tmpdir, 'pch.h.gch')
+			cp = sp.run([buildtool, '-c', '-x', 'c++-header', wrapper, '-o', tmpfile] + flags,
+				stdout=sp.PIPE, stderr=sp.PIPE)
+			if cp.returncode != 0:
+				__pchdirs[key] = None
+				return None
+			os.replace(tmpfile, pchfile)
+		except OSError:
+			__pchdirs[key] = None
+			return None
+		finally:
+			shutil.rmtree(tmpdir, ignore_errors=True)
+	return directory
+# end def
+
+
+
+PYLAUNCHER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pylaunch.py')
+
 def pybuild(buildtool, srcfile, flags=[], outfile=None):
+	'''Compiles srcfile into bytecode for the interpreter buildtool, to be
+	run with PYLAUNCHER'''
 	if not outfile:
-		dot = srcfile.rfind('.')
-		outfile = srcfile[:dot]
+		outfile = outname(srcfile)
 
 	print(f'PyCompile: {srcfile} -> {outfile}')
-	try:
-		of = pyc.compile(srcfile, doraise=True, quiet=1)
-		os.rename(of, outfile)
-	except Exception as e:
-		import traceback
-		traceback.print_exc()
-		return False
-	finally:
+	# Bytecode is specific to the version of the interpreter
+	code = 'import sys, py_compile; py_compile.compile(sys.argv[1], sys.argv[2], doraise=True)'
+	cp = sp.run([buildtool, '-c', code, srcfile, outfile], stdout=sp.PIPE, stderr=sp.PIPE)
+	if cp.returncode != 0:
+		eprint(cp.stderr.decode('utf-8', errors='replace').strip())
 		delete(outfile)
-	return True
+		return None
+	return outfile
 # end def
 
 
 
-def execute(exefile, args=[], timeout=15, addpath=True):
+class Completed():
+	'''Outcome of a finished process. verdict is set to one of the LIMIT_*
+	constants when the process was killed for exceeding a limit, and rejected
+	to the stream ('cout' or 'cerr') whose early check killed the process.
+	usage holds the resources used by the process (see Usage)'''
+	def __init__(self, returncode, verdict=None, rejected=None, usage=None):
+		self.returncode = returncode
+		self.verdict = verdict
+		self.rejected = rejected
+		self.usage = usage
+	# end def
+# end class
+
+
+
+class Measured(Completed):
+	'''Outcome of a testrun executed repeatedly to time it. cputime is the
+	statistic of the CPU times of its timed runs and maxtime the largest
+	one accepted, if any. usage adds up all the runs'''
+	def __init__(self, returncode, usage, cputime, statistic, runs, maxtime=None):
+		super().__init__(returncode, usage=usage)
+		self.cputime = cputime
+		self.statistic = statistic
+		self.runs = runs
+		self.maxtime = maxtime
+	# end def
+# end class
+
+
+
+class Usage():
+	'''Resources used by one or more processes: wall-clock, user and system
+	time in seconds and peak resident set size in bytes. On Linux the peak
+	size of a process includes that of the process it was forked from before
+	exec, hence evaluations start programs from a forkserver.Spawner'''
+	def __init__(self, walltime=0, utime=0, stime=0, maxrss=0):
+		self.walltime = walltime
+		self.utime = utime
+		self.stime = stime
+		self.maxrss = maxrss
+	# end def
+
+	@property
+	def cputime(self):
+		return self.utime + self.stime
+	# end def
+
+	def todict(self):
+		return {
+			'walltime' : self.walltime,
+			'utime'    : self.utime,
+			'stime'    : self.stime,
+			'maxrss'   : self.maxrss,
+		}
+	# end def
+
+	def __str__(self):
+		return '{:0.3f} s wall, {:0.3f} s CPU ({:0.3f} s user, {:0.3f} s system), {:0.1f} MiB peak memory'.format(
+			self.walltime, self.cputime, self.utime, self.stime, self.maxrss / 1024**2)
+	# end def
+
+	@staticmethod
+	def fromdict(d):
+		return Usage(**d) if d else None
+	# end def
+
+	@staticmethod
+	def fromrusage(walltime, ru):
+		if ru is None:
+			return Usage(walltime)
+		# ru_maxrss is given in kilobytes except on macOS
+		maxrss = ru.ru_maxrss if sys.platform == 'darwin' else ru.ru_maxrss * 1024
+		return Usage(walltime, ru.ru_utime, ru.ru_stime, maxrss)
+	# end def
+
+	@staticmethod
+	def total(usages):
+		'''Adds up the times of the given usages, keeping the largest peak memory'''
+		t = Usage()
+		for u in usages:
+			t.walltime+= u.walltime
+			t.utime+= u.utime
+			t.stime+= u.stime
+			t.maxrss = max(t.maxrss, u.maxrss)
+		return t
+	# end def
+# end class
+
+
+
+LIMIT_OUTPUT    = 'output'
+LIMIT_CPU       = 'cpu'
+LIMIT_MEMORY    = 'memory'
+LIMIT_PROCESSES = 'processes'
+LIMIT_FILESIZE  = 'filesize'
+
+DEFAULT_OUTPUT_LIMIT = 16 * 1024 * 1024
+
+CANCEL_POLL_INTERVAL = 0.05
+SPILL_THRESHOLD = 1024 * 1024
+READ_SIZE = 65536
+
+# Signals of programs failing to handle a failed allocation (e.g. an
+# uncaught std::bad_alloc or a dereferenced NULL)
+MEMORY_SIGNALS = [signal.SIGSEGV, signal.SIGABRT, signal.SIGBUS, signal.SIGKILL]
+# Share of the memory limit a program must have used for its failure to
+# be blamed on the limit
+MEMORY_VERDICT_RATIO = 0.5
+
+def execute(exefile, args=[], timeout=15, addpath=True, cancel=None, env=None,
+	maxout=None, maxerr=None, checkout=None, checkerr=None, rlimits=None):
+	'''Executes exefile with the given args and returns the decoded stdout and
+	stderr along with a Completed object, or a triplet of None on timeout.
+	Output is captured incrementally (spilling to disk past SPILL_THRESHOLD)
+	and the process is killed as soon as stdout exceeds maxout bytes or stderr
+	exceeds maxerr bytes, yielding the output read so far and LIMIT_OUTPUT.
+	checkout and checkerr are early checks (see vfuncs.EarlyCheck) fed with
+	the output as it is read; the process is killed once one rejects it.
+	rlimits maps LIMIT_CPU (seconds), LIMIT_MEMORY (bytes of address space),
+	LIMIT_PROCESSES and LIMIT_FILESIZE (bytes) to the limits applied to the
+	process (see _popen); the verdict tells which one made it fail, as far
+	as the way the process ended tells (see _rlimitverdict)'''
 	eargs = [os.path.abspath(exefile)] if addpath else [exefile]
 	eargs.extend([str(a) for a in args])
-	proc = sp.Popen(eargs, stdout=sp.PIPE, stderr=sp.PIPE)
+	start = time.monotonic()
+	proc = _popen(eargs, env, rlimits)
+	return collect(proc, start, timeout, cancel, maxout, maxerr, checkout, checkerr, rlimits)
+# end def
+
+
+
+def collect(proc, start, timeout=15, cancel=None, maxout=None, maxerr=None,
+	checkout=None, checkerr=None, rlimits=None):
+	'''Captures the output of proc, started at start (a time.monotonic value),
+	and waits for it to finish as execute does. proc is an sp.Popen or an
+	object alike whose process is waited for by its wait4 method instead of
+	os.wait4 (see forkserver.ForkedProcess)'''
+	cout = _Capture(maxout, checkout)
+	cerr = _Capture(maxerr, checkerr)
 	try:
-		out, err = proc.communicate(timeout=timeout)
-		out = out.decode("utf-8")
-		err = err.decode("utf-8")
+		ru = _communicate(proc, timeout, cancel, cout, cerr)
+		usage = Usage.fromrusage(time.monotonic() - start, ru)
+		out, err = _decode(cout, cerr)
 	except sp.TimeoutExpired:
 		# log.warning("Timeout! Process didn't finish within {:.2f} seconds".format(float(timeout)))
-		proc.kill()
-		out, err = proc.communicate(timeout=timeout)
+		_kill(proc)
 		return None, None, None
+	finally:
+		cout.close()
+		cerr.close()
+	return out, err, _completed(proc, cout, cerr, rlimits, usage)
+# end def
+
+
+
+async def execute_async(exefile, args=[], timeout=15, addpath=True, env=None,
+	maxout=None, maxerr=None, checkout=None, checkerr=None, rlimits=None):
+	eargs = [os.path.abspath(exefile)] if addpath else [exefile]
+	eargs.extend([str(a) for a in args])
+	start = time.monotonic()
+	proc = _popen(eargs, env, rlimits)
+	return await collect_async(proc, start, timeout, maxout, maxerr, checkout, checkerr, rlimits)
+# end def
+
+
+
+async def collect_async(proc, start, timeout=15, maxout=None, maxerr=None,
+	checkout=None, checkerr=None, rlimits=None):
+	'''Coroutine counterpart of collect'''
+	# The process is reaped with wait4 (see _reap_async) rather than by
+	# the child watcher of asyncio, which discards its resource usage
+	cout = _Capture(maxout, checkout)
+	cerr = _Capture(maxerr, checkerr)
+	reaper = asyncio.ensure_future(_reap_async(proc))
+	tasks = [
+		asyncio.ensure_future(_pump_async(proc, proc.stdout, cout)),
+		asyncio.ensure_future(_pump_async(proc, proc.stderr, cerr)),
+		reaper,
+	]
+	try:
+		try:
+			done, pending = await asyncio.wait(tasks, timeout=timeout)
+		except asyncio.CancelledError:
+			await _kill_async(proc, tasks)
+			raise
+		if len(pending) > 0:
+			await _kill_async(proc, tasks)
+			return None, None, None
+		usage = Usage.fromrusage(time.monotonic() - start, reaper.result())
+		out, err = _decode(cout, cerr)
+	finally:
+		cout.close()
+		cerr.close()
+	return out, err, _completed(proc, cout, cerr, rlimits, usage)
+# end def
+
+
+
+async def _pump_async(proc, pipe, capture):
+	# Keeps draining the pipe after the limit is exceeded (or the output
+	# rejected) and the process killed, so the pipe reaches EOF and the process can be waited for
+	loop = asyncio.get_event_loop()
+	stream = asyncio.StreamReader(limit=READ_SIZE)
+	transport, protocol = await loop.connect_read_pipe(
+		lambda: asyncio.StreamReaderProtocol(stream), pipe)
+	try:
+		while True:
+			data = await stream.read(READ_SIZE)
+			if not data:
+				return
+			if not capture.write(data):
+				try:
+					proc.kill()
+				except ProcessLookupError:
+					pass
+	finally:
+		transport.close()
+# end def
+
+
+
+KILL_GRACE_PERIOD = 1
+
+async def _kill_async(proc, tasks):
+	try:
+		proc.kill()
+	except ProcessLookupError:
+		pass
+	done, pending = await asyncio.wait(tasks, timeout=KILL_GRACE_PERIOD)
+	for t in pending:
+		t.cancel()
+# end def
+
+
+
+def _completed(proc, cout, cerr, rlimits, usage):
+	verdict = LIMIT_OUTPUT if cout.exceeded or cerr.exceeded else None
+	rejected = 'cout' if cout.rejected else 'cerr' if cerr.rejected else None
+	if not verdict and not rejected:
+		verdict = _rlimitverdict(proc.returncode, usage, rlimits)
+	return Completed(proc.returncode, verdict, rejected, usage)
+# end def
+
+
+
+def _popen(eargs, env, rlimits):
+	'''Starts eargs with its output piped and the given resource limits,
+	applied in the child before exec: applied afterwards (e.g. with prlimit)
+	they could miss what the program does first. preexec_fn is not safe
+	along with threads (e.g. parallel testruns), hence evaluations start
+	programs from a forkserver.Spawner, which applies the limits itself'''
+	return sp.Popen(eargs, stdout=sp.PIPE, stderr=sp.PIPE, env=env,
+		preexec_fn=_preexec(rlimits))
+# end def
+
+
+
+def _preexec(rlimits):
+	'''Returns a function applying the given resource limits in the child
+	process before exec, or None if there are no limits to apply'''
+	setlimits = resourcelimits(rlimits)
+	if len(setlimits) < 1:
+		return None
+
+	def preexec():
+		for rlimit, values in setlimits:
+			resource.setrlimit(rlimit, values)
+	return preexec
+# end def
+
+
+
+def resourcelimits(rlimits):
+	'''Translates the given resource limits (see execute) into a list of
+	(resource, (soft, hard)) arguments of resource.setrlimit'''
+	if not rlimits or not resource:
+		return []
+	cpu = rlimits.get(LIMIT_CPU)
+	processes = rlimits.get(LIMIT_PROCESSES)
+	if processes is not None:
+		# RLIMIT_NPROC counts all the processes (threads too) of the user, as
+		# the evaluator itself and concurrent testruns, which are added up
+		processes+= userprocesses()
+	limits = [
+		# SIGXCPU is sent at the soft limit and SIGKILL a second later
+		(resource.RLIMIT_CPU, math.ceil(cpu) if cpu else None, 1),
+		(resource.RLIMIT_AS, rlimits.get(LIMIT_MEMORY), 0),
+		(resource.RLIMIT_NPROC, processes, 0),
+		(resource.RLIMIT_FSIZE, rlimits.get(LIMIT_FILESIZE), 0),
+	]
+	setlimits = []
+	for rlimit, value, grace in limits:
+		if value is None:
+			continue
+		# Limits cannot be raised past the hard limit of the evaluator
+		hard = resource.getrlimit(rlimit)[1]
+		if hard != resource.RLIM_INFINITY:
+			value = min(value, hard - grace)
+			hard = min(value + grace, hard)
+		else:
+			hard = value + grace
+		setlimits.append( (rlimit, (int(value), int(hard))) )
+	return setlimits
+# end def
+
+
+
+def userprocesses():
+	'''Number of processes and threads of the real user of the evaluator,
+	as counted by RLIMIT_NPROC. 0 where /proc is not available'''
+	uid = os.getuid()
+	count = 0
+	try:
+		pids = [ p for p in os.listdir('/proc') if p.isdigit() ]
+	except OSError:
+		return 0
+	for pid in pids:
+		try:
+			if os.stat(f'/proc/{pid}').st_uid == uid:
+				count+= len(os.listdir(f'/proc/{pid}/task'))
+		except OSError:
+			# Finished meanwhile
+			pass
+	return count
+# end def
+
+
+
+def _rlimitverdict(returncode, usage, rlimits):
+	'''Infers the resource limit that made a process fail, if any, from the
+	signal that killed it and its resource usage (see Usage). Only processes
+	killed by a signal are blamed: programs may handle exhausted limits
+	(e.g. a failed fork) and are then judged by their output'''
+	if not rlimits or returncode is None or returncode >= 0:
+		return None
+	signum = -returncode
+	cpu = rlimits.get(LIMIT_CPU)
+	# SIGKILL follows SIGXCPU at the hard limit when it is ignored
+	if cpu and (signum == signal.SIGXCPU or
+		signum == signal.SIGKILL and usage and usage.cputime >= cpu):
+		return LIMIT_CPU
+	if rlimits.get(LIMIT_FILESIZE) and signum == signal.SIGXFSZ:
+		return LIMIT_FILESIZE
+	memory = rlimits.get(LIMIT_MEMORY)
+	if memory and signum in MEMORY_SIGNALS and usage and \
+		usage.maxrss >= MEMORY_VERDICT_RATIO * memory:
+		return LIMIT_MEMORY
+	return None
+# end def
+
+
+
+def _kill(proc):
+	try:
+		proc.kill()
+	except ProcessLookupError:
+		pass
+	proc.stdout.close()
+	proc.stderr.close()
+	return _reap(proc)
+# end def
+
+
+
+def _reap(proc, deadline=None, cancel=None):
+	'''Waits for proc to finish and returns its resource usage as given by
+	os.wait4. Raises TimeoutExpired once deadline (a time.monotonic value)
+	is reached or the cancel event is set'''
+	wait = deadline is None and cancel is None
+	delay = 0.0005
+	try:
+		while True:
+			pid, status, ru = _wait4(proc, 0 if wait else os.WNOHANG)
+			if pid != 0:
+				break
+			remaining = CANCEL_POLL_INTERVAL
+			if deadline is not None:
+				remaining = min(deadline - time.monotonic(), remaining)
+			if remaining <= 0 or (cancel and cancel.is_set()):
+				raise sp.TimeoutExpired(proc.args, 0)
+			delay = min(2 * delay, remaining)
+			_pause(proc, delay)
+	except ChildProcessError:
+		# Already reaped elsewhere, its usage is lost
+		proc.wait()
+		return None
+	_setreturncode(proc, status)
+	return ru
+# end def
+
+
+
+def _pause(proc, delay):
+	'''Sleeps for delay seconds, or until proc has news to read if it can
+	be selected (see forkserver.ForkedProcess)'''
+	if hasattr(proc, 'fileno') and proc.fileno() >= 0:
+		select.select([proc], [], [], delay)
+	else:
+		time.sleep(delay)
+# end def
+
+
+
+async def _reap_async(proc):
+	'''Coroutine counterpart of _reap. The loop is woken up when the process
+	exits by a descriptor readable then (see _exitfd), so no thread is
+	blocked waiting for each running process. Without one, the process is
+	polled with WNOHANG'''
+	fd, owned = _exitfd(proc)
+	delay = 0.0005
+	try:
+		while True:
+			pid, status, ru = _wait4(proc, os.WNOHANG)
+			if pid != 0:
+				break
+			if fd is not None:
+				await _readable(fd)
+				continue
+			await asyncio.sleep(delay)
+			delay = min(2 * delay, CANCEL_POLL_INTERVAL)
+	except ChildProcessError:
+		proc.wait()
+		return None
+	finally:
+		if owned:
+			os.close(fd)
+	_setreturncode(proc, status)
+	return ru
+# end def
+
+
+
+def _exitfd(proc):
+	'''Returns a descriptor readable once proc exits, or None, and whether it
+	was opened for the call: a pidfd (Linux 5.3 and Python 3.9 onwards) or
+	the connection of a child of a fork server, which tells when it exits'''
+	if hasattr(proc, 'wait4'):
+		return proc.fileno(), False
+	if hasattr(os, 'pidfd_open'):
+		try:
+			return os.pidfd_open(proc.pid), True
+		except OSError:
+			# Older kernel, or the process was reaped already
+			pass
+	return None, False
+# end def
+
+
+
+async def _readable(fd):
+	loop = asyncio.get_event_loop()
+	ready = loop.create_future()
+	loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+	try:
+		await ready
+	finally:
+		loop.remove_reader(fd)
+# end def
+
+
+
+def _setreturncode(proc, status):
+	if os.WIFSIGNALED(status):
+		proc.returncode = -os.WTERMSIG(status)
+	else:
+		proc.returncode = os.WEXITSTATUS(status)
+# end def
+
+
+
+def _wait4(proc, options):
+	# Processes not started by the evaluator are waited for by their parent
+	if hasattr(proc, 'wait4'):
+		return proc.wait4(options)
+	return os.wait4(proc.pid, options)
+# end def
+
+
+
+def _communicate(proc, timeout, cancel, cout, cerr):
+	'''Pumps the output of proc into the cout and cerr captures until the
+	process exits, killing it as soon as a capture is full or rejects the
+	output. Raises TimeoutExpired on timeout or once the cancel event (a
+	threading.Event) is set. Returns the resource usage of the process'''
+	captures = { proc.stdout: cout, proc.stderr: cerr }
+	deadline = time.monotonic() + timeout
+	with selectors.DefaultSelector() as sel:
+		for f in captures:
+			sel.register(f, selectors.EVENT_READ)
+		while len(sel.get_map()) > 0:
+			remaining = deadline - time.monotonic()
+			if remaining <= 0 or (cancel and cancel.is_set()):
+				raise sp.TimeoutExpired(proc.args, timeout)
+			if cancel:
+				remaining = min(remaining, CANCEL_POLL_INTERVAL)
+			for key, events in sel.select(remaining):
+				data = os.read(key.fd, READ_SIZE)
+				if not data:
+					sel.unregister(key.fileobj)
+				elif not captures[key.fileobj].write(data):
+					return _kill(proc)
+
+	# Output streams are closed but the process may still be running
+	ru = _reap(proc, deadline, cancel)
+	proc.stdout.close()
+	proc.stderr.close()
+	return ru
+# end def
+
+
+
+def _decode(cout, cerr):
+	try:
+		return cout.value.decode("utf-8"), cerr.value.decode("utf-8")
 	except:
-		out = None
-		err = None
-	return out, err, proc
-	# if retcode is not None and proc.returncode != retcode:
-	# 	return False
+		return None, None
 # end def
+
+
+
+class _Capture():
+	'''Bounded buffer of the output of a process. Data is kept in memory up to
+	SPILL_THRESHOLD bytes and in a temporary file beyond. Writes past limit
+	bytes are truncated and rejected, as well as writes making the early
+	check (if any) reject the output'''
+	def __init__(self, limit=None, check=None):
+		self._limit = limit
+		self._size = 0
+		self._exceeded = False
+		self._check = check
+		self._rejected = False
+		self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+		self._file = tempfile.SpooledTemporaryFile(max_size=SPILL_THRESHOLD)
+	# end def
+
+	@property
+	def exceeded(self):
+		return self._exceeded
+	# end def
+
+	@property
+	def rejected(self):
+		return self._rejected
+	# end def
+
+	@property
+	def value(self):
+		self._file.seek(0)
+		return self._file.read()
+	# end def
+
+	def write(self, data):
+		'''Appends data to the buffer. Returns False if limit was exceeded'''
+		if self._limit is not None and self._size + len(data) > self._limit:
+			data = data[:self._limit - self._size]
+			self._file.write(data)
+			self._size+= len(data)
+			self._exceeded = True
+			return False
+		self._file.write(data)
+		self._size+= len(data)
+		if self._check and not self._rejected:
+			self._rejected = not self._check.feed(self._decoder.decode(data))
+			return not self._rejected
+		return True
+	# end def
+
+	def close(self):
+		self._file.close()
+	# end def
+# end class
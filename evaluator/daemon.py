@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ## ###############################################################
+# evaluator/daemon.py
+#
+# Author:  Mauricio Matamoros
+# License: MIT
+#
+# ## ###############################################################
+
+import os
+import json
+import signal
+import socket
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from .common import warn
+from .specs import from_xml as specs_from_xml
+from .evaluator import from_specs as evaluator_from_specs
+from . import reporters
+from . import pdflog
+
+DEFAULT_SOCKET = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or '/tmp',
+	f'progeval-{os.getuid()}.sock')
+
+# Parsed specs and evaluators of each worker process of the daemon
+__specs = {}
+__evaluators = {}
+__options = None
+__speccache = True
+
+
+class Daemon():
+	'''Evaluates the requests received on a unix socket in a pool of up to
+	jobs worker processes, which keep the parsed specs (reloaded when their
+	XML file changes), evaluators and report tooling between requests.
+	options are passed as keyword arguments to each Evaluator.
+	A request is one JSON line with the specs, source, format, output and
+	working directory of the evaluation (see submit); the response is one
+	JSON line with its score and report, or the error.'''
+	def __init__(self, path=DEFAULT_SOCKET, jobs=None, options=None, speccache=True):
+		self._path = path
+		self._jobs = jobs
+		self._options = options
+		self._speccache = speccache
+		self._pool = None
+	# end def
+
+	@property
+	def path(self):
+		return self._path
+	# end def
+
+	def serve(self):
+		'''Serves requests until interrupted (SIGINT or SIGTERM)'''
+		self._pool = self._newpool()
+		# Workers are started (and warmed up) before the first request
+		self._pool.submit(int).result()
+		try:
+			asyncio.run(self._serve())
+		finally:
+			self._pool.shutdown()
+			if os.path.exists(self._path):
+				os.remove(self._path)
+	# end def
+
+	def _newpool(self):
+		options = dict(self._options or {})
+		options['workers'] = self._jobs or os.cpu_count()
+		return ProcessPoolExecutor(max_workers=self._jobs,
+			initializer=_init_worker, initargs=(options, self._speccache))
+	# end def
+
+	async def _run(self, request):
+		'''Evaluates request in the pool. If a worker dies (e.g. killed by the
+		OOM killer) the pool is unusable; it is replaced and the request
+		retried once'''
+		loop = asyncio.get_running_loop()
+		for attempt in range(2):
+			pool = self._pool
+			try:
+				return await loop.run_in_executor(pool, _evaluate, request)
+			except BrokenProcessPool:
+				if attempt > 0:
+					raise
+				# Concurrent requests may have replaced it already
+				if self._pool is pool:
+					warn('A worker of the daemon died, restarting the pool')
+					pool.shutdown(wait=False)
+					self._pool = self._newpool()
+	# end def
+
+	async def _serve(self):
+		if os.path.exists(self._path):
+			if _alive(self._path):
+				raise OSError(f'Another daemon is listening on {self._path}')
+			os.remove(self._path)
+		# The socket is created private, no other user may connect meanwhile
+		umask = os.umask(0o077)
+		try:
+			server = await asyncio.start_unix_server(self._handle, path=self._path)
+		finally:
+			os.umask(umask)
+		print(f'Listening on {self._path}', flush=True)
+		stop = asyncio.Event()
+		loop = asyncio.get_running_loop()
+		for signum in [signal.SIGINT, signal.SIGTERM]:
+			loop.add_signal_handler(signum, stop.set)
+		async with server:
+			await stop.wait()
+	# end def
+
+	async def _handle(self, reader, writer):
+		try:
+			request = json.loads(await reader.readline())
+			response = await self._run(request)
+		except (ValueError, TypeError) as err:
+			response = { 'error': f'Malformed request: {err}' }
+		except Exception as err:
+			response = { 'error': str(err) }
+		try:
+			writer.write(json.dumps(response).encode('utf-8') + b'\n')
+			await writer.drain()
+			writer.close()
+		except OSError:
+			pass
+	# end def
+# end class
+
+
+
+def submit(specs, source, format='pdf', output=None, path=DEFAULT_SOCKET):
+	'''Asks the daemon listening at path to evaluate source against specs.
+	Relative paths are resolved, and programs run, in the current directory.
+	Returns the (score, report) of the evaluation; raises OSError when the
+	daemon is unreachable and RuntimeError when the evaluation failed'''
+	request = {
+		'specs'  : os.path.abspath(specs),
+		'source' : os.path.abspath(source),
+		'format' : format,
+		'output' : os.path.abspath(output) if output else None,
+		'cwd'    : os.getcwd(),
+	}
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+		s.connect(path)
+		s.sendall(json.dumps(request).encode('utf-8') + b'\n')
+		with s.makefile('rb') as f:
+			line = f.readline()
+	if not line:
+		raise RuntimeError('The daemon closed the connection')
+	response = json.loads(line)
+	if response.get('error'):
+		raise RuntimeError(response['error'])
+	return response['score'], response['report']
+# end def
+
+
+
+def _alive(path):
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+		try:
+			s.connect(path)
+		except OSError:
+			return False
+	return True
+# end def
+
+
+
+def _init_worker(options, speccache):
+	global __options, __speccache
+	__options = options or {}
+	__speccache = speccache
+	pdflog.warmup()
+# end def
+
+
+
+def _evaluate(request):
+	'''Evaluates a request in a worker process'''
+	try:
+		os.chdir(request['cwd'])
+		e = _evaluator(request['specs'], request['format'])
+		e.evaluate(request['source'])
+		output = request['output']
+		if not output and request['format'] != 'pdf':
+			output = os.path.splitext(os.path.basename(request['source']))[0] + e.reporter.extension
+		report = e.reporter.build(output)
+	except SystemExit:
+		# Errors loading the specs are reported (see common.error) and exit
+		return { 'error': f'Failed to evaluate {request["source"]}' }
+	except Exception as err:
+		warn(f'Failed to evaluate {request["source"]}: {err}')
+		return { 'error': str(err) }
+	if not report:
+		return { 'error': 'Failed to generate report file.' }
+	return { 'score': e.score, 'report': os.path.abspath(report) }
+# end def
+
+
+
+def _evaluator(file, format):
+	'''Evaluator of the specs in file, reused until the file changes'''
+	st = os.stat(file)
+	stamp = (st.st_mtime_ns, st.st_size)
+	if file not in __specs or __specs[file][0] != stamp:
+		__specs[file] = (stamp, specs_from_xml(file, cache=__speccache))
+		for key in [k for k in __evaluators if k[0] == file]:
+			del __evaluators[key]
+	key = (file, format)
+	if key not in __evaluators:
+		__evaluators[key] = evaluator_from_specs(__specs[file][1],
+			reporter=reporters.from_format(format), **__options)
+	return __evaluators[key]
+# end def
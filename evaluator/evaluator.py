@@ -10,18 +10,88 @@
 # ## ###############################################################
 import os
 import re
+import math
+import shutil
+import asyncio
 import hashlib
 import datetime
+import collections
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from . import common
-from . import pdflog
+from .reporters import Reporter, PdfReporter, Recorder, replay
+from .cache import filedigest, ResultStore
+from .forkserver import ForkServer, Spawner
 
-def from_specs(specs):
-	return Evaluator(specs)
+DEFAULT_LIMITS = {
+	'cout' : common.DEFAULT_OUTPUT_LIMIT,
+	'cerr' : common.DEFAULT_OUTPUT_LIMIT,
+}
+
+# Testruns launched ahead of the one being reported, per concurrent testrun
+PREFETCH = 4
+
+def from_specs(specs, **kwargs):
+	return Evaluator(specs, **kwargs)
+
+
+
+def builder(specs, pch=False):
+	'''The function building the programs of specs (see common.cbuild), with
+	precompiled headers if pch is set (C++ only, see common.pchdir).
+	Returns None if the language is not supported'''
+	build = {
+		'C'  : common.cbuild,
+		'C+' : common.cppbuild,
+		'Py' : common.pybuild,
+	}.get(specs.language[0:2], None)
+	if build is common.cppbuild and pch:
+		pchdir = common.pchdir(specs.buildTool, specs.buildFlags)
+		if pchdir:
+			build = functools.partial(common.cppbuild, pchdir=pchdir)
+	return build
 
 
 class Evaluator():
-	def __init__(self, specs):
+	def __init__(self, specs, parallel=False, jobs=None, reporter=None, buildcache=None, results=None,
+		limits=None, early=True, forkserver=False, workspace=None, index=None, pch=False,
+		workers=1):
+		'''When parallel is set, the testruns of each testbed are executed
+		concurrently (up to jobs at a time) and reported in order.
+		Results are written to reporter (default: a PdfReporter).
+		Built programs are reused from buildcache, a cache.BuildCache, and
+		outcomes of deterministic testruns from results, a cache.ResultStore.
+		limits are the default resource limits of testruns (see TestRun.limits).
+		When early is set, processes are killed as soon as their output is
+		certain to be rejected (see vfuncs.EarlyCheck).
+		With forkserver, Python programs are run by a ForkServer, other
+		programs are started by a Spawner.
+		Each evaluation builds its program in a private directory created
+		under workspace (see common.workspace) and removed afterwards.
+		Sources identical to one evaluated before with the same specs and
+		settings are reported from index, a cache.ReportIndex, instead.
+		With pch, C++ programs are built with precompiled headers.
+		workers is the number of evaluators running at a time with this one
+		(e.g. in a pool), whose testruns share the process limit of the user'''
 		self._specs = specs
+		self._parallel = parallel
+		self._jobs = jobs
+		self._reporter = reporter if reporter is not None else PdfReporter()
+		self._buildcache = buildcache
+		self._results = results
+		self._limits = dict(DEFAULT_LIMITS)
+		self._limits.update(limits or {})
+		self._early = early
+		self._forkserver = forkserver
+		self._wsroot = workspace
+		self._index = index
+		self._pch = pch
+		self._workers = workers or 1
+		self._indexkey = None
+		self._server = None
+		self._spawner = None
+		self._reftimes = {}
 		self._reset()
 	#end def
 
@@ -30,24 +100,137 @@ class Evaluator():
 		return self._specs and self._specs.compiled
 	# end def
 
+	@property
+	def score(self):
+		return self._score
+	# end def
+
+	@property
+	def reporter(self):
+		return self._reporter
+	# end def
+
+	@property
+	def usage(self):
+		'''Resources used by the testruns of the last evaluation (see common.Usage)'''
+		return common.Usage.total(self._usage)
+	# end def
+
 	def evaluate(self, source):
 		if not self._specs:
 			return
+		if self._reuse(source):
+			return self._score
+		self._begin(source)
+		# The workspace and fork server are not left behind on errors
+		try:
+			if self._build():
+				self._reporter.section('Tests')
+				self._test()
+		finally:
+			self._clean()
+		return self._end()
+	#end def
+
+	async def evaluate_async(self, source):
+		'''Coroutine counterpart of evaluate. Concurrent evaluations require
+		one Evaluator (and reporter) each, but may share the same specs.'''
+		if not self._specs:
+			return
+		if self._reuse(source):
+			return self._score
+		self._begin(source)
+		loop = asyncio.get_event_loop()
+		try:
+			if await loop.run_in_executor(None, self._build):
+				self._reporter.section('Tests')
+				await self._test_async()
+		finally:
+			self._clean()
+		return self._end()
+	#end def
+
+	def _begin(self, source):
 		self._reset()
 		self._srcfile = source
+		self._workdir = common.workspace(self._wsroot)
 
 		self._writeSummary()
-		pdflog.section('Build')
-		if not self._build():
-			self._clean()
-		else:
-			pdflog.section('Tests')
-			self._test()
+		self._reporter.section('Build')
+	#end def
+
+	def _end(self):
+		self._reporter.end(self._score, self.usage)
+		if self._indexkey:
+			# Timeouts depend on the load of the machine, the evaluation may
+			# well end otherwise next time
+			events = self._reporter.events
+			if not any(name == 'timedout' for name, args, kwargs in events):
+				self._index.store(self._indexkey, self._score, self.usage, events)
+			self._reporter = self._reporter.reporter
+			self._indexkey = None
+		return self._score
+	#end def
+
+	def _reuse(self, source):
+		'''Reports source from the index when an identical source was evaluated
+		before, re-stamping the name, date and program of the report.
+		Otherwise records the evaluation to index it. Returns True on reuse'''
+		if isinstance(self._reporter, Recorder):
+			# Left by a failed evaluation
+			self._reporter = self._reporter.reporter
+		self._indexkey = self._key(source)
+		if not self._indexkey:
+			return False
+		r = self._index.fetch(self._indexkey)
+		if not r:
+			self._reporter = Recorder(self._reporter)
+			return False
+
+		self._reset()
+		self._indexkey = None
+		self._score, usage, events = r
+		self._usage = [ usage ] if usage else []
+		self._restamp(events, events[0][1][0], source)
+		# The header is written anew
+		begin = [ 'begin', list(Evaluator._header(source)), {} ]
+		replay([ begin ] + events[1:], self._reporter)
+		return True
+	#end def
 
-		pdflog.section('Score')
-		pdflog.rawwrite(f'Final score: \\labeltext{{{self._score}}}{{txt:score}}')
-		pdflog.writeline()
-		self._clean()
+	def _restamp(self, events, original, source):
+		'''Renames the program in the events of the evaluation of original,
+		including the outputs naming it (e.g. tracebacks)'''
+		oldcmd = self._execprefix(original)
+		newcmd = self._execprefix(source)
+		for name, args, kwargs in events:
+			if name == 'rejected' and isinstance(args[1], str):
+				args[1] = args[1].replace(original, source)
+			if name in ['building', 'buildFailed', 'built'] and args[0] == original:
+				args[0] = source
+			elif name == 'built' and self.compiled and \
+				os.path.basename(args[0]) == os.path.basename(common.outname(original)):
+				args[0] = os.path.join(os.path.dirname(args[0]),
+					os.path.basename(common.outname(source)))
+			elif name == 'testrun' and (args[2] + ' ').startswith(oldcmd + ' '):
+				args[2] = newcmd + args[2][len(oldcmd):]
+	#end def
+
+	def _key(self, source):
+		'''Key of source in the index, None when evaluations of the specs may
+		not be reused (e.g. with performance or non-deterministic testbeds)'''
+		if not self._index or not self._specs.digest:
+			return None
+		for tb in self._specs.testbeds:
+			if tb.type == 'performance' or not tb.deterministic:
+				return None
+		tool = self._specs.interpreter if not self.compiled else self._specs.buildTool
+		settings = {
+			'tool'   : [ tool, common.toolid(tool) ],
+			'limits' : self._limits,
+			'early'  : self._early,
+		}
+		return self._index.key(filedigest(source), self._specs.digest, settings)
 	#end def
 
 	def _build(self):
@@ -57,109 +240,376 @@ class Evaluator():
 		if self._specs.language[0:2] == 'Py' and \
 			not self._specs.buildScore and \
 			not self._specs.buildFlags:
-			self._exefile = self._specs.interpreter
+			# Not reported: scripts failing to compile are run from source
+			self._setupPython(self._cachedbuild(common.pybuild))
+			self._progdigest = self._digest()
 			return True
 
-		build = {
-			'C'  : common.cbuild,
-			'C+' : common.cppbuild,
-			'Py' : common.pybuild,
-		}.get(self._specs.language[0:2], None)
+		build = builder(self._specs, self._pch)
 		if not build:
-			pdflog.error(f'Unsupported language. Program failed to build.')
+			self._reporter.message('error', f'Unsupported language. Program failed to build.')
 			return
 
-		srcfile = os.path.basename(self._srcfile)
-		pdflog.info('Building {}'.format(srcfile))
+		self._reporter.building(self._srcfile)
 
-		self._exefile = build(self._specs.buildTool, self._srcfile, flags=self._specs.buildFlags)
+		self._exefile = self._cachedbuild(build)
 		if not self._exefile:
-			pdflog.warning(f'Source file {srcfile} failed to build')
+			self._reporter.buildFailed(self._srcfile)
 			return False
 
 		self._score+= self._specs.buildScore
+		self._progdigest = self._digest()
 
-		if not isinstance(self._exefile, str):
-			exefile = os.path.basename(self._srcfile)
-			self._exefile = self._specs.interpreter
+		if not self.compiled:
+			exefile = self._srcfile
+			self._setupPython(self._exefile)
 		else:
-			exefile = os.path.basename(self._exefile)
-		pdflog.info('Built {}'.format(exefile))
-		if self._specs.buildScore > 0:
-			pdflog.writeline('Score {:+0.1f}'.format(self._specs.buildScore))
+			exefile = self._exefile
+			self._startSpawner()
+		self._reporter.built(exefile, self._specs.buildScore)
 		return True
 	#end def
 
+	def _setupPython(self, pycfile):
+		'''Prepares the runs of the Python program under test from its bytecode
+		in pycfile (if any, see common.pybuild). Modules imported by the
+		program are compiled to the build cache (if any) and reused'''
+		self._exefile = self._specs.interpreter
+		self._pycfile = pycfile if isinstance(pycfile, str) else None
+		if self._buildcache:
+			self._pyenv = dict(os.environ, PYTHONPYCACHEPREFIX=self._buildcache.pycache)
+		if not self._forkserver:
+			return self._startSpawner()
+		server = ForkServer(self._specs.interpreter, self._srcfile, self._pycfile, self._pyenv)
+		if not server.start():
+			self._reporter.message('warning', 'Failed to start the fork server, running the interpreter instead')
+			return self._startSpawner()
+		self._server = server
+	#end def
+
+	def _startSpawner(self):
+		'''Programs are started by the evaluator itself (see common.execute)
+		if the Spawner fails to start'''
+		spawner = Spawner()
+		if spawner.start():
+			self._spawner = spawner
+	#end def
+
+	def _cachedbuild(self, build):
+		outfile = os.path.join(self._workdir, os.path.basename(common.outname(self._srcfile)))
+		if not self._buildcache:
+			return build(self._specs.buildTool, self._srcfile, flags=self._specs.buildFlags,
+				outfile=outfile)
+
+		key = self._buildcache.key(self._srcfile, self._specs.language,
+			self._specs.buildFlags, self._specs.buildTool)
+		exefile = self._buildcache.fetch(key, outfile)
+		if exefile:
+			return exefile
+		exefile = build(self._specs.buildTool, self._srcfile, flags=self._specs.buildFlags,
+			outfile=outfile)
+		if exefile:
+			self._buildcache.store(key, exefile)
+		return exefile
+	#end def
+
+	def _digest(self):
+		'''Digest identifying the program under test'''
+		if not self._results:
+			return None
+		if self.compiled:
+			return filedigest(self._exefile)
+		# Scripts may tell their path (e.g. in tracebacks)
+		s = filedigest(self._srcfile) + '\0' + str(common.toolid(self._specs.interpreter)) + \
+			'\0' + os.path.abspath(self._srcfile)
+		return hashlib.sha256(s.encode('utf-8')).hexdigest()
+	#end def
+
 	def _test(self):
 		for tb in self._specs.testbeds:
-			pdflog.subsection(f'Running {tb.name}')
+			self._reporter.testbed(tb.name)
 			passcount = self._run_testbed(tb)
-			pdflog.rawwrite('\\medskip{\\bfseries Summary}\\\\\n')
-			pdflog.writeline(f'Passed {passcount} of {len(tb.testruns)} tests')
+			if not self._score_testbed(tb, passcount):
+				break
+	#end def
 
-			score = tb.score if passcount == len(tb.testruns) else 0
-			if tb.type == 'proportional':
-				score = tb.score * passcount / len(tb.testruns)
-			self._score+= score
-			pdflog.writeline('Score {:+0.1f} of {}'.format(score, tb.score))
+	async def _test_async(self):
+		for tb in self._specs.testbeds:
+			self._reporter.testbed(tb.name)
+			passcount = await self._run_testbed_async(tb)
+			if not self._score_testbed(tb, passcount):
+				break
+	#end def
 
-			if passcount < len(tb.testruns):
-				if tb.onError == 'halt':
-					pdflog.rawwrite('\\medskip\n')
-					pdflog.writeline('Program did not pass all required tests.')
-					pdflog.writeline('Evaluation halted.') # , color='Maroon'
-				if tb.onError in ['abort', 'halt']:
-					break
+	def _score_testbed(self, tb, passcount):
+		'''Grants the score of a testbed. Returns False if evaluation must stop'''
+		score = tb.score if passcount == len(tb) else 0
+		if tb.type in ['proportional', 'performance']:
+			score = tb.score * passcount / len(tb)
+		self._score+= score
+		usage = common.Usage.total(self._tbusage)
+		self._usage.append(usage)
+		self._reporter.testbedEnd(passcount, len(tb), score, tb.score, usage)
+
+		if passcount < len(tb):
+			if tb.onError == 'halt':
+				self._reporter.halted()
+			if tb.onError in ['abort', 'halt']:
+				return False
+		return True
 	#end def
 
 
 	def _run_testbed(self, tb):
+		self._testbed = tb
+		self._tbusage = []
+		if tb.type == 'performance':
+			# Timed runs must not compete for the CPU
+			return self._replay_testbed(tb, self._measure)
+		if not self._parallel:
+			return self._replay_testbed(tb, self._execute)
+
+		# Launch testruns ahead and replay the results in order.
+		# Pending and in-flight runs are dropped once the testbed stops.
+		jobs = self._jobs or min(32, (os.cpu_count() or 1) + 4)
+		cancel = threading.Event()
+		pool = ThreadPoolExecutor(max_workers=jobs)
+		inflight = collections.deque()
+		launched = Evaluator._prefetch(tb, inflight, jobs * PREFETCH,
+			lambda t: pool.submit(self._execute, t, cancel))
+		try:
+			return self._replay_testbed(tb, lambda t: inflight.popleft()[1].result(), launched)
+		finally:
+			cancel.set()
+			for t, f in inflight:
+				f.cancel()
+			pool.shutdown(wait=True)
+	#end def
+
+
+	async def _run_testbed_async(self, tb):
+		self._testbed = tb
+		self._tbusage = []
+		if tb.type == 'performance':
+			loop = asyncio.get_event_loop()
+			return await self._replay_testbed_async(tb,
+				lambda t: loop.run_in_executor(None, self._measure, t))
+		if not self._parallel:
+			return await self._replay_testbed_async(tb, self._execute_async)
+
+		jobs = self._jobs or os.cpu_count() or 1
+		sem = asyncio.Semaphore(jobs)
+		async def execute(t):
+			async with sem:
+				return await self._execute_async(t)
+		inflight = collections.deque()
+		launched = Evaluator._prefetch(tb, inflight, jobs * PREFETCH,
+			lambda t: asyncio.ensure_future(execute(t)))
+		try:
+			return await self._replay_testbed_async(tb, lambda t: inflight.popleft()[1], launched)
+		finally:
+			tasks = [ task for t, task in inflight ]
+			for task in tasks:
+				task.cancel()
+			await asyncio.gather(*tasks, return_exceptions=True)
+	#end def
+
+
+	@staticmethod
+	def _prefetch(tb, inflight, depth, launch):
+		'''Launches the testruns of tb, appending them to inflight along with
+		the future of their outcome, and yields each once the depth
+		testruns following it are launched (or there are no more). Outcomes
+		must be popped from inflight as testruns are yielded'''
+		for t in tb:
+			inflight.append( (t, launch(t)) )
+			if len(inflight) > depth:
+				yield inflight[0][0]
+		while inflight:
+			yield inflight[0][0]
+	#end def
+
+
+	def _replay_testbed(self, tb, execute, testruns=None):
+		'''Reports the outcome of each testrun of tb (or of testruns, those
+		of tb being executed) as given by execute. Returns the passed count'''
 		i = 0
-		# srcfile = os.path.basename(self._srcfile)
-		# exefile = os.path.basename(self._exefile)
 		passcount = 0
-		for t in tb:
-			if (passcount < i) and (tb.onError in ['abort', 'skip']):
-				pdflog.rawwrite('\\medskip\n')
-				pdflog.writeline('Program did not pass the previous required test.')
-				pdflog.writeline('Test set aborted.') # , color='Maroon'
+		for t in (tb if testruns is None else testruns):
+			if self._stop_testbed(tb, i, passcount):
 				break
-
 			i+=1
-			pdflog.write(f'Test {i} of {len(tb)}: ')
-			self._writeCmdStr(t)
+			self._writeTestHeader(i, tb, t)
+			passed = self._check(t, *execute(t))
+			if passed is None:
+				break
+			passcount+= passed
+		return passcount
+	#end def
 
-			o, e, p = self._execute(t)
 
-			if p is None:
-				self._writeTimeout(t.timeout)
-				pdflog.writeline('\tTestbed aborted')
+	async def _replay_testbed_async(self, tb, execute, testruns=None):
+		i = 0
+		passcount = 0
+		for t in (tb if testruns is None else testruns):
+			if self._stop_testbed(tb, i, passcount):
 				break
+			i+=1
+			self._writeTestHeader(i, tb, t)
+			passed = self._check(t, *(await execute(t)))
+			if passed is None:
+				break
+			passcount+= passed
+		return passcount
+	#end def
 
-			if t.cout and not t.checkCout(o):
-				self._writeReject('Output', o.strip())
-				continue
 
-			if t.cerr and not t.checkCerr(e):
-				self._writeReject('Output (stderr)', e.strip())
-				continue
+	def _stop_testbed(self, tb, i, passcount):
+		if (passcount < i) and (tb.onError in ['abort', 'skip']):
+			self._reporter.stopped()
+			return True
+		return False
+	#end def
 
-			if t.retval and not t.checkRetval(p.returncode):
-				self._writeReject('Return code', p.returncode)
-				continue
 
-			passcount+= 1
-			pdflog.writeline('\tPass', color='OliveGreen')
+	def _check(self, t, o, e, p):
+		'''Validates the outcome of a testrun. Returns whether it passed,
+		or None when the testbed must be aborted (timeout)'''
+		if p is None:
+			self._reporter.timedout(t.timeout)
+			return None
 
-		return passcount
+		if p.usage:
+			self._reporter.usage(p.usage)
+			self._tbusage.append(p.usage)
+
+		if isinstance(p, common.Measured):
+			self._reporter.timing(p.cputime, p.maxtime, p.statistic, p.runs)
+
+		rejection = self._verify(t, o, e, p)
+		if rejection:
+			report, args = rejection
+			report(*args)
+			return False
+
+		self._reporter.passed()
+		return True
 	#end def
 
-	def _execstr(self, testset):
-		exefile = os.path.basename(self._exefile)
+	def _verify(self, t, o, e, p):
+		'''Returns the reporter method (and its arguments) rejecting the
+		outcome of a testrun, or None if the testrun passed'''
+		if t.error:
+			return self._reporter.message, ('error', t.error)
+
+		if p.verdict:
+			return self._reporter.exceeded, (p.verdict,)
+
+		if p.rejected == 'cout' or (t.cout and not t.checkCout(o)):
+			return self._reporter.rejected, ('Output', o, t.explainCout(o))
+
+		if p.rejected == 'cerr' or (t.cerr and not t.checkCerr(e)):
+			return self._reporter.rejected, ('Output (stderr)', e, t.explainCerr(e))
+
+		if t.retval and not t.checkRetval(p.returncode):
+			return self._reporter.rejected, ('Return code', p.returncode)
+
+		if isinstance(p, common.Measured) and p.maxtime is not None and p.cputime > p.maxtime:
+			return self._reporter.slow, ()
+		return None
+	#end def
+
+	def _measure(self, testset):
+		'''Times a testrun of a performance testbed and sets the largest CPU
+		time accepted from the testrun or the reference implementation'''
+		o, e, p = self._timeruns(testset)
+		if isinstance(p, common.Measured):
+			p.maxtime = testset.maxtime
+			if p.maxtime is None:
+				reftime = self._referenceTime(self._testbed, testset)
+				if reftime is not None:
+					p.maxtime = reftime * self._testbed.factor
+		return o, e, p
+	#end def
+
+	def _timeruns(self, testset):
+		'''Executes a testrun warmup + repeat times (see Testbed) and returns
+		its outcome with the statistic of the CPU times of the timed runs.
+		Stops at the first run that times out or is rejected'''
+		tb = self._testbed
+		usages = []
+		for i in range(tb.warmup + tb.repeat):
+			o, e, p = self._execute(testset)
+			if p is None or self._verify(testset, o, e, p):
+				return o, e, p
+			usages.append(p.usage or common.Usage())
+		times = [ u.cputime for u in usages[tb.warmup:] ]
+		cputime = Evaluator._statistic(tb.statistic, times)
+		return o, e, common.Measured(p.returncode, common.Usage.total(usages),
+			cputime, tb.statistic, len(times))
+	#end def
+
+	def _referenceTime(self, tb, testset):
+		'''CPU time of the reference implementation of tb running testset'''
+		if not tb.reference:
+			return None
+		if tb not in self._reftimes:
+			self._reftimes[tb] = self._timeReference(tb)
+		return self._reftimes[tb].get(testset.key)
+	#end def
+
+	def _timeReference(self, tb):
+		# Built and executed by an evaluator of its own with no report
+		source = os.path.join(self._specs.directory, tb.reference)
+		if not os.path.isfile(source):
+			self._reporter.message('warning', f'Reference implementation {tb.reference} not found')
+			return {}
+		ref = Evaluator(self._specs, reporter=Reporter(), buildcache=self._buildcache,
+			limits=self._limits, early=False, forkserver=self._forkserver,
+			workspace=self._wsroot, pch=self._pch)
+		times = {}
+		try:
+			ref._begin(source)
+			if not ref._build():
+				self._reporter.message('warning', f'Reference implementation {tb.reference} failed to build')
+				return times
+			ref._testbed = tb
+			for t in tb:
+				o, e, p = ref._timeruns(t)
+				if isinstance(p, common.Measured):
+					times[t.key] = p.cputime
+		finally:
+			ref._clean()
+		return times
+	#end def
+
+	@staticmethod
+	def _statistic(name, values):
+		values = sorted(values)
+		if name == 'mean':
+			return sum(values) / len(values)
+		if name == 'min':
+			return values[0]
+		if name == 'max':
+			return values[-1]
+		q = 0.5 if name == 'median' else int(name[1:]) / 100
+		# Linear interpolation between the closest ranks
+		k = (len(values) - 1) * q
+		lo = math.floor(k)
+		hi = min(lo + 1, len(values) - 1)
+		return values[lo] + (values[hi] - values[lo]) * (k - lo)
+	#end def
+
+	def _execprefix(self, srcfile):
+		'''The command running the program built from srcfile'''
 		if self.compiled:
-			s = './{} '.format(exefile)
-		else:
-			s = '{} {} '.format(exefile, os.path.basename(self._srcfile))
+			return './{}'.format(os.path.basename(common.outname(srcfile)))
+		interpreter = os.path.basename(self._specs.interpreter)
+		return '{} {}'.format(interpreter, os.path.basename(srcfile))
+	#end def
+
+	def _execstr(self, testset):
+		s = self._execprefix(self._srcfile) + ' '
 		s+= ' '.join([
 			str(a) if not ' ' in str(a) else f'"{str(a)}"'
 			for a in testset.args
@@ -169,13 +619,126 @@ class Evaluator():
 		# 'python3 ground.py "A mamá, Roma le aviva el amor a papá, y a papá, Roma le aviva el"' amor a mamá."
 	#end def
 
-	def _execute(self, testset):
-		if self.compiled:
+	def _execute(self, testset, cancel=None):
+		if testset.error:
+			return Evaluator._unexecuted()
+		key = self._resultkey(testset)
+		if key:
+			r = self._results.fetch(key)
+			if r:
+				return Evaluator._strip(*r)
+
+		limits = self._spawnLimits(testset)
+		checkout, checkerr = testset.earlyChecks() if self._early else (None, None)
+		if self._server:
+			o, e, p = self._server.execute(testset.args,
+				timeout=testset.timeout, cancel=cancel,
+				maxout=limits['cout'], maxerr=limits['cerr'],
+				checkout=checkout, checkerr=checkerr, rlimits=limits)
+		elif self._spawner:
+			o, e, p = self._spawner.execute(self._command(testset),
+				timeout=testset.timeout, cancel=cancel, env=self._pyenv,
+				maxout=limits['cout'], maxerr=limits['cerr'],
+				checkout=checkout, checkerr=checkerr, rlimits=limits)
+		elif self.compiled:
 			o, e, p = common.execute(self._exefile, testset.args,
-				timeout=testset.timeout, addpath=True)
+				timeout=testset.timeout, addpath=True, cancel=cancel,
+				maxout=limits['cout'], maxerr=limits['cerr'],
+				checkout=checkout, checkerr=checkerr, rlimits=limits)
 		else:
-			o, e, p = common.execute(self._exefile, [ self._srcfile ] + testset.args,
-				timeout=testset.timeout, addpath=False)
+			o, e, p = common.execute(self._exefile, self._pyargs(testset),
+				timeout=testset.timeout, addpath=False, cancel=cancel, env=self._pyenv,
+				maxout=limits['cout'], maxerr=limits['cerr'],
+				checkout=checkout, checkerr=checkerr, rlimits=limits)
+		# The partial output of early killed runs depends on the checks in use
+		if key and not (cancel and cancel.is_set()) and not (p and p.rejected):
+			self._results.store(key, o, e, p)
+		return Evaluator._strip(o, e, p)
+	#end def
+
+	async def _execute_async(self, testset):
+		if testset.error:
+			return Evaluator._unexecuted()
+		key = self._resultkey(testset)
+		if key:
+			r = self._results.fetch(key)
+			if r:
+				return Evaluator._strip(*r)
+
+		limits = self._spawnLimits(testset)
+		checkout, checkerr = testset.earlyChecks() if self._early else (None, None)
+		if self._server:
+			o, e, p = await self._server.execute_async(testset.args,
+				timeout=testset.timeout,
+				maxout=limits['cout'], maxerr=limits['cerr'],
+				checkout=checkout, checkerr=checkerr, rlimits=limits)
+		elif self._spawner:
+			o, e, p = await self._spawner.execute_async(self._command(testset),
+				timeout=testset.timeout, env=self._pyenv,
+				maxout=limits['cout'], maxerr=limits['cerr'],
+				checkout=checkout, checkerr=checkerr, rlimits=limits)
+		elif self.compiled:
+			o, e, p = await common.execute_async(self._exefile, testset.args,
+				timeout=testset.timeout, addpath=True,
+				maxout=limits['cout'], maxerr=limits['cerr'],
+				checkout=checkout, checkerr=checkerr, rlimits=limits)
+		else:
+			o, e, p = await common.execute_async(self._exefile, self._pyargs(testset),
+				timeout=testset.timeout, addpath=False, env=self._pyenv,
+				maxout=limits['cout'], maxerr=limits['cerr'],
+				checkout=checkout, checkerr=checkerr, rlimits=limits)
+		if key and not (p and p.rejected):
+			self._results.store(key, o, e, p)
+		return Evaluator._strip(o, e, p)
+	#end def
+
+	def _command(self, testset):
+		'''Arguments of the process running testset'''
+		if self.compiled:
+			return [os.path.abspath(self._exefile)] + testset.args
+		return [self._exefile] + self._pyargs(testset)
+	#end def
+
+	def _pyargs(self, testset):
+		'''Arguments of the interpreter running testset'''
+		if self._pycfile:
+			return [ common.PYLAUNCHER, self._pycfile, self._srcfile ] + testset.args
+		return [ self._srcfile ] + testset.args
+	#end def
+
+	def _resultkey(self, testset):
+		if not self._results or not self._progdigest or not self._testbed.deterministic:
+			return None
+		if self._testbed.type == 'performance':
+			return None
+		return ResultStore.key(self._progdigest, testset, self._testrunLimits(testset))
+	#end def
+
+	def _testrunLimits(self, testset):
+		limits = dict(self._limits)
+		limits.update(testset.limits)
+		return limits
+	#end def
+
+	def _spawnLimits(self, testset):
+		'''Limits set on the process of a testrun. RLIMIT_NPROC counts the
+		processes of all the testruns of the user, so the process limit is
+		granted to every testrun that may run at a time'''
+		limits = self._testrunLimits(testset)
+		if limits.get(common.LIMIT_PROCESSES) is not None:
+			jobs = self._jobs or min(32, (os.cpu_count() or 1) + 4) if self._parallel else 1
+			limits[common.LIMIT_PROCESSES]*= jobs * self._workers
+		return limits
+	#end def
+
+	@staticmethod
+	def _unexecuted():
+		'''Outcome of a testrun which could not be generated (see TestRun.error)'''
+		return '', '', common.Completed(None)
+	#end def
+
+	@staticmethod
+	def _strip(o, e, p):
 		if isinstance(o, str):
 			o = o.strip()
 		if isinstance(e, str):
@@ -185,69 +748,46 @@ class Evaluator():
 
 	def _reset(self):
 		self._srcfile = None
+		self._workdir = None
 		self._exefile = None
+		self._pycfile = None
+		self._pyenv = None
+		self._progdigest = None
+		self._testbed = None
 		self._score = 0
+		self._usage = []
+		self._tbusage = []
 	#end def
 
 	def _clean(self):
-		common.delete(self._exefile)
-	#end def
-
-	def _writeCmdStr(self, testset, width=72):
-		estr = self._execstr(testset)
-		parts = [ estr[i:i+width] for i in range(0, len(estr), width) ]
-		for i in range(len(parts)):
-			vc = pdflog.getVerbChar(parts[i])
-			if i > 0:
-				pdflog.rawwrite('\\hspace{10em}')
-			pdflog.rawwrite(f'\\Verb{ vc }{ parts[i] }{ vc }')
-			pdflog.writeline()
-	#end def
-
-	def _writeTimeout(self, timeout):
-		unit = 'second'
-		if timeout >= 60:
-			timeout/= 60
-			unit = 'minute'
-		elif timeout < 1:
-			timeout*= 1000
-			unit = 'millisecond'
-		if (timeout//1) != 1:
-			unit+= 's'
-		pdflog.writeline(f'\tExecution timed out after {timeout:0.0f} {unit}.')
-		pdflog.writeline('\tTIMEOUT!', color='YellowOrange')
-	#end def
-
-	def _writeReject(self, stream, verbatim):
-		verbatim = verbatim.strip()
-		pdflog.write(f'\t{stream} ')
-		if isinstance(verbatim, str) and len(verbatim) > 0:
-			pdflog.writeverbatim(verbatim)
-			pdflog.writeline()
-		else:
-			pdflog.rawwrite(': (none). ')
+		if self._server:
+			self._server.stop()
+			self._server = None
+		if self._spawner:
+			self._spawner.stop()
+			self._spawner = None
+		if self._workdir:
+			shutil.rmtree(self._workdir, ignore_errors=True)
+			self._workdir = None
+	#end def
 
-		pdflog.writeline('REJECTED!', color='YellowOrange')
+	def _writeTestHeader(self, i, tb, testset):
+		self._reporter.testrun(i, len(tb), self._execstr(testset))
 	#end def
 
 	def _writeSummary(self):
-		with open(self._srcfile, 'r', encoding='utf-8') as f:
+		self._reporter.begin(*Evaluator._header(self._srcfile))
+	#end def
+
+	@staticmethod
+	def _header(srcfile):
+		'''The (srcfile, sha1, author, date) of the report of srcfile'''
+		with open(srcfile, 'r', encoding='utf-8') as f:
 			src = f.read()
 		now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 		sha1 = hashlib.sha1(src.encode('utf-8')).hexdigest()
 		author = Evaluator.findAuthor(src)
-		srcfile = os.path.basename(self._srcfile)
-		pdflog.rawwrite('\\Large\n')
-		pdflog.writeline(f'Automated evaluation report')
-		pdflog.rawwrite('\\noindent\n')
-		pdflog.rawwrite('\\begin{tabular}{@{} l l}\n')
-		pdflog.rawwrite(f'Generated on: & {now}\\\\\n')
-		pdflog.rawwrite(f'Source file:  & \\Verb^{srcfile}^\\\\\n')
-		pdflog.rawwrite(f'Source sha1:  & \\Verb^{sha1}^\\\\\n')
-		pdflog.rawwrite(f'Source author:& \\Verb^{author}^\\\\\n')
-		pdflog.rawwrite(f'Score:        & \\ref*{{txt:score}}\\\\\n')
-		pdflog.rawwrite('\\end{tabular}\n')
-		pdflog.rawwrite('\\normalsize\n')
+		return srcfile, sha1, author, now
 	#end def
 
 
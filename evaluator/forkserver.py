@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ## ###############################################################
+# evaluator/forkserver.py
+#
+# Author:  Mauricio Matamoros
+# License: MIT
+#
+# ## ###############################################################
+
+import os
+import sys
+import json
+import time
+import array
+import select
+import shutil
+import signal
+import socket
+import tempfile
+import subprocess as sp
+from types import SimpleNamespace
+from . import common
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pyserver.py')
+
+# Seconds to wait for the server to start
+START_TIMEOUT = 10
+
+
+class ForkServer():
+	'''Pre-started interpreter running a Python script once per testrun in a
+	forked child (see pyserver.py), so the startup of the interpreter and
+	the import of the modules used by the script are paid once.
+	Runs yield the same outcome as common.execute(interpreter, [script] + args).
+	The script is loaded from pycfile if given (see common.pybuild), and env
+	is the environment of the server and hence of the runs'''
+	def __init__(self, interpreter, script, pycfile=None, env=None):
+		self._interpreter = interpreter
+		self._script = script
+		self._pycfile = pycfile
+		self._env = env
+		self._proc = None
+		self._dir = None
+	# end def
+
+	@property
+	def running(self):
+		return self._proc is not None and self._proc.poll() is None
+	# end def
+
+	def start(self):
+		'''Starts the server. Returns False if it could not be started'''
+		self._dir = tempfile.mkdtemp(prefix='progeval-')
+		self._path = os.path.join(self._dir, 'server')
+		try:
+			self._proc = sp.Popen(self._command(), stdout=sp.PIPE, stderr=sp.DEVNULL, env=self._env)
+		except OSError:
+			self.stop()
+			return False
+		# The server writes a line once it is listening
+		ready = select.select([self._proc.stdout], [], [], START_TIMEOUT)[0]
+		if not ready or not self._proc.stdout.readline():
+			self.stop()
+			return False
+		self._proc.stdout.close()
+		return True
+	# end def
+
+	def stop(self):
+		if self._proc:
+			self._proc.kill()
+			self._proc.wait()
+			if self._proc.stdout:
+				self._proc.stdout.close()
+			self._proc = None
+		if self._dir:
+			shutil.rmtree(self._dir, ignore_errors=True)
+			self._dir = None
+	# end def
+
+	def _command(self):
+		args = [self._interpreter, SERVER_SCRIPT, self._path, self._script]
+		if self._pycfile:
+			args.append(self._pycfile)
+		return args
+	# end def
+
+	def _job(self, args, env):
+		'''Request of a run with args (see pyserver.py)'''
+		return { 'script' : self._script, 'args' : [str(a) for a in args] }
+	# end def
+
+	def spawn(self, args, rlimits=None, env=None):
+		'''Runs the script with the given args and resource limits (see
+		common.execute) in a new child. Returns its ForkedProcess'''
+		rout, wout = os.pipe()
+		rerr, werr = os.pipe()
+		conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			conn.connect(self._path)
+			job = self._job(args, env)
+			job['cwd'] = os.getcwd()
+			job['rlimits'] = [ [r, s, h] for r, (s, h) in common.resourcelimits(rlimits) ]
+			data = json.dumps(job).encode('utf-8') + b'\n'
+			fds = array.array('i', [wout, werr])
+			sent = conn.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)])
+			conn.sendall(data[sent:])
+		except OSError:
+			conn.close()
+			for fd in [rout, wout, rerr, werr]:
+				os.close(fd)
+			raise
+		os.close(wout)
+		os.close(werr)
+		stdout = open(rout, 'rb')
+		stderr = open(rerr, 'rb')
+		command = [self._interpreter, self._script] + job['args'] if job.get('script') else job['args']
+		return ForkedProcess(conn, command, stdout, stderr)
+	# end def
+
+	def execute(self, args, timeout=15, cancel=None, maxout=None, maxerr=None,
+		checkout=None, checkerr=None, rlimits=None, env=None):
+		'''Runs the script with the given args as common.execute does'''
+		start = time.monotonic()
+		proc = self.spawn(args, rlimits, env)
+		return common.collect(proc, start, timeout, cancel, maxout, maxerr,
+			checkout, checkerr, rlimits)
+	# end def
+
+	async def execute_async(self, args, timeout=15, maxout=None, maxerr=None,
+		checkout=None, checkerr=None, rlimits=None, env=None):
+		'''Coroutine counterpart of execute'''
+		start = time.monotonic()
+		proc = self.spawn(args, rlimits, env)
+		return await common.collect_async(proc, start, timeout, maxout, maxerr,
+			checkout, checkerr, rlimits)
+	# end def
+# end class
+
+
+
+class Spawner(ForkServer):
+	'''Server starting programs (args[0] of each run, looked up in the PATH
+	of env) from a small process of its own instead of the evaluator.
+	Resource limits are thus applied between fork and exec by a process
+	with no threads, and the peak memory of a program (see common.Usage)
+	only includes the few megabytes of the server instead of the evaluator'''
+	def __init__(self):
+		super().__init__(sys.executable, None)
+	# end def
+
+	def _command(self):
+		# Neither site packages nor the environment are needed, all of them
+		# would make the server (and the memory of every program) larger
+		return [self._interpreter, '-E', '-s', '-S', SERVER_SCRIPT, self._path]
+	# end def
+
+	def _job(self, args, env):
+		job = { 'args' : [str(a) for a in args] }
+		if env is not None:
+			job['env'] = env
+		return job
+	# end def
+# end class
+
+
+
+class ForkedProcess():
+	'''Child of a ForkServer, with the interface of sp.Popen used by
+	common.collect. The child is killed and waited for by the server'''
+	def __init__(self, conn, args, stdout, stderr):
+		self._conn = conn
+		self._buffer = b''
+		self._status = None
+		self.args = args
+		self.stdout = stdout
+		self.stderr = stderr
+		self.returncode = None
+		message = self._receive(True)
+		if message is None:
+			self.pid = None
+			self._gone()
+		else:
+			self.pid = message['pid']
+	# end def
+
+	def kill(self):
+		if self._status is not None:
+			return
+		try:
+			self._conn.send(b'k')
+		except OSError:
+			pass
+	# end def
+
+	def fileno(self):
+		'''Descriptor readable once the server tells about the child'''
+		return self._conn.fileno()
+	# end def
+
+	def wait(self):
+		if self.returncode is None:
+			self.wait4(0)
+		return self.returncode
+	# end def
+
+	def wait4(self, options):
+		'''Counterpart of os.wait4(pid, options) for the child'''
+		if self._status is None:
+			message = self._receive(not (options & os.WNOHANG))
+			if message is None:
+				if self._conn.fileno() < 0:
+					raise ChildProcessError('the fork server is gone')
+				return 0, 0, None
+			self._status = message
+			self._conn.close()
+		ru = SimpleNamespace(ru_utime=self._status['utime'],
+			ru_stime=self._status['stime'], ru_maxrss=self._status['maxrss'])
+		return self.pid, self._status['status'], ru
+	# end def
+
+	def _receive(self, block):
+		'''Returns the next message of the server, or None if there is none
+		yet (or ever, closing the connection)'''
+		while not b'\n' in self._buffer:
+			if self._conn.fileno() < 0:
+				return None
+			if not block and not select.select([self._conn], [], [], 0)[0]:
+				return None
+			try:
+				data = self._conn.recv(4096)
+			except OSError:
+				data = b''
+			if not data:
+				self._gone()
+				return None
+			self._buffer+= data
+		line, self._buffer = self._buffer.split(b'\n', 1)
+		return json.loads(line.decode('utf-8'))
+	# end def
+
+	def _gone(self):
+		# The server died, so did the child
+		self._conn.close()
+		if self.returncode is None:
+			self.returncode = -signal.SIGKILL
+	# end def
+# end class
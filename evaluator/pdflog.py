@@ -12,9 +12,12 @@
 import re
 import os
 import sys
+import json
+import shutil
 import hashlib
+import tempfile
 import subprocess as sp
-from .common import execute, delete
+from .common import execute, delete, cachedir, toolid, workspace
 
 DEFAULT_TIMEOUT = 20
 pyprint = print
@@ -67,8 +70,13 @@ def setfile(file):
 	__pdflog.output = file
 #end def
 
-def build():
-	return __pdflog.build()
+def build(name=None, output=None):
+	return __pdflog.build(name, output)
+#end def
+
+def reset():
+	global __pdflog
+	__pdflog = PdfLog()
 #end def
 
 def encrypt_pdf(pdffile):
@@ -84,13 +92,17 @@ def encrypt_pdf(pdffile):
 				break
 			sha1.update(data)
 	sha1 =  sha1.hexdigest()
-	efname = f'{sha1}.pdf'
+	efname = os.path.join(os.path.dirname(pdffile), f'{sha1}.pdf')
 
 	args = [
 		pdffile, 'output', efname, 'encrypt_128bit',
 		'owner_pw', sha1, 'allow', 'printing',
 		'allow', 'CopyContents'
 	]
+	if not _pdftk_version():
+		pyprint(f'Failed to encrypt {pdffile}. pdftk is not installed.', file=sys.stderr)
+		return
+
 	pyprint(f'encrypting {pdffile} into {efname}')
 	o, e, p = execute('pdftk', args, addpath=False)
 	pyprint(f'cout: {o}')
@@ -107,7 +119,7 @@ def encrypt_pdf(pdffile):
 
 
 def getVerbChar(s):
-	if __latexmk_ver >= 4.31:
+	if _xelatex():
 		verchars = '§¬¥^|`"<>!@#$%&+-/.,:;()~'
 	else:
 		verchars = '^|`"<>!@#$%&+-/.,:;()~'
@@ -119,6 +131,72 @@ def getVerbChar(s):
 
 
 
+__versions = {}
+def _toolversion(tool, probe):
+	'''Version of tool as detected by probe or None if the tool is not installed.
+	Detected versions are kept in memory and in a cache file which entries
+	are invalidated when the path or modification time of the tool changes'''
+	if tool in __versions:
+		return __versions[tool]
+
+	path = shutil.which(tool)
+	if not path:
+		__versions[tool] = None
+		return None
+	stamp = f'{path}:{os.path.getmtime(path)}'
+
+	cachefile = cachedir('probes.json')
+	try:
+		with open(cachefile, 'r', encoding='utf-8') as f:
+			probes = json.load(f)
+	except (OSError, ValueError):
+		probes = {}
+	if tool in probes and probes[tool]['stamp'] == stamp:
+		__versions[tool] = probes[tool]['version']
+		return __versions[tool]
+
+	try:
+		version = probe()
+	except OSError:
+		version = None
+	__versions[tool] = version
+	if version is None:
+		return None
+
+	probes[tool] = { 'stamp': stamp, 'version': version }
+	try:
+		os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+		tmp = f'{cachefile}.{os.getpid()}'
+		with open(tmp, 'w', encoding='utf-8') as f:
+			json.dump(probes, f)
+		os.replace(tmp, cachefile)
+	except OSError:
+		pass
+	return version
+#end def
+
+
+
+def _pdftk_version():
+	return _toolversion('pdftk', _get_pdftk_version)
+#end def
+
+
+
+def _latexmk_version():
+	return _toolversion('latexmk', _get_latexmk_version)
+#end def
+
+
+
+def _xelatex():
+	'''Whether reports are built with xelatex (latexmk 4.31 or newer)'''
+	version = _latexmk_version()
+	return version is not None and version >= 4.31
+#end def
+
+
+
 def _get_pdftk_version():
 	o, e, p = execute('pdftk', ['--version'], timeout=1, addpath=False)
 	if p is None or p.returncode != 0:
@@ -145,7 +223,7 @@ def _get_latexmk_version():
 
 
 
-def _pdfbuild(texfile):
+def _pdfbuild(texfile, fmt=None):
 	# args = ['-halt-on-error', '-output-directory', 'tex', texfile]
 	# return execute('pdflatex', args, timeout=20)
 	tfpath = os.path.abspath(texfile)
@@ -156,27 +234,124 @@ def _pdfbuild(texfile):
 		f'-outdir={aopath}',
 		'-halt-on-error',
 	]
-	if __latexmk_ver >= 4.31:
+	if _xelatex():
 		args.append('-xelatex')
+	env = None
+	if fmt:
+		fmtdir, fmtname = fmt
+		engine = _engine()[0]
+		args.append(f'-{engine}={engine} -fmt={fmtname} %O %S')
+		env = dict(os.environ)
+		env['TEXFORMATS'] = f'{fmtdir}:{env.get("TEXFORMATS", "")}'
 	args.append(texfile)
 	# pyprint('\nExec: latexmk ' + '\n  '.join(args) + '\n')
-	return execute('latexmk', args, timeout=DEFAULT_TIMEOUT, addpath=False)
+	return execute('latexmk', args, timeout=DEFAULT_TIMEOUT, addpath=False, env=env)
 #end def
 
 
 
-def _pdfclean(texfile):
-	tfpath = os.path.abspath(texfile)
-	aopath = os.path.dirname(tfpath)
-	args = [
-		'-c',
-		f'-auxdir={aopath}',
-		f'-outdir={aopath}',
-		texfile
-	]
-	if __latexmk_ver >= 4.31:
-		args.append('-xelatex')
-	return execute('latexmk', args, addpath=False)
+def _engine():
+	'''The LaTeX engine used to build reports and its ini-mode counterpart'''
+	return ('xelatex', 'xetex') if _xelatex() else ('pdflatex', 'pdftex')
+#end def
+
+
+
+__formats = {}
+def _preamble_format(header):
+	'''Dumps the static preamble of the template (up to \\endofdump) into a
+	precompiled format using mylatexformat. The format is stored next to the
+	template, or in the cache directory if the former is not writable.
+	Returns the (directory, name) of the format or None if unavailable'''
+	engine, initex = _engine()
+	key = hashlib.sha1((header + str(toolid(engine))).encode('utf-8')).hexdigest()
+	fmtname = f'progeval-{key[:16]}'
+	if fmtname in __formats:
+		return __formats[fmtname]
+
+	here = os.path.abspath(os.path.dirname(__file__))
+	fmtdirs = [ here, cachedir('latex') ]
+	for d in fmtdirs:
+		if os.path.exists(os.path.join(d, f'{fmtname}.fmt')):
+			__formats[fmtname] = (d, fmtname)
+			return __formats[fmtname]
+
+	__formats[fmtname] = None
+	if not shutil.which(initex):
+		return None
+	for d in fmtdirs:
+		try:
+			os.makedirs(d, exist_ok=True)
+			tmpdir = tempfile.mkdtemp(dir=d, prefix='.fmt')
+		except OSError:
+			continue
+		try:
+			preamble = os.path.join(tmpdir, 'preamble.tex')
+			with open(preamble, 'w', encoding='utf-8') as f:
+				f.write(header)
+			args = [
+				'-ini', '-interaction=batchmode', '-halt-on-error',
+				f'-output-directory={tmpdir}', f'-jobname={fmtname}',
+				f'&{engine}', 'mylatexformat.ltx', f'"{preamble}"'
+			]
+			o, e, p = execute(initex, args, timeout=DEFAULT_TIMEOUT, addpath=False)
+			fmtfile = os.path.join(tmpdir, f'{fmtname}.fmt')
+			if p is None or p.returncode != 0 or not os.path.exists(fmtfile):
+				pyprint(f'Failed to precompile the report preamble. Using full builds.', file=sys.stderr)
+				return None
+			os.replace(fmtfile, os.path.join(d, f'{fmtname}.fmt'))
+			__formats[fmtname] = (d, fmtname)
+			return __formats[fmtname]
+		except OSError:
+			continue
+		finally:
+			shutil.rmtree(tmpdir, ignore_errors=True)
+	return None
+#end def
+
+
+
+__template = None
+def _template():
+	'''The (header, footer) of template.tex, split at %Content%. The template
+	is read once per process'''
+	global __template
+	if __template is not None:
+		return __template
+
+	header = ''
+	footer = ''
+	rxContent = re.compile(r'%Content%[\r\n]*')
+	here = os.path.abspath(os.path.dirname(__file__))
+	template = os.path.join(here, 'template.tex')
+	with open(template, 'r', encoding='utf-8') as f:
+		line = f.readline()
+		flag = False
+		while line:
+			if rxContent.fullmatch(line):
+				flag = True
+				line = f.readline()
+				continue
+
+			if flag:
+				footer+= line
+			else:
+				header+= line
+			line = f.readline()
+		# end while
+	# end with
+	__template = (header, footer)
+	return __template
+#end def
+
+
+
+def warmup():
+	'''Probes pdftk and latexmk and loads the template and its precompiled
+	preamble ahead of the first report (e.g. in long-running processes)'''
+	_pdftk_version()
+	if _latexmk_version():
+		_preamble_format(_template()[0])
 #end def
 
 
@@ -188,27 +363,7 @@ class PdfLog():
 	# end def
 
 	def _loadTemplate(self):
-		self.__header = ''
-		self.__footer = ''
-		rxContent = re.compile(r'%Content%[\r\n]*')
-		here = os.path.abspath(os.path.dirname(__file__))
-		template = os.path.join(here, 'template.tex')
-		with open(template, 'r', encoding='utf-8') as f:
-			line = f.readline()
-			flag = False
-			while line:
-				if rxContent.fullmatch(line):
-					flag = True
-					line = f.readline()
-					continue
-
-				if flag:
-					self.__footer+= line
-				else:
-					self.__header+= line
-				line = f.readline()
-			# end while
-		# end with
+		self.__header, self.__footer = _template()
 	# end def
 
 	def section(self, s):
@@ -224,6 +379,10 @@ class PdfLog():
 		self.writeline(f'[WARN]: {s}')
 	# end def
 
+	def warning(self, s):
+		self.warn(s)
+	# end def
+
 	def info(self, s):
 		pyprint(f'[INFO]: {s}')
 		# self._content.append(f'[INFO]: {s}')
@@ -282,32 +441,49 @@ class PdfLog():
 
 	# end def
 
-	def build(self):
+	def build(self, name=None, output=None):
+		'''Typesets the report in a workspace of its own (see common.workspace)
+		and moves the PDF to output (default: tex/name.pdf)'''
 		text = self.__header + '\n'
 		text+= ''.join(self._content)
 		text+= self.__footer
 
 		fprefix = hashlib.sha1(text.encode('utf-8')).hexdigest()
-		fprefix = 'foo'
-		texfile = os.path.join('tex', f'{fprefix}.tex')
-		logfile = os.path.join('tex', f'{fprefix}.log')
-		auxfile = os.path.join('tex', f'{fprefix}.aux')
-		pdffile = os.path.join('tex', f'{fprefix}.pdf')
-
-		if not os.path.exists('tex'):
-			os.mkdir('tex')
+		fprefix = name if name else 'foo'
+		if not output:
+			output = os.path.join('tex', f'{fprefix}.pdf')
+		workdir = workspace()
+		try:
+			return self._build(text, fprefix, workdir, output)
+		finally:
+			shutil.rmtree(workdir, ignore_errors=True)
+	# end def
+
+	def _build(self, text, fprefix, workdir, output):
+		texfile = os.path.join(workdir, f'{fprefix}.tex')
+		pdffile = os.path.join(workdir, f'{fprefix}.pdf')
+
 		with open(texfile, 'w', encoding='utf-8') as f:
 			f.write(text)
 
-		if not _pdfbuild(os.path.abspath(texfile)):
-			pyprint(f'Failed to build {pdffile}: no input file {texfile}', file=sys.stderr)
+		if not _latexmk_version():
+			pyprint(f'Failed to build {pdffile}: latexmk is not installed', file=sys.stderr)
+			return None
 
-		_pdfclean(os.path.abspath(texfile))
+		fmt = _preamble_format(self.__header)
+		o, e, p = _pdfbuild(os.path.abspath(texfile), fmt)
+		if fmt and (p is None or p.returncode != 0):
+			o, e, p = _pdfbuild(os.path.abspath(texfile))
+		if not p:
+			pyprint(f'Failed to build {pdffile}: no input file {texfile}', file=sys.stderr)
 
 		if not os.path.exists(pdffile):
-			pyprint(f'Failed to build {pdffile}', file=sys.stderr)
+			pyprint(f'Failed to build {output}', file=sys.stderr)
 			return None
-		return pdffile
+		if os.path.dirname(output):
+			os.makedirs(os.path.dirname(output), exist_ok=True)
+		shutil.move(pdffile, output)
+		return output
 	# end def
 
 
@@ -366,5 +542,3 @@ class PdfLog():
 # end class
 
 __pdflog = PdfLog()
-__pdftk_ver = _get_pdftk_version()
-__latexmk_ver = _get_latexmk_version()
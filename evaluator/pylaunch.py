@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ## ###############################################################
+# evaluator/pylaunch.py
+#
+# Author:  Mauricio Matamoros
+# License: MIT
+#
+# ## ###############################################################
+#
+# Runs a Python script from its compiled bytecode (see common.pybuild) as
+# python3 script args would, sparing the compilation of the script:
+#
+#     python3 pylaunch.py script.pyc script args
+#
+# Runs in the interpreter of the specs, hence it uses nothing but the
+# standard library. Falls back to the source when the bytecode is missing
+# or was compiled by another version of the interpreter.
+#
+# ## ###############################################################
+
+import os
+import sys
+import marshal
+import builtins
+from types import CodeType
+
+try:
+	from _frozen_importlib_external import MAGIC_NUMBER
+except ImportError:
+	from importlib.util import MAGIC_NUMBER
+
+# Size of the header of .pyc files (PEP 552)
+HEADER_SIZE = 16 if sys.version_info >= (3, 7) else 12
+
+
+def load(pycfile, script):
+	'''Returns the code object of script, read from pycfile when possible.
+	The bytecode may be shared by identical scripts (see cache.BuildCache),
+	so its code is renamed after script, as if compiled from it'''
+	if pycfile and hasattr(CodeType, 'replace'):
+		try:
+			with open(pycfile, 'rb') as f:
+				data = f.read()
+			if data[:4] == MAGIC_NUMBER:
+				return rename(marshal.loads(data[HEADER_SIZE:]), script)
+		except (OSError, ValueError, EOFError):
+			pass
+	with open(script, 'rb') as f:
+		return compile(f.read(), script, 'exec', dont_inherit=True)
+# end def
+
+
+
+def rename(code, filename):
+	'''Returns code, and the code objects nested in it, with filename'''
+	if code.co_filename == filename:
+		return code
+	consts = tuple(rename(c, filename) if isinstance(c, CodeType) else c
+		for c in code.co_consts)
+	return code.replace(co_filename=filename, co_consts=consts)
+# end def
+
+
+
+def run(script, args, code=None, pycfile=None):
+	'''Runs script (or its code, if given) as the __main__ module'''
+	sys.argv = [ script ] + list(args)
+	sys.path[0] = os.path.dirname(os.path.abspath(script))
+	main = type(sys)('__main__')
+	main.__file__ = script
+	main.__cached__ = None
+	main.__builtins__ = builtins
+	sys.modules['__main__'] = main
+	try:
+		if code is None:
+			code = load(pycfile, script)
+		exec(code, main.__dict__)
+	except SystemExit:
+		raise
+	except BaseException as ex:
+		import traceback
+		# Hide the frames of the launcher, as if the script was run directly
+		filename = code.co_filename if code is not None else script
+		tb = ex.__traceback__
+		while tb is not None and tb.tb_frame.f_code.co_filename != filename:
+			tb = tb.tb_next
+		traceback.print_exception(type(ex), ex, tb)
+		sys.exit(1)
+# end def
+
+
+
+if __name__ == '__main__':
+	run(sys.argv[2], sys.argv[3:], pycfile=sys.argv[1])
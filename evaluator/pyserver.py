@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ## ###############################################################
+# evaluator/pyserver.py
+#
+# Author:  Mauricio Matamoros
+# License: MIT
+#
+# ## ###############################################################
+#
+# Fork server for Python programs (see forkserver.ForkServer).
+# Runs in the interpreter of the specs rather than in the evaluator, hence
+# it is a standalone script using nothing but the standard library:
+#
+#     python3 pyserver.py socket [script [script.pyc]]
+#
+# The server listens on the unix socket and forks a child for each
+# connection, which runs the script (compiled once) as python3 would, or
+# with no script executes the program given by the args of the run (see
+# forkserver.Spawner). The client sends one JSON line with the args,
+# working directory, resource limits (and environment, with no script) of
+# the run along with the stdout and stderr of the child (as SCM_RIGHTS), and
+# receives one JSON line with the pid of the child and another with its
+# exit status and resource usage. Sending k kills the child.
+#
+# ## ###############################################################
+
+import sys
+# Modules imported by the interpreter itself before running any script
+STARTUP_MODULES = set(sys.modules)
+
+import os
+import ast
+import json
+import array
+import errno
+import select
+import signal
+import socket
+import pylaunch
+import importlib
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+# Seconds between checks for the death of the evaluator
+PARENT_POLL_INTERVAL = 1
+MAX_FDS = 2
+
+
+def serve(path, script=None, pycfile=None):
+	'''Serves runs of script (or of programs, with no script) on the unix
+	socket at path until the evaluator exits. Returns only in the forked
+	children, with their job'''
+	parent = os.getppid()
+	code = None
+	if script:
+		# Modules are looked up next to the script, as in python3 script
+		sys.path[0] = os.path.dirname(os.path.abspath(script))
+		preload(script)
+		try:
+			code = pylaunch.load(pycfile, script)
+		except Exception:
+			# Reported by each child (see pylaunch.run)
+			code = None
+
+	listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	listener.bind(path)
+	listener.listen(64)
+	# SIGCHLD wakes up select through the pipe
+	rwake, wwake = os.pipe()
+	for fd in [rwake, wwake]:
+		os.set_blocking(fd, False)
+	signal.set_wakeup_fd(wwake)
+	signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+	# Ready (see ForkServer.start)
+	sys.stdout.write('\n')
+	sys.stdout.flush()
+
+	conns = {}    # socket -> [buffer, fds, pid]
+	children = {} # pid -> socket
+	while os.getppid() == parent:
+		try:
+			readable = select.select([listener, rwake] + list(conns), [], [],
+				PARENT_POLL_INTERVAL)[0]
+		except InterruptedError:
+			continue
+		for s in readable:
+			if s is listener:
+				conn = listener.accept()[0]
+				conns[conn] = [b'', [], None]
+			elif s == rwake:
+				_drain(rwake)
+				_reap(conns, children)
+			elif conns[s][2] is None:
+				if not _receive(s, conns[s]):
+					_close(s, conns)
+				elif b'\n' in conns[s][0]:
+					job = _fork(s, conns, children)
+					if job:
+						# In the child
+						listener.close()
+						os.close(rwake)
+						os.close(wwake)
+						job['code'] = code
+						return job
+			else:
+				_control(s, conns, children)
+	# The evaluator is gone
+	for pid in children:
+		_kill(pid)
+	sys.exit(0)
+# end def
+
+
+
+def run(job):
+	'''Runs the script of job as __main__, as python3 script args would'''
+	script = job['script']
+	directory = os.path.dirname(os.path.abspath(script))
+	# Local modules shadow those imported by the server (e.g. a json.py)
+	for name in set(sys.modules) - STARTUP_MODULES:
+		if os.path.exists(os.path.join(directory, name + '.py')) or \
+			os.path.isdir(os.path.join(directory, name)):
+			del sys.modules[name]
+	# Children would share the random state of the server otherwise (the
+	# random module reseeds itself after fork)
+	if 'numpy.random' in sys.modules:
+		sys.modules['numpy.random'].seed()
+	pylaunch.run(script, job['args'], code=job['code'])
+# end def
+
+
+
+def execute(job):
+	'''Replaces the child with the program of job, as sp.Popen would'''
+	# Signals ignored by the interpreter would stay ignored by the program
+	for name in ['SIGPIPE', 'SIGXFSZ']:
+		if hasattr(signal, name):
+			signal.signal(getattr(signal, name), signal.SIG_DFL)
+	args = job['args']
+	try:
+		if job.get('env') is not None:
+			os.execvpe(args[0], args, job['env'])
+		os.execvp(args[0], args)
+	except OSError as err:
+		os.write(2, f'{args[0]}: {err.strerror}\n'.encode('utf-8', 'replace'))
+		os._exit(127)
+# end def
+
+
+
+def preload(script):
+	'''Imports the modules imported by script which are not local to it, so
+	children do not import them again. Failures are ignored'''
+	directory = os.path.dirname(os.path.abspath(script))
+	try:
+		with open(script, 'rb') as f:
+			tree = ast.parse(f.read())
+	except Exception:
+		return
+	names = []
+	for node in tree.body:
+		if isinstance(node, ast.Import):
+			names.extend([a.name for a in node.names])
+		elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+			names.append(node.module)
+	for name in names:
+		top = name.split('.')[0]
+		if os.path.exists(os.path.join(directory, top + '.py')) or \
+			os.path.isdir(os.path.join(directory, top)):
+			continue
+		try:
+			importlib.import_module(name)
+		except BaseException:
+			pass
+# end def
+
+
+
+def _receive(conn, state):
+	'''Reads the request of conn. Returns False once the client is gone'''
+	fds = array.array('i')
+	try:
+		data, ancdata, flags, addr = conn.recvmsg(65536,
+			socket.CMSG_SPACE(MAX_FDS * fds.itemsize))
+	except OSError:
+		return False
+	for level, kind, cdata in ancdata:
+		if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+			cdata = cdata[:len(cdata) - (len(cdata) % fds.itemsize)]
+			fds.frombytes(cdata)
+	state[0]+= data
+	state[1].extend(fds)
+	return len(data) > 0
+# end def
+
+
+
+def _fork(conn, conns, children):
+	'''Forks the child of the request of conn. Returns its job in the child'''
+	data, fds, pid = conns[conn]
+	try:
+		job = json.loads(data.split(b'\n')[0].decode('utf-8'))
+	except ValueError:
+		job = None
+	if job is None or len(fds) != 2:
+		_close(conn, conns)
+		return None
+
+	pid = os.fork()
+	if pid == 0:
+		_child(job, fds, conns)
+		return job
+
+	for fd in fds:
+		os.close(fd)
+	conns[conn] = [b'', [], pid]
+	children[pid] = conn
+	_send(conn, {'pid': pid})
+	return None
+# end def
+
+
+
+def _child(job, fds, conns):
+	signal.set_wakeup_fd(-1)
+	signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+	# Pipes of pending requests would not be closed until the child exits
+	for conn, (data, pending, pid) in conns.items():
+		conn.close()
+		for fd in pending if pending is not fds else []:
+			os.close(fd)
+	os.dup2(fds[0], 1)
+	os.dup2(fds[1], 2)
+	for fd in fds:
+		os.close(fd)
+	os.chdir(job['cwd'])
+	if resource:
+		for rlimit, soft, hard in job['rlimits']:
+			resource.setrlimit(rlimit, (soft, hard))
+# end def
+
+
+
+def _control(conn, conns, children):
+	pid = conns[conn][2]
+	try:
+		data = conn.recv(4096)
+	except OSError:
+		data = b''
+	if b'k' in data:
+		_kill(pid)
+	elif not data:
+		# The client is gone, the child is reaped with no one to tell
+		_kill(pid)
+		children[pid] = None
+		_close(conn, conns)
+# end def
+
+
+
+def _reap(conns, children):
+	while True:
+		try:
+			pid, status, ru = os.wait4(-1, os.WNOHANG)
+		except ChildProcessError:
+			return
+		if pid == 0:
+			return
+		conn = children.pop(pid, None)
+		if conn is None:
+			continue
+		_send(conn, {
+			'status' : status,
+			'utime'  : ru.ru_utime,
+			'stime'  : ru.ru_stime,
+			'maxrss' : ru.ru_maxrss,
+		})
+		_close(conn, conns)
+# end def
+
+
+
+def _send(conn, message):
+	try:
+		conn.sendall(json.dumps(message).encode('utf-8') + b'\n')
+	except OSError:
+		pass
+# end def
+
+
+
+def _close(conn, conns):
+	data, fds, pid = conns.pop(conn)
+	for fd in fds if pid is None else []:
+		os.close(fd)
+	conn.close()
+# end def
+
+
+
+def _kill(pid):
+	try:
+		os.kill(pid, signal.SIGKILL)
+	except OSError:
+		pass
+# end def
+
+
+
+def _drain(fd):
+	try:
+		while os.read(fd, 4096):
+			pass
+	except OSError as ex:
+		if ex.errno not in [errno.EAGAIN, errno.EWOULDBLOCK]:
+			raise
+# end def
+
+
+
+if __name__ == '__main__':
+	job = serve(*sys.argv[1:4])
+	if job.get('script'):
+		run(job)
+	else:
+		execute(job)
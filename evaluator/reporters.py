@@ -0,0 +1,770 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ## ###############################################################
+# evaluator/reporters.py
+#
+# Author:  Mauricio Matamoros
+# License: MIT
+#
+# ## ###############################################################
+
+import os
+import html
+import json
+import xml.etree.ElementTree as ET
+from . import pdflog
+from .common import Usage
+
+
+def from_format(fmt, **kwargs):
+	'''Creates a reporter for the given output format'''
+	reporter = {
+		'pdf'   : PdfReporter,
+		'json'  : JsonReporter,
+		'junit' : JUnitReporter,
+		'html'  : HtmlReporter,
+	}.get(fmt.lower(), None)
+	if not reporter:
+		raise ValueError(f'Unsupported report format {fmt}')
+	return reporter(**kwargs)
+# end def
+
+
+
+FORMATS = ['pdf', 'json', 'junit', 'html']
+
+# Characters of a rejected value written to reports, where outputs may take
+# up to the output limit (see _clip)
+MAX_VALUE = 4096
+
+# Human-readable names of the limits reported by Reporter.exceeded
+LIMIT_NAMES = {
+	'output'    : 'Output',
+	'cpu'       : 'CPU time',
+	'memory'    : 'Memory',
+	'processes' : 'Process',
+	'filesize'  : 'File size',
+}
+
+
+
+class Reporter():
+	'''Receives the events of an evaluation and builds a report from them.
+	Events are delivered in order: begin, sections, build and testbed events
+	(each testbed holding its testruns), and end with the final score.'''
+
+	extension = ''
+
+	def begin(self, srcfile, sha1, author, date):
+		pass
+	# end def
+
+	def section(self, title):
+		pass
+	# end def
+
+	def message(self, level, text):
+		'''Free-text message where level is one of info, warning or error'''
+		pass
+	# end def
+
+	def building(self, srcfile):
+		pass
+	# end def
+
+	def built(self, exefile, score):
+		pass
+	# end def
+
+	def buildFailed(self, srcfile):
+		pass
+	# end def
+
+	def testbed(self, name):
+		pass
+	# end def
+
+	def testrun(self, i, total, cmd):
+		pass
+	# end def
+
+	def passed(self):
+		pass
+	# end def
+
+	def rejected(self, stream, value, reason=None):
+		'''The value of stream was rejected. reason explains why, if known
+		(e.g. the first mismatching element of a vector)'''
+		pass
+	# end def
+
+	def timedout(self, timeout):
+		pass
+	# end def
+
+	def exceeded(self, limit):
+		'''The process was killed for exceeding a limit (see LIMIT_NAMES)'''
+		pass
+	# end def
+
+	def timing(self, cputime, maxtime, statistic, runs):
+		'''CPU time of a testrun of a performance testbed (the statistic of
+		runs timed runs) and the largest one accepted, if any'''
+		pass
+	# end def
+
+	def slow(self):
+		'''The testrun was rejected for exceeding the CPU time accepted'''
+		pass
+	# end def
+
+	def stopped(self):
+		'''The testbed was stopped after a failed testrun (onerror abort/skip)'''
+		pass
+	# end def
+
+	def usage(self, usage):
+		'''Resources used by the current testrun (see common.Usage),
+		reported right before its verdict'''
+		pass
+	# end def
+
+	def testbedEnd(self, passcount, total, score, maxscore, usage=None):
+		'''End of a testbed; usage adds up the resources of its testruns'''
+		pass
+	# end def
+
+	def halted(self):
+		'''The evaluation was stopped after a failed testbed (onerror halt)'''
+		pass
+	# end def
+
+	def end(self, score, usage=None):
+		pass
+	# end def
+
+	def build(self, output=None):
+		'''Writes the report to output (or a default location) and returns its path'''
+		return None
+	# end def
+# end class
+
+
+
+# Events of Reporter, in the order they are declared
+EVENTS = ['begin', 'section', 'message', 'building', 'built', 'buildFailed',
+	'testbed', 'testrun', 'passed', 'rejected', 'timedout', 'exceeded', 'timing',
+	'slow', 'stopped', 'usage', 'testbedEnd', 'halted', 'end']
+
+
+
+class Recorder():
+	'''Forwards the events of an evaluation to reporter and records them as
+	JSON-serializable [event, args, kwargs] lists, which can be delivered
+	again to another reporter with replay'''
+	def __init__(self, reporter):
+		self._reporter = reporter
+		self._events = []
+	# end def
+
+	@property
+	def events(self):
+		return self._events
+	# end def
+
+	@property
+	def reporter(self):
+		return self._reporter
+	# end def
+
+	def __getattr__(self, name):
+		if name not in EVENTS:
+			return getattr(self._reporter, name)
+		event = getattr(self._reporter, name)
+		def record(*args, **kwargs):
+			self._events.append([name, [_encode(a) for a in args],
+				{ k: _encode(v) for k, v in kwargs.items() }])
+			return event(*args, **kwargs)
+		return record
+	# end def
+# end class
+
+
+
+def replay(events, reporter):
+	'''Delivers the events recorded by a Recorder to reporter'''
+	for name, args, kwargs in events:
+		getattr(reporter, name)(*[_decode(a) for a in args],
+			**{ k: _decode(v) for k, v in kwargs.items() })
+# end def
+
+
+
+def _clip(value):
+	'''Returns value cut down to MAX_VALUE characters and its length, or None
+	as the length if it was not cut'''
+	if isinstance(value, str) and len(value) > MAX_VALUE:
+		return value[:MAX_VALUE], len(value)
+	return value, None
+# end def
+
+
+
+def _clipnote(length):
+	return f'First {MAX_VALUE} of {length} characters shown'
+# end def
+
+
+
+def _encode(value):
+	if isinstance(value, Usage):
+		return { 'usage': value.todict() }
+	return value
+# end def
+
+
+
+def _decode(value):
+	if isinstance(value, dict) and 'usage' in value:
+		return Usage.fromdict(value['usage'])
+	return value
+# end def
+
+
+
+class PdfReporter(Reporter):
+	'''Typesets the report with LaTeX and encrypts the resulting PDF'''
+
+	extension = '.pdf'
+
+	def __init__(self, encrypt=True):
+		self._encrypt = encrypt
+		self._log = pdflog.PdfLog()
+	# end def
+
+	def begin(self, srcfile, sha1, author, date):
+		self._log = pdflog.PdfLog()
+		srcfile = os.path.basename(srcfile)
+		self._log.rawwrite('\\Large\n')
+		self._log.writeline(f'Automated evaluation report')
+		self._log.rawwrite('\\noindent\n')
+		self._log.rawwrite('\\begin{tabular}{@{} l l}\n')
+		self._log.rawwrite(f'Generated on: & {date}\\\\\n')
+		self._log.rawwrite(f'Source file:  & \\Verb^{srcfile}^\\\\\n')
+		self._log.rawwrite(f'Source sha1:  & \\Verb^{sha1}^\\\\\n')
+		self._log.rawwrite(f'Source author:& \\Verb^{author}^\\\\\n')
+		self._log.rawwrite(f'Score:        & \\ref*{{txt:score}}\\\\\n')
+		self._log.rawwrite('\\end{tabular}\n')
+		self._log.rawwrite('\\normalsize\n')
+	# end def
+
+	def section(self, title):
+		self._log.section(title)
+	# end def
+
+	def message(self, level, text):
+		{
+			'info'    : self._log.info,
+			'warning' : self._log.warning,
+			'error'   : self._log.error,
+		}.get(level, self._log.info)(text)
+	# end def
+
+	def building(self, srcfile):
+		self._log.info('Building {}'.format(os.path.basename(srcfile)))
+	# end def
+
+	def built(self, exefile, score):
+		self._log.info('Built {}'.format(os.path.basename(exefile)))
+		if score > 0:
+			self._log.writeline('Score {:+0.1f}'.format(score))
+	# end def
+
+	def buildFailed(self, srcfile):
+		self._log.warning(f'Source file {os.path.basename(srcfile)} failed to build')
+	# end def
+
+	def testbed(self, name):
+		self._log.subsection(f'Running {name}')
+	# end def
+
+	def testrun(self, i, total, cmd, width=72):
+		self._log.write(f'Test {i} of {total}: ')
+		parts = [ cmd[i:i+width] for i in range(0, len(cmd), width) ]
+		for i in range(len(parts)):
+			vc = pdflog.getVerbChar(parts[i])
+			if i > 0:
+				self._log.rawwrite('\\hspace{10em}')
+			self._log.rawwrite(f'\\Verb{ vc }{ parts[i] }{ vc }')
+			self._log.writeline()
+	# end def
+
+	def passed(self):
+		self._log.writeline('\tPass', color='OliveGreen')
+	# end def
+
+	def rejected(self, stream, value, reason=None):
+		verbatim, length = _clip(str(value).strip() if value is not None else '')
+		self._log.write(f'\t{stream} ')
+		if len(verbatim) > 0:
+			self._log.writeverbatim(verbatim)
+			self._log.writeline()
+			if length:
+				self._log.writeline(f'\t({_clipnote(length)}.)')
+		else:
+			self._log.rawwrite(': (none). ')
+		if reason:
+			self._log.writeline(f'\t{reason}.')
+
+		self._log.writeline('REJECTED!', color='YellowOrange')
+	# end def
+
+	def timedout(self, timeout):
+		unit = 'second'
+		if timeout >= 60:
+			timeout/= 60
+			unit = 'minute'
+		elif timeout < 1:
+			timeout*= 1000
+			unit = 'millisecond'
+		if (timeout//1) != 1:
+			unit+= 's'
+		self._log.writeline(f'\tExecution timed out after {timeout:0.0f} {unit}.')
+		self._log.writeline('\tTIMEOUT!', color='YellowOrange')
+		self._log.writeline('\tTestbed aborted')
+	# end def
+
+	def exceeded(self, limit):
+		self._log.writeline(f'\t{LIMIT_NAMES.get(limit, limit)} limit exceeded.')
+		self._log.writeline('\tREJECTED!', color='YellowOrange')
+	# end def
+
+	def timing(self, cputime, maxtime, statistic, runs):
+		s = f'\tCPU time: {cputime:0.3f} s ({statistic} of {runs} runs)'
+		if maxtime is not None:
+			s+= f', limit {maxtime:0.3f} s'
+		self._log.writeline(s)
+	# end def
+
+	def slow(self):
+		self._log.writeline('\tTOO SLOW!', color='YellowOrange')
+	# end def
+
+	def stopped(self):
+		self._log.rawwrite('\\medskip\n')
+		self._log.writeline('Program did not pass the previous required test.')
+		self._log.writeline('Test set aborted.') # , color='Maroon'
+	# end def
+
+	def testbedEnd(self, passcount, total, score, maxscore, usage=None):
+		self._log.rawwrite('\\medskip{\\bfseries Summary}\\\\\n')
+		self._log.writeline(f'Passed {passcount} of {total} tests')
+		self._log.writeline('Score {:+0.1f} of {}'.format(score, maxscore))
+		if usage:
+			self._log.writeline(f'Resources: {usage}')
+	# end def
+
+	def halted(self):
+		self._log.rawwrite('\\medskip\n')
+		self._log.writeline('Program did not pass all required tests.')
+		self._log.writeline('Evaluation halted.') # , color='Maroon'
+	# end def
+
+	def end(self, score, usage=None):
+		self._log.section('Score')
+		self._log.rawwrite(f'Final score: \\labeltext{{{score}}}{{txt:score}}')
+		self._log.writeline()
+		if usage:
+			self._log.writeline(f'Resources: {usage}')
+	# end def
+
+	def build(self, output=None):
+		name = os.path.splitext(os.path.basename(output))[0] if output else None
+		report = self._log.build(name, output)
+		if not report:
+			return None
+		if self._encrypt:
+			pdflog.encrypt_pdf(report)
+		return report
+	# end def
+# end class
+
+
+
+class JsonReporter(Reporter):
+	'''Writes one JSON object per event (JSON lines). Events are also written
+	to stream as soon as they occur when one is given (e.g. sys.stdout)'''
+
+	extension = '.jsonl'
+
+	def __init__(self, stream=None):
+		self._stream = stream
+		self._events = []
+		self._testbed = None
+		self._testrun = None
+	# end def
+
+	def _emit(self, event, **kwargs):
+		d = { 'event': event }
+		d.update(kwargs)
+		line = json.dumps(d, ensure_ascii=False)
+		self._events.append(line)
+		if self._stream:
+			print(line, file=self._stream, flush=True)
+	# end def
+
+	def _verdict(self, verdict, **kwargs):
+		self._emit(verdict, testbed=self._testbed, testrun=self._testrun, **kwargs)
+	# end def
+
+	def begin(self, srcfile, sha1, author, date):
+		self._events = []
+		self._emit('begin', source=os.path.basename(srcfile), sha1=sha1, author=author, date=date)
+	# end def
+
+	def section(self, title):
+		self._emit('section', title=title)
+	# end def
+
+	def message(self, level, text):
+		self._emit('message', level=level, text=text)
+	# end def
+
+	def building(self, srcfile):
+		self._emit('building', source=os.path.basename(srcfile))
+	# end def
+
+	def built(self, exefile, score):
+		self._emit('built', program=os.path.basename(exefile), score=score)
+	# end def
+
+	def buildFailed(self, srcfile):
+		self._emit('buildfailed', source=os.path.basename(srcfile))
+	# end def
+
+	def testbed(self, name):
+		self._testbed = name
+		self._emit('testbed', name=name)
+	# end def
+
+	def testrun(self, i, total, cmd):
+		self._testrun = i
+		self._emit('testrun', testbed=self._testbed, index=i, total=total, command=cmd)
+	# end def
+
+	def passed(self):
+		self._verdict('pass')
+	# end def
+
+	def rejected(self, stream, value, reason=None):
+		kwargs = { 'stream': stream }
+		kwargs['value'], length = _clip(value)
+		if length:
+			kwargs['length'] = length
+		if reason:
+			kwargs['reason'] = reason
+		self._verdict('reject', **kwargs)
+	# end def
+
+	def timedout(self, timeout):
+		self._verdict('timeout', timeout=timeout)
+	# end def
+
+	def exceeded(self, limit):
+		self._verdict('limit', limit=limit)
+	# end def
+
+	def timing(self, cputime, maxtime, statistic, runs):
+		self._verdict('timing', cputime=cputime, maxtime=maxtime, statistic=statistic, runs=runs)
+	# end def
+
+	def slow(self):
+		self._verdict('slow')
+	# end def
+
+	def stopped(self):
+		self._emit('stopped', testbed=self._testbed)
+	# end def
+
+	def usage(self, usage):
+		self._verdict('usage', **usage.todict())
+	# end def
+
+	def testbedEnd(self, passcount, total, score, maxscore, usage=None):
+		self._emit('testbedend', testbed=self._testbed, passed=passcount,
+			total=total, score=score, maxscore=maxscore,
+			usage=usage.todict() if usage else None)
+	# end def
+
+	def halted(self):
+		self._emit('halted', testbed=self._testbed)
+	# end def
+
+	def end(self, score, usage=None):
+		self._emit('score', score=score, usage=usage.todict() if usage else None)
+	# end def
+
+	def build(self, output=None):
+		'''Writes the events to output, unless they were written to the
+		stream already (output is then the file of the stream)'''
+		if not output:
+			return None
+		if self._stream:
+			return output
+		with open(output, 'w', encoding='utf-8') as f:
+			for line in self._events:
+				f.write(line + '\n')
+		return output
+	# end def
+# end class
+
+
+
+class _TreeReporter(Reporter):
+	'''Base of the reporters that build their output from a tree of results:
+	a list of testbeds, each a dict with a list of testruns (also dicts)'''
+
+	def begin(self, srcfile, sha1, author, date):
+		self._info = {
+			'source' : os.path.basename(srcfile),
+			'sha1'   : sha1,
+			'author' : author,
+			'date'   : date,
+		}
+		self._messages = []
+		self._testbeds = []
+		self._score = None
+		self._usage = None
+	# end def
+
+	def message(self, level, text):
+		self._messages.append( (level, text) )
+	# end def
+
+	def built(self, exefile, score):
+		self._messages.append( ('info', 'Built {}'.format(os.path.basename(exefile))) )
+	# end def
+
+	def buildFailed(self, srcfile):
+		self._messages.append( ('warning', f'Source file {os.path.basename(srcfile)} failed to build') )
+	# end def
+
+	def testbed(self, name):
+		self._testbeds.append({ 'name': name, 'testruns': [], 'notes': [] })
+	# end def
+
+	def testrun(self, i, total, cmd):
+		self._testbeds[-1]['testruns'].append({ 'index': i, 'command': cmd, 'verdict': None })
+	# end def
+
+	def passed(self):
+		self._testbeds[-1]['testruns'][-1]['verdict'] = 'pass'
+	# end def
+
+	def rejected(self, stream, value, reason=None):
+		tr = self._testbeds[-1]['testruns'][-1]
+		tr['verdict'] = 'reject'
+		tr['stream'] = stream
+		tr['value'], tr['length'] = _clip('' if value is None else str(value))
+		tr['reason'] = reason
+	# end def
+
+	def timedout(self, timeout):
+		tr = self._testbeds[-1]['testruns'][-1]
+		tr['verdict'] = 'timeout'
+		tr['timeout'] = timeout
+	# end def
+
+	def exceeded(self, limit):
+		tr = self._testbeds[-1]['testruns'][-1]
+		tr['verdict'] = 'limit'
+		tr['limit'] = LIMIT_NAMES.get(limit, limit)
+	# end def
+
+	def timing(self, cputime, maxtime, statistic, runs):
+		self._testbeds[-1]['testruns'][-1]['timing'] = (cputime, maxtime, statistic, runs)
+	# end def
+
+	def slow(self):
+		self._testbeds[-1]['testruns'][-1]['verdict'] = 'slow'
+	# end def
+
+	def stopped(self):
+		self._testbeds[-1]['notes'].append('Test set aborted.')
+	# end def
+
+	def usage(self, usage):
+		self._testbeds[-1]['testruns'][-1]['usage'] = usage
+	# end def
+
+	def testbedEnd(self, passcount, total, score, maxscore, usage=None):
+		self._testbeds[-1].update({
+			'passed'   : passcount,
+			'total'    : total,
+			'score'    : score,
+			'maxscore' : maxscore,
+			'usage'    : usage,
+		})
+	# end def
+
+	def halted(self):
+		self._testbeds[-1]['notes'].append('Evaluation halted.')
+	# end def
+
+	def end(self, score, usage=None):
+		self._score = score
+		self._usage = usage
+	# end def
+# end class
+
+
+
+class JUnitReporter(_TreeReporter):
+	'''Writes a JUnit XML report with one testsuite per testbed'''
+
+	extension = '.xml'
+
+	def build(self, output=None):
+		if not output:
+			return None
+		root = ET.Element('testsuites', name=self._info['source'])
+		props = ET.SubElement(root, 'properties')
+		JUnitReporter._property(props, 'score', self._score)
+		if self._usage:
+			for name, value in self._usage.todict().items():
+				JUnitReporter._property(props, name, value)
+			root.set('time', f'{self._usage.walltime:0.3f}')
+		for tb in self._testbeds:
+			suite = ET.SubElement(root, 'testsuite', name=tb['name'])
+			failures = errors = 0
+			for tr in tb['testruns']:
+				case = ET.SubElement(suite, 'testcase', classname=tb['name'],
+					name=f'Test {tr["index"]}: {tr["command"]}')
+				if tr.get('usage'):
+					case.set('time', f'{tr["usage"].walltime:0.3f}')
+				if tr['verdict'] == 'reject':
+					failures+= 1
+					message = f'{tr["stream"]} rejected'
+					if tr['reason']:
+						message+= f': {tr["reason"]}'
+					f = ET.SubElement(case, 'failure', message=message)
+					f.text = tr['value']
+					if tr['length']:
+						f.text+= f'\n[{_clipnote(tr["length"])}]'
+				elif tr['verdict'] == 'timeout':
+					errors+= 1
+					ET.SubElement(case, 'error', message=f'Timed out after {tr["timeout"]} s')
+				elif tr['verdict'] == 'limit':
+					failures+= 1
+					ET.SubElement(case, 'failure', message=f'{tr["limit"]} limit exceeded')
+				elif tr['verdict'] == 'slow':
+					failures+= 1
+					cputime, maxtime, statistic, runs = tr['timing']
+					ET.SubElement(case, 'failure',
+						message=f'CPU time {cputime:0.3f} s exceeds {maxtime:0.3f} s')
+			suite.set('tests', str(len(tb['testruns'])))
+			suite.set('failures', str(failures))
+			suite.set('errors', str(errors))
+			if tb.get('usage'):
+				suite.set('time', f'{tb["usage"].walltime:0.3f}')
+		ET.ElementTree(root).write(output, encoding='utf-8', xml_declaration=True)
+		return output
+	# end def
+
+	@staticmethod
+	def _property(props, name, value):
+		prop = ET.SubElement(props, 'property')
+		prop.set('name', name)
+		prop.set('value', str(value))
+	# end def
+# end class
+
+
+
+class HtmlReporter(_TreeReporter):
+	'''Writes a self-contained static HTML report'''
+
+	extension = '.html'
+
+	__style = '''
+		body { font-family: sans-serif; max-width: 50em; margin: 2em auto; }
+		code, pre { background: #f4f4f4; padding: 0 .2em; }
+		.pass { color: #3c8031; } .reject, .timeout { color: #c66c00; }
+		.note { font-style: italic; } .usage { color: #808080; font-size: small; }
+	'''
+
+	def build(self, output=None):
+		if not output:
+			return None
+		e = html.escape
+		lines = [
+			'<!DOCTYPE html>',
+			'<html><head><meta charset="utf-8">',
+			f'<title>Evaluation report: {e(self._info["source"])}</title>',
+			f'<style>{HtmlReporter.__style}</style>',
+			'</head><body>',
+			'<h1>Automated evaluation report</h1>',
+			'<table>',
+			f'<tr><td>Generated on:</td><td>{e(self._info["date"])}</td></tr>',
+			f'<tr><td>Source file:</td><td><code>{e(self._info["source"])}</code></td></tr>',
+			f'<tr><td>Source sha1:</td><td><code>{e(self._info["sha1"])}</code></td></tr>',
+			f'<tr><td>Source author:</td><td><code>{e(self._info["author"])}</code></td></tr>',
+			f'<tr><td>Score:</td><td>{e(str(self._score))}</td></tr>',
+			'</table>',
+			'<h2>Build</h2>',
+		]
+		for level, text in self._messages:
+			lines.append(f'<p class="{e(level)}">{e(text)}</p>')
+		for tb in self._testbeds:
+			lines.append(f'<h2>Running {e(tb["name"])}</h2>')
+			lines.append('<ol>')
+			for tr in tb['testruns']:
+				lines.append(f'<li><code>{e(tr["command"])}</code> ' + HtmlReporter._verdict(tr) +
+					HtmlReporter._usage(tr.get('usage')) + '</li>')
+			lines.append('</ol>')
+			for note in tb['notes']:
+				lines.append(f'<p class="note">{e(note)}</p>')
+			if 'total' in tb:
+				lines.append(f'<p>Passed {tb["passed"]} of {tb["total"]} tests. '
+					'Score {:+0.1f} of {}</p>'.format(tb['score'], tb['maxscore']))
+			if tb.get('usage'):
+				lines.append(f'<p>Resources: {e(str(tb["usage"]))}</p>')
+		lines.append(f'<h2>Score</h2><p>Final score: {e(str(self._score))}</p>')
+		if self._usage:
+			lines.append(f'<p>Resources: {e(str(self._usage))}</p>')
+		lines.append('</body></html>')
+		with open(output, 'w', encoding='utf-8') as f:
+			f.write('\n'.join(lines) + '\n')
+		return output
+	# end def
+
+	@staticmethod
+	def _verdict(tr):
+		e = html.escape
+		if tr['verdict'] == 'pass':
+			return '<span class="pass">Pass</span>'
+		if tr['verdict'] == 'timeout':
+			return f'<span class="timeout">TIMEOUT after {tr["timeout"]} s</span>'
+		if tr['verdict'] == 'limit':
+			return f'<span class="reject">{e(tr["limit"])} limit exceeded</span>'
+		if tr['verdict'] == 'slow':
+			cputime, maxtime, statistic, runs = tr['timing']
+			return f'<span class="reject">TOO SLOW: {cputime:0.3f} s of CPU time ({e(statistic)}), ' + \
+				f'limit {maxtime:0.3f} s</span>'
+		if tr['verdict'] == 'reject':
+			reason = f' ({e(tr["reason"])})' if tr['reason'] else ''
+			clipped = f'<p class="note">{_clipnote(tr["length"])}</p>' if tr['length'] else ''
+			return f'<span class="reject">{e(tr["stream"])} REJECTED{reason}</span>' + \
+				f'<pre>{e(tr["value"]) or "(none)"}</pre>' + clipped
+		return ''
+	# end def
+
+	@staticmethod
+	def _usage(usage):
+		if not usage:
+			return ''
+		return ' <span class="usage">({:0.3f} s, {:0.1f} MiB)</span>'.format(
+			usage.walltime, usage.maxrss / 1024**2)
+	# end def
+# end class
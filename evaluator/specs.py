@@ -10,50 +10,221 @@
 # ## ###############################################################
 
 # from .evaluator import Evaluator
+import gc
 import re
 import os
+import json
+import math
 import shlex
+import pickle
+import random
+import hashlib
+import tempfile
+import xml.etree.ElementTree as ET
 from abc import abstractmethod
-from xml.dom import minidom
-from .common import error, warn
+from .common import error, warn, parsesize, cachedir
+from .cache import filedigest
 from .vfuncs import parse as vfparse
-from xml.dom.minicompat import NodeList
-from xml.dom.minidom import Element, Text
 
-def from_xml(file):
+# Bump when the pickled Specs objects change so stale cached specs are ignored
+SPECS_CACHE_VERSION = 6
+
+
+def from_xml(file, cache=True):
+	'''Loads the specs in the given XML file. Unless cache is False, specs
+	are loaded from (and stored in) a cache of parsed specs keyed on the
+	contents of the file'''
 	if not os.path.isfile(file):
 		error(f'File {file} not found.')
 		return None
-	doc = minidom.parse(file)
-	conf = doc.getElementsByTagName('testconf')
-	if not conf or len(conf) < 1:
-		error(f'Malformed document {file}. Expected <testconf>.')
-		return None
-	if not 'language' in conf[0].attributes:
+	# Loading creates lots of long-lived objects which the garbage collector
+	# would otherwise scan over and over
+	gcenabled = gc.isenabled()
+	gc.disable()
+	digest = filedigest(file)
+	try:
+		key = _cachekey(file, digest) if cache else None
+		specs = _fetch(key) if key else None
+		if not specs:
+			specs = _parse(file)
+			if key and specs:
+				_store(key, specs)
+	finally:
+		if gcenabled:
+			gc.enable()
+	if specs:
+		specs.directory = os.path.dirname(os.path.abspath(file))
+		specs.digest = _digest(digest, specs.files)
+	return specs
+# end def
+
+
+
+def _digest(digest, files):
+	'''Digest of the specs file (given) along with the files it refers to'''
+	s = digest
+	for path in files:
+		s+= f'\0{path}\0' + (filedigest(path) if os.path.isfile(path) else '')
+	return hashlib.sha256(s.encode('utf-8')).hexdigest()
+# end def
+
+
+
+def _parse(file):
+	# Testruns are parsed as soon as their element ends and then dropped, so
+	# the document is never held in memory as a whole
+	conf = None
+	testbeds = []
+	testbed = None
+	limits = {}
+	files = set()
+	depth = 0
+	directory = os.path.dirname(os.path.abspath(file))
+	for event, elem in ET.iterparse(file, events=('start', 'end')):
+		if event == 'start':
+			if conf is None:
+				if elem.tag != 'testconf':
+					error(f'Malformed document {file}. Expected <testconf>.')
+					return None
+				conf = elem
+			elif elem.tag == 'testbeds':
+				depth+= 1
+			elif elem.tag == 'testbed' and depth > 0 and testbed is None:
+				testbed = Testbed.parse(elem.attrib)
+				limits = parselimits(elem.attrib)
+			continue
+
+		if elem.tag == 'testrun' and testbed is not None:
+			try:
+				tr = TestRun.parse(elem.attrib, directory)
+			except ValueError as err:
+				error(f'Malformed <testrun> in {file}. {err}')
+				return None
+			except ImportError as err:
+				error(f'Cannot load {file}. {err}')
+				return None
+			for name in limits:
+				tr.limits.setdefault(name, limits[name])
+			files.update(tr.files)
+			testbed.add(tr)
+			elem.clear()
+		elif elem.tag == 'testgen' and testbed is not None:
+			try:
+				gen = TestGen.parse(elem, directory)
+			except ValueError as err:
+				error(f'Malformed <testgen> in {file}. {err}')
+				return None
+			except ImportError as err:
+				error(f'Cannot load {file}. {err}')
+				return None
+			gen.limits.update(limits)
+			files.update(gen.files)
+			testbed.add(gen)
+			elem.clear()
+		elif elem.tag == 'testbed' and testbed is not None:
+			testbeds.append(testbed)
+			testbed = None
+			elem.clear()
+		elif elem.tag == 'testbeds':
+			depth-= 1
+
+	if not 'language' in conf.attrib:
 		error(f'Malformed document {file}. Expected a language attribute.')
 		return None
-	lang = conf[0].attributes['language'].value.lower().strip()
+	lang = conf.attrib['language'].lower().strip()
 
 	if lang == 'c':
-		return CSpecs(conf[0])
+		specs = CSpecs(conf, testbeds)
 	elif lang == 'c++':
-		return CPPSpecs(conf[0])
+		specs = CPPSpecs(conf, testbeds)
 	elif lang == 'python':
-		return PySpecs(conf[0])
+		specs = PySpecs(conf, testbeds)
 	else:
 		error(f'Unsupported language {lang}.')
 		return None
+	specs._files = sorted(files)
+	return specs
+# end def
+
+
+
+def _cachekey(file, digest):
+	# Validation functions may refer to files next to the XML file
+	directory = os.path.dirname(os.path.abspath(file))
+	s = f'{SPECS_CACHE_VERSION}\0{digest}\0{directory}'
+	return hashlib.sha256(s.encode('utf-8')).hexdigest()
+# end def
+
+
+
+def _fetch(key):
+	try:
+		with open(cachedir('specs', f'{key}.pickle'), 'rb') as f:
+			specs = pickle.load(f)
+	except Exception:
+		return None
+	return specs if isinstance(specs, Specs) else None
+# end def
+
+
+
+def _store(key, specs):
+	directory = cachedir('specs')
+	try:
+		os.makedirs(directory, exist_ok=True)
+		fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp')
+	except OSError:
+		return
+	try:
+		with os.fdopen(fd, 'wb') as f:
+			pickle.dump(specs, f, protocol=pickle.HIGHEST_PROTOCOL)
+		os.replace(tmp, os.path.join(directory, f'{key}.pickle'))
+	except (OSError, pickle.PicklingError) as err:
+		warn(f'Failed to cache specs: {err}')
+		if os.path.exists(tmp):
+			os.remove(tmp)
+# end def
+
+
+
+def parsebool(value):
+	return value.strip().lower() not in ['false', 'no', 'off', '0']
+# end def
+
+
+
+# Attributes of <testbed> and <testrun> limiting the resources of a testrun,
+# mapped to the name of the limit and the function parsing its value
+LIMIT_ATTRIBUTES = {
+	'coutlimit' : ('cout',      parsesize),
+	'cerrlimit' : ('cerr',      parsesize),
+	'cpulimit'  : ('cpu',       float),
+	'memlimit'  : ('memory',    parsesize),
+	'proclimit' : ('processes', int),
+	'filelimit' : ('filesize',  parsesize),
+}
+
+def parselimits(attributes):
+	limits = {}
+	for attr in LIMIT_ATTRIBUTES:
+		if attr in attributes:
+			name, parse = LIMIT_ATTRIBUTES[attr]
+			limits[name] = parse(attributes[attr])
+	return limits
 # end def
 
 
 
 class Specs():
-	def __init__(self, domconf):
+	def __init__(self, conf):
 		self._buildTool = None
 		self._buildFlags = []
 		self._buildScore = 0
 		self._lang = None
 		self._testbeds = []
+		self._dir = os.getcwd()
+		self._digest = None
+		self._files = []
 	# end def
 
 
@@ -63,6 +234,34 @@ class Specs():
 	# end def
 
 
+	@property
+	def directory(self):
+		'''Directory of the specs file, base of the relative paths in it'''
+		return self._dir
+	@directory.setter
+	def directory(self, value):
+		self._dir = value
+	# end def
+
+
+	@property
+	def digest(self):
+		'''Digest of the specs file and of the files it refers to (see
+		files), None if unknown'''
+		return self._digest
+	@digest.setter
+	def digest(self, value):
+		self._digest = value
+	# end def
+
+
+	@property
+	def files(self):
+		'''Files read by the validation functions of the testruns'''
+		return self._files
+	# end def
+
+
 	@property
 	@abstractmethod
 	def compiled(self):
@@ -102,103 +301,48 @@ class Specs():
 
 
 	def _parseBuild(self, conf):
-		build = conf.getElementsByTagName('build')
-		if not build or (build is None) or (len(build) < 1):
+		build = conf.find('.//build')
+		if build is None:
 			return
-		if 'score' in build[0].attributes:
-			self._buildScore = float(build[0].attributes['score'].value)
+		if 'score' in build.attrib:
+			self._buildScore = float(build.attrib['score'])
 
-		flags = build[0].getElementsByTagName('flags')
-		if not isinstance(flags, NodeList) or (len(flags) < 1):
+		flags = build.find('.//flags')
+		if flags is None or not flags.text:
 			return
-		if not isinstance(flags[0], Element):
-			return
-		if not isinstance(flags[0].firstChild, Text):
-			return
-		self._buildFlags = flags[0].firstChild.data
+		self._buildFlags = flags.text
 	# end def
 
 
 	def _parseInterpreter(self, conf):
-		inters = conf.getElementsByTagName('interpreter')
-		if not inters or len(inters) < 1:
+		inter = conf.find('.//interpreter')
+		if inter is None:
 			return
-		self._interpreter = inters[0].firstChild.nodeValue
+		self._interpreter = inter.text
 	# end def
 
 
-	def _parseTestbeds(self, conf):
-		tbl = conf.getElementsByTagName('testbeds')
-		if not tbl or len(tbl) != 1:
-			return
-
-		tbl = tbl[0].getElementsByTagName('testbed')
-		if not tbl or len(tbl) < 1:
-			return
-
+	def _parseTestbeds(self, testbeds):
 		i = 0
-		for tbi in tbl:
+		for tb in testbeds:
 			i+= 1
-			tb = self.__parseTestbed(tbi)
 			if not tb.name:
 				# tb.name = f'Testing set {i}' if i < 2 else 'Main testing set'
 				tb.name = f'Testset {i}'
-			if len(tb.testruns) > 1:
+			if len(tb) > 1:
 				self._testbeds.append(tb)
 	# end def
-
-
-	@staticmethod
-	def __parseTestbed(tbe):
-		tb = Testbed()
-		tb.name = None
-		if 'score' in tbe.attributes:
-			tb.score = float(tbe.attributes['score'].value)
-
-		if 'name' in tbe.attributes:
-			tb.name = tbe.attributes['name'].value
-
-		if 'type' in tbe.attributes:
-			tb.type = tbe.attributes['type'].value
-
-		if 'onerror' in tbe.attributes:
-			tb.onError = tbe.attributes['onerror'].value
-
-		tb.testruns.extend(Specs.__parseTestruns(tbe))
-		return tb
-	# end def
-
-
-	@staticmethod
-	def __parseTestruns(tbe):
-		trl = tbe.getElementsByTagName('testrun')
-		if not trl or len(trl) < 1:
-			return []
-
-		testruns = []
-		for tre in trl:
-			tr = Specs.__parseTestrun(tre)
-			if tr:
-				testruns.append(tr)
-		return testruns
-	# end def
-
-
-	@staticmethod
-	def __parseTestrun(tre):
-		return TestRun.parse(tre)
-	# end def
 # end class
 
 
 
 class CSpecs(Specs):
-	def __init__(self, domconf):
-		Specs.__init__(self, domconf)
+	def __init__(self, conf, testbeds=[]):
+		Specs.__init__(self, conf)
 		self._lang = 'C'
 		self._buildTool = 'gcc'
-		self._parseBuild(domconf)
-		self._parseTestbeds(domconf)
+		self._parseBuild(conf)
+		self._parseTestbeds(testbeds)
 	# end def
 
 	@property
@@ -215,12 +359,12 @@ class CSpecs(Specs):
 
 
 class CPPSpecs(Specs):
-	def __init__(self, domconf):
-		Specs.__init__(self, domconf)
+	def __init__(self, conf, testbeds=[]):
+		Specs.__init__(self, conf)
 		self._lang = 'C++'
 		self._buildTool = 'g++'
-		self._parseBuild(domconf)
-		self._parseTestbeds(domconf)
+		self._parseBuild(conf)
+		self._parseTestbeds(testbeds)
 	# end def
 
 	@property
@@ -237,18 +381,18 @@ class CPPSpecs(Specs):
 
 
 class PySpecs(Specs):
-	def __init__(self, domconf):
-		Specs.__init__(self, domconf)
+	def __init__(self, conf, testbeds=[]):
+		Specs.__init__(self, conf)
 		self._lang = 'Python'
 		self._interpreter = 'python3'
-		self._parseBuild(domconf)
-		self._parseInterpreter(domconf)
-		self._parseTestbeds(domconf)
+		self._parseBuild(conf)
+		self._parseInterpreter(conf)
+		self._parseTestbeds(testbeds)
 		self._buildTool = self._interpreter
 	# end def
 
-	def _parseInterpreter(self, domconf):
-		super()._parseInterpreter(domconf)
+	def _parseInterpreter(self, conf):
+		super()._parseInterpreter(conf)
 		if not isinstance(self._interpreter, str):
 			self._interpreter = 'python3'
 		self._interpreter = self._interpreter.lower()
@@ -275,7 +419,73 @@ class Testbed(Specs):
 		self._name = 'Testing set'
 		self._type = None
 		self._onError = 'halt'
+		self._deterministic = True
+		self._repeat = 5
+		self._warmup = 1
+		self._statistic = 'median'
+		self._reference = None
+		self._factor = 2
 		self._testruns = []
+		self._count = 0
+	# end def
+
+	@property
+	def repeat(self):
+		'''Number of timed runs of each testrun of a performance testbed'''
+		return self._repeat
+	@repeat.setter
+	def repeat(self, value):
+		self._repeat = max(1, value)
+	# end def
+
+	@property
+	def warmup(self):
+		'''Number of untimed runs preceding the timed ones'''
+		return self._warmup
+	@warmup.setter
+	def warmup(self, value):
+		self._warmup = max(0, value)
+	# end def
+
+	@property
+	def statistic(self):
+		'''Statistic of the CPU times of the timed runs compared against the
+		limit: median, mean, min, max or a percentile such as p90'''
+		return self._statistic
+	@statistic.setter
+	def statistic(self, value):
+		value = value.strip().lower()
+		if not re.match(r'^(median|mean|min|max|p\d{1,2})$', value):
+			warn(f'Unsupported statistic {value}. Using median.')
+			value = 'median'
+		self._statistic = value
+	# end def
+
+	@property
+	def reference(self):
+		'''Source of the reference implementation whose CPU times, multiplied
+		by factor, are the limits of the testruns with no maxtime'''
+		return self._reference
+	@reference.setter
+	def reference(self, value):
+		self._reference = value
+	# end def
+
+	@property
+	def factor(self):
+		return self._factor
+	@factor.setter
+	def factor(self, value):
+		self._factor = value
+	# end def
+
+	@property
+	def deterministic(self):
+		'''Whether the results of the testruns can be memoized'''
+		return self._deterministic
+	@deterministic.setter
+	def deterministic(self, value):
+		self._deterministic = value
 	# end def
 
 	@property
@@ -304,8 +514,16 @@ class Testbed(Specs):
 
 	@property
 	def testruns(self):
+		'''Testruns and testrun generators (see TestGen) of the testbed.
+		Iterate the testbed for its testruns, generated ones included'''
 		return self._testruns
 
+	def add(self, testrun):
+		'''Appends a TestRun or a TestGen to the testbed'''
+		self._testruns.append(testrun)
+		self._count+= len(testrun) if isinstance(testrun, TestGen) else 1
+	# end def
+
 	@property
 	def type(self):
 		return self._type
@@ -315,24 +533,65 @@ class Testbed(Specs):
 	# end def
 
 	def __len__(self):
-		return len(self.testruns)
+		return self._count
 	# end def
 
 	def __iter__(self):
-		return self.testruns.__iter__()
+		for t in self._testruns:
+			if isinstance(t, TestGen):
+				yield from t
+			else:
+				yield t
 	# end def
 
 	def __str__(self):
 		return self._name
 	# end def
 
+	@staticmethod
+	def parse(attributes):
+		'''Creates a testbed (with no testruns) from the attributes of its element'''
+		tb = Testbed()
+		tb.name = None
+		if 'score' in attributes:
+			tb.score = float(attributes['score'])
+
+		if 'name' in attributes:
+			tb.name = attributes['name']
+
+		if 'type' in attributes:
+			tb.type = attributes['type']
+
+		if 'onerror' in attributes:
+			tb.onError = attributes['onerror']
+
+		if 'deterministic' in attributes:
+			tb.deterministic = parsebool(attributes['deterministic'])
+
+		if 'repeat' in attributes:
+			tb.repeat = int(attributes['repeat'])
+
+		if 'warmup' in attributes:
+			tb.warmup = int(attributes['warmup'])
+
+		if 'statistic' in attributes:
+			tb.statistic = attributes['statistic']
+
+		if 'reference' in attributes:
+			tb.reference = attributes['reference']
+
+		if 'factor' in attributes:
+			tb.factor = float(attributes['factor'])
+		return tb
+	# end def
+
 	def __repr__(self):
 		return '<Testbed:' +               \
 			f'name=\'{self.name}\', ' +    \
 			f'score={self.score}, ' +      \
 			f'type={self.type}, ' +        \
 			f'onerror={self.type}, ' +     \
-			f'testruns={len(self.testruns)}>'
+			f'testruns={len(self)}>'
 	# end def
 # end class
 
@@ -348,6 +607,34 @@ class TestRun():
 		self._retvalCheckFunc = None
 		self._retval = 0
 		self._timeout = 5
+		self._maxtime = None
+		self._limits = {}
+		self._directory = None
+		self._intern = True
+		self._error = None
+	# end def
+
+	@property
+	def error(self):
+		'''Why the testrun could not be generated (see TestGen), in which
+		case it is not executed and fails, None otherwise'''
+		return self._error
+	# end def
+
+	@property
+	def directory(self):
+		'''Directory where the files used by the validation functions (e.g.
+		the expected values of allclose) are looked up'''
+		return self._directory
+	@directory.setter
+	def directory(self, value):
+		self._directory = value
+	# end def
+
+	@property
+	def limits(self):
+		'''Resource limits of the testrun, e.g. { 'cout': 1024 } (bytes)'''
+		return self._limits
 	# end def
 
 	@property
@@ -356,7 +643,8 @@ class TestRun():
 	@args.setter
 	def args(self, value):
 		if isinstance(value, str):
-			value = shlex.split(value)
+			# shlex is slow and only needed for quotes and escapes
+			value = shlex.split(value) if re.search(r'[\'"\\]', value) else value.split()
 		self._args = value
 	# end def
 
@@ -367,7 +655,7 @@ class TestRun():
 	def cout(self, value):
 		if isinstance(value, str):
 			self._cout = value
-			self._coutCheckFunc = vfparse(value)
+			self._coutCheckFunc = vfparse(value, self._directory, self._intern)
 	# end def
 
 	@property
@@ -377,7 +665,7 @@ class TestRun():
 	def cerr(self, value):
 		if isinstance(value, str):
 			self._cerr = value
-			self._cerrCheckFunc = vfparse(value)
+			self._cerrCheckFunc = vfparse(value, self._directory, self._intern)
 	# end def
 
 	@property
@@ -387,7 +675,7 @@ class TestRun():
 	def retval(self, value):
 		if isinstance(value, str):
 			self._retval = value
-			self._retvalCheckFunc = vfparse(value)
+			self._retvalCheckFunc = vfparse(value, self._directory, self._intern)
 	# end def
 
 	@property
@@ -398,6 +686,42 @@ class TestRun():
 		self._timeout = value
 	# end def
 
+	@property
+	def maxtime(self):
+		'''Largest CPU time in seconds accepted in performance testbeds'''
+		return self._maxtime
+	@maxtime.setter
+	def maxtime(self, value):
+		self._maxtime = value
+	# end def
+
+	@property
+	def key(self):
+		'''Canonical hash of the parameters that define the execution'''
+		d = {
+			'args'    : self._args or [],
+			'timeout' : self._timeout,
+		}
+		s = json.dumps(d, sort_keys=True)
+		return hashlib.sha256(s.encode('utf-8')).hexdigest()
+	# end def
+
+	@property
+	def files(self):
+		'''Files read by the validation functions (see VFunc.files)'''
+		funcs = [ self._coutCheckFunc, self._cerrCheckFunc, self._retvalCheckFunc ]
+		return [ path for f in funcs if f for path in f.files ]
+	# end def
+
+	def earlyChecks(self):
+		'''New early checks of the stdout and stderr of an execution of
+		the testrun (see vfuncs.EarlyCheck), None where not supported'''
+		return (
+			self._coutCheckFunc.early() if self._coutCheckFunc else None,
+			self._cerrCheckFunc.early() if self._cerrCheckFunc else None,
+		)
+	# end def
+
 	def checkCout(self, value):
 		if self._coutCheckFunc:
 			return self._coutCheckFunc(value)
@@ -416,26 +740,225 @@ class TestRun():
 		return True
 	# end def
 
+	def explainCout(self, value):
+		'''Explains why value was rejected as stdout, if possible'''
+		if self._coutCheckFunc:
+			return self._coutCheckFunc.explain(value)
+		return None
+	# end def
+
+	def explainCerr(self, value):
+		'''Explains why value was rejected as stderr, if possible'''
+		if self._cerrCheckFunc:
+			return self._cerrCheckFunc.explain(value)
+		return None
+	# end def
+
 
 	@staticmethod
-	def parse(tre):
+	def parse(attributes, directory=None, intern=True):
+		'''Creates a testrun from the attributes of its element. Validation
+		functions are shared with other testruns unless intern is False'''
 		tr = TestRun()
-		if 'args' in tre.attributes:
-			tr.args = tre.attributes['args'].value
+		tr.directory = directory
+		tr._intern = intern
+		if 'args' in attributes:
+			tr.args = attributes['args']
+
+		if 'cout' in attributes:
+			tr.cout = attributes['cout']
 
-		if 'cout' in tre.attributes:
-			tr.cout = tre.attributes['cout'].value
+		if 'cerr' in attributes:
+			tr.cerr = attributes['cerr']
 
-		if 'cerr' in tre.attributes:
-			tr.cerr = tre.attributes['cerr'].value
+		if 'retval' in attributes:
+			tr.retval = int(attributes['retval'])
 
-		if 'retval' in tre.attributes:
-			tr.retval = int(tre.attributes['retval'].value)
+		if 'timeout' in attributes:
+			tr.timeout = float(attributes['timeout'])
 
-		if 'timeout' in tre.attributes:
-			tr.timeout = float(tre.attributes['timeout'].value)
+		if 'maxtime' in attributes:
+			tr.maxtime = float(attributes['maxtime'])
 
+		tr.limits.update(parselimits(attributes))
 		return tr
 	# end def
 # end class
 
+
+
+
+# Names available to the expressions of the templates of <testgen> besides
+# its parameters: the math module and a few harmless builtins
+TEMPLATE_BUILTINS = { name: getattr(math, name) for name in dir(math) if not name.startswith('_') }
+TEMPLATE_BUILTINS.update({ f.__name__: f for f in [
+	abs, all, any, bool, chr, divmod, float, hex, int, len, max, min, oct,
+	ord, pow, range, repr, reversed, round, sorted, str, sum,
+] })
+
+class TestGen():
+	'''Generator of the testruns of a <testgen> element. Its <param>s range
+	over the product of their values or, when count is given, are drawn at
+	random count times from a generator seeded with seed. The remaining
+	attributes are those of a <testrun>, written as Python f-strings over
+	the parameters, e.g. args="{a} {b}" cout="{a + b}".
+	Testruns are created as the generator is iterated and dropped once
+	used, so the number of testruns does not affect memory usage'''
+	def __init__(self):
+		self._params = []
+		self._count = None
+		self._seed = 0
+		self._templates = {}
+		self._limits = {}
+		self._directory = None
+	# end def
+
+	@property
+	def limits(self):
+		'''Default resource limits of the testruns (see TestRun.limits)'''
+		return self._limits
+	# end def
+
+	@property
+	def count(self):
+		'''Number of random testruns, None for the product of the parameters'''
+		return self._count
+	# end def
+
+	def __len__(self):
+		if self._count is not None:
+			return self._count
+		return math.prod(len(values) for name, kind, values in self._params)
+	# end def
+
+	@property
+	def files(self):
+		'''Files read by the validation functions of the testruns. Only
+		templates of allclose may refer to files, the testruns are generated
+		to know which otherwise'''
+		if not any('allclose' in s for s in self._templates.values()):
+			return []
+		return sorted({ path for tr in self for path in tr.files })
+	# end def
+
+	def __iter__(self):
+		templates = { attr: TestGen._compile(s) for attr, s in self._templates.items() }
+		for params in self._sweep():
+			yield self._testrun(templates, params)
+	# end def
+
+	def _sweep(self):
+		'''Yields the parameters of each testrun'''
+		if self._count is not None:
+			rng = random.Random(self._seed)
+			for i in range(self._count):
+				yield { name: rng.uniform(*values) if kind == 'uniform' else rng.choice(values)
+					for name, kind, values in self._params }
+			return
+		# Decoded from the index of the testrun so no value list is built
+		# (the last parameter changes fastest, as in itertools.product)
+		for i in range(len(self)):
+			params = {}
+			for name, kind, values in reversed(self._params):
+				i, j = divmod(i, len(values))
+				params[name] = values[j]
+			yield params
+	# end def
+
+	def _testrun(self, templates, params):
+		scope = dict(params)
+		scope['__builtins__'] = TEMPLATE_BUILTINS
+		attributes = {}
+		attr = None
+		try:
+			for attr, code in templates.items():
+				attributes[attr] = eval(code, scope)
+			attr = None
+			# Generated validation functions are rarely repeated, interning
+			# them would keep them all in memory
+			tr = TestRun.parse(attributes, self._directory, intern=False)
+		except ImportError:
+			# A missing module (see vfuncs._numpy) fails every testrun alike
+			raise
+		except Exception as err:
+			# Reported as a failed testrun rather than aborting the evaluation
+			tr = TestRun()
+			tr.args = []
+			where = f' {attr}="{self._templates[attr]}"' if attr else ''
+			tr._error = f'Cannot generate the testrun{where} with {params}: {err}'
+			return tr
+		for name in self._limits:
+			tr.limits.setdefault(name, self._limits[name])
+		return tr
+	# end def
+
+	@staticmethod
+	def _compile(s):
+		try:
+			return compile('f' + repr(s), '<testgen>', 'eval')
+		except SyntaxError as err:
+			raise ValueError(f'Invalid template "{s}": {err.msg}')
+	# end def
+
+	@staticmethod
+	def _parseParam(attributes):
+		'''Returns the (name, kind, values) of a <param>: a range of integers
+		(as Python's range, e.g. range="1 100 2"), a list of values, or the
+		bounds of uniformly distributed floats (random testgens only)'''
+		name = attributes.get('name', '')
+		if not name.isidentifier():
+			raise ValueError(f'Invalid parameter name "{name}".')
+		if 'range' in attributes:
+			bounds = attributes['range'].split()
+			if not 0 < len(bounds) < 4:
+				raise ValueError(f'Invalid range of parameter {name}.')
+			return name, 'range', range(*[int(b) for b in bounds])
+		if 'values' in attributes:
+			return name, 'values', [ TestGen._value(v) for v in shlex.split(attributes['values']) ]
+		if 'uniform' in attributes:
+			bounds = attributes['uniform'].split()
+			if len(bounds) != 2:
+				raise ValueError(f'Invalid bounds of parameter {name}.')
+			return name, 'uniform', (float(bounds[0]), float(bounds[1]))
+		raise ValueError(f'Parameter {name} has no range, values or uniform attribute.')
+	# end def
+
+	@staticmethod
+	def _value(s):
+		for parse in [int, float]:
+			try:
+				return parse(s)
+			except ValueError:
+				pass
+		return s
+	# end def
+
+	@staticmethod
+	def parse(elem, directory=None):
+		'''Creates a testrun generator from its element and <param>s.
+		Raises ValueError if they are malformed'''
+		gen = TestGen()
+		gen._directory = directory
+		attributes = dict(elem.attrib)
+		if 'count' in attributes:
+			gen._count = max(0, int(attributes.pop('count')))
+		if 'seed' in attributes:
+			gen._seed = TestGen._value(attributes.pop('seed'))
+		for param in elem.findall('param'):
+			gen._params.append(TestGen._parseParam(param.attrib))
+		names = [ name for name, kind, values in gen._params ]
+		if len(set(names)) != len(names):
+			raise ValueError('Parameters must have different names.')
+		for name, kind, values in gen._params:
+			if kind == 'uniform' and gen._count is None:
+				raise ValueError(f'Parameter {name} is uniform, which requires a count.')
+			if kind != 'uniform' and gen._count and len(values) == 0:
+				raise ValueError(f'Parameter {name} has no values to choose from.')
+		gen._templates = attributes
+		# Mistakes in the templates are reported when the file is loaded
+		first = next(iter(gen), None)
+		if first is not None and first.error:
+			raise ValueError(first.error + '.')
+		return gen
+	# end def
+# end class
@@ -9,13 +9,24 @@
 #
 # ## ###############################################################
 
+import os
 import re
 
+# Interned VFuncs by expression, the least recently used are dropped past
+# INTERN_SIZE so long-lived processes (e.g. the daemon) do not grow forever
+INTERN_SIZE = 4096
+__interned = {}
 __rxfunc = re.compile(r'^(\w+)\s*\((.*)\)$')
 
+# Characters separating the values of vectors and matrices (see _VectorCheck)
+_SEPARATORS = str.maketrans(',;[]()', '      ')
+
 
 class VFunc():
-	def __init__(self, fname, fargs):
+	'''Validation function. fargs are compiled once into a specialized
+	callable (see _pickfunc), so VFuncs are immutable and may be shared.
+	source holds the arguments of the parse call that created the VFunc'''
+	def __init__(self, fname, fargs, source=None):
 		self._fname = fname
 		if isinstance(fargs, str):
 			self._fargs = [fargs]
@@ -23,117 +34,149 @@ class VFunc():
 			self._fargs = fargs
 		else:
 			raise TypeError('fargs must be a list of strings')
+		self._source = source
 		self._func = None
 		self._pickfunc()
 	# end def
 
 
 	def _pickfunc(self):
-		self._func = {
-			'equals'      : self._equals,
-			'different'   : self._different,
-			'around'      : self._around,
-			'between'     : self._between,
-			'minlength'   : self._minlength,
-			'maxlength'   : self._maxlength,
-			'lt'          : self._lt,
-			'leq'         : self._leq,
-			'gt'          : self._gt,
-			'geq'         : self._geq,
-			'contains'    : self._contains,
-			'anyof'       : self._anyof,
-			'in'          : self._anyof,
-			'noneof'      : self._noneof,
-			'notin'       : self._noneof,
-			'matches'     : self._matches
+		factory = {
+			'equals'      : VFunc._equals,
+			'different'   : VFunc._different,
+			'around'      : VFunc._around,
+			'between'     : VFunc._between,
+			'minlength'   : VFunc._minlength,
+			'maxlength'   : VFunc._maxlength,
+			'lt'          : VFunc._lt,
+			'leq'         : VFunc._leq,
+			'gt'          : VFunc._gt,
+			'geq'         : VFunc._geq,
+			'contains'    : VFunc._contains,
+			'anyof'       : VFunc._anyof,
+			'in'          : VFunc._anyof,
+			'noneof'      : VFunc._noneof,
+			'notin'       : VFunc._noneof,
+			'matches'     : VFunc._matches,
+			'allclose'    : _AllClose,
+			'allbetween'  : _AllBetween
 		}.get(self._fname, None)
+		self._func = factory(*self._fargs) if factory else None
 	# end def
 
 
-	def _equals(self, value):
-		if isinstance(self._fargs[0], (int, float)):
-			value = VFunc._tofloat(value)
-			if value is None: return False
-		# elif isinstance(self._fargs[0], int):
-		# 	value = VFunc._toint(value)
-		# 	if not value: return False
-		# print(f'equals: "{value}" == "{self._fargs[0]}"')
-		return value == self._fargs[0]
+	# Factories of the validation functions, taking the function arguments
+
+	@staticmethod
+	def _equals(farg):
+		if isinstance(farg, (int, float)):
+			tofloat = VFunc._tofloat
+			return lambda value: tofloat(value) == farg
+		return lambda value: value == farg
 	# end def
 
-	def _different(self, value):
-		if isinstance(self._fargs[0], (int, float)):
-			value = VFunc._tofloat(value)
-			if value is None: return False
-		return value == self._fargs[0]
+	@staticmethod
+	def _different(farg):
+		if isinstance(farg, (int, float)):
+			tofloat = VFunc._tofloat
+			return lambda value: tofloat(value) == farg
+		return lambda value: value == farg
 	# end def
 
-	def _minlength(self, value):
-		return len(value) >= self._fargs[0]
+	@staticmethod
+	def _minlength(n):
+		return lambda value: len(value) >= n
 	# end def
 
-	def _maxlength(self, value):
-		return len(value) <= self._fargs[0]
+	@staticmethod
+	def _maxlength(n):
+		return lambda value: len(value) <= n
 	# end def
 
-	def _around(self, value):
-		value = VFunc._tofloat(value)
-		if value is None: return False
-		return abs(value - self._fargs[0]) < self._fargs[0] * self._fargs[1]
+	@staticmethod
+	def _around(x, tolerance):
+		tofloat = VFunc._tofloat
+		delta = x * tolerance
+		def around(value):
+			value = tofloat(value)
+			return value is not None and abs(value - x) < delta
+		return around
 	# end def
 
-	def _between(self, value):
-		value = VFunc._tofloat(value)
-		if value is None: return False
-		return value >= self._fargs[0] and value <= self._fargs[1]
+	@staticmethod
+	def _between(lo, hi):
+		tofloat = VFunc._tofloat
+		def between(value):
+			value = tofloat(value)
+			return value is not None and value >= lo and value <= hi
+		return between
 	# end def
 
 
-	def _lt(self, value):
-		value = VFunc._tofloat(value)
-		if value is None: return False
-		return value < self._fargs[0]
+	@staticmethod
+	def _lt(x):
+		tofloat = VFunc._tofloat
+		def lt(value):
+			value = tofloat(value)
+			return value is not None and value < x
+		return lt
 	# end def
 
 
-	def _leq(self, value):
-		value = VFunc._tofloat(value)
-		if value is None: return False
-		return value <= self._fargs[0]
+	@staticmethod
+	def _leq(x):
+		tofloat = VFunc._tofloat
+		def leq(value):
+			value = tofloat(value)
+			return value is not None and value <= x
+		return leq
 	# end def
 
 
-	def _gt(self, value):
-		value = VFunc._tofloat(value)
-		if value is None: return False
-		return value > self._fargs[0]
+	@staticmethod
+	def _gt(x):
+		tofloat = VFunc._tofloat
+		def gt(value):
+			value = tofloat(value)
+			return value is not None and value > x
+		return gt
 	# end def
 
 
-	def _geq(self, value):
-		value = VFunc._tofloat(value)
-		if value is None: return False
-		return value >= self._fargs[0]
+	@staticmethod
+	def _geq(x):
+		tofloat = VFunc._tofloat
+		def geq(value):
+			value = tofloat(value)
+			return value is not None and value >= x
+		return geq
 	# end def
 
 
-	def _contains(self, value):
-		return self._fargs[0] in value
+	@staticmethod
+	def _contains(s):
+		return lambda value: s in value
 	# end def
 
 
-	def _anyof(self, value):
-		return value in self._fargs
+	@staticmethod
+	def _anyof(*options):
+		options = frozenset(options)
+		return lambda value: value in options
 	# end def
 
 
-	def _noneof(self, value):
-		return value not in self._fargs
+	@staticmethod
+	def _noneof(*options):
+		options = frozenset(options)
+		return lambda value: value not in options
 	# end def
 
 
-	def _matches(self, value):
-		return re.search(self._fargs[0], value) is not None
+	@staticmethod
+	def _matches(rx):
+		search = re.compile(rx).search
+		return lambda value: search(value) is not None
 	# end def
 
 
@@ -147,6 +190,51 @@ class VFunc():
 		if not callable(self._func):
 			return
 		return self._func(value)
+	# end def
+
+
+	@property
+	def files(self):
+		'''Files read by the function (e.g. the expected values of allclose)'''
+		if self._fname == 'allclose' and os.path.isfile(self._fargs[0]):
+			return [ self._fargs[0] ]
+		return []
+	# end def
+
+
+	def explain(self, value):
+		'''Returns why value is rejected (e.g. the first mismatching element
+		of a vector), or None if there is nothing to add'''
+		explain = getattr(self._func, 'explain', None)
+		return explain(value) if explain else None
+	# end def
+
+
+	def __reduce__(self):
+		# Compiled functions cannot be pickled; rebuild (and intern) instead
+		if self._source is not None:
+			return (parse, self._source)
+		return (VFunc, (self._fname, self._fargs))
+	# end def
+
+
+	def early(self):
+		'''Returns a new incremental check for this function, or None if the
+		function cannot reject an output before it is complete.
+		See EarlyCheck'''
+		numeric = ['around', 'between', 'lt', 'leq', 'gt', 'geq']
+		if self._fname == 'equals':
+			if isinstance(self._fargs[0], (int, float)):
+				return _NumberCheck()
+			return _PrefixCheck(self._fargs)
+		elif self._fname in ['anyof', 'in']:
+			return _PrefixCheck(self._fargs)
+		elif self._fname == 'maxlength':
+			return _LengthCheck(self._fargs[0])
+		elif self._fname in numeric:
+			return _NumberCheck()
+		return None
+	# end def
 
 
 	@staticmethod
@@ -168,9 +256,257 @@ class VFunc():
 
 
 
-def parse(s):
+class EarlyCheck():
+	'''Incremental check of an output stream. feed receives the output in
+	chunks as it is produced and returns False once the stripped output is
+	certain to be rejected by the function regardless of what follows'''
+	def __init__(self):
+		self._started = False
+	# end def
+
+	def feed(self, text):
+		if not self._started:
+			text = text.lstrip()
+			if not text:
+				return True
+			self._started = True
+		return self._feed(text)
+	# end def
+
+	def _feed(self, text):
+		return True
+	# end def
+# end class
+
+
+
+class _PrefixCheck(EarlyCheck):
+	'''Rejects once the output cannot become any of the given strings'''
+	def __init__(self, options):
+		super().__init__()
+		self._options = [o for o in options if isinstance(o, str)]
+		self._maxlen = max([len(o) for o in self._options] + [0])
+		self._head = ''
+		self._overflow = False
+	# end def
+
+	def _feed(self, text):
+		if len(self._head) < self._maxlen:
+			n = self._maxlen - len(self._head)
+			self._head+= text[:n]
+			text = text[n:]
+		if len(text) > 0 and not text.isspace():
+			self._overflow = True
+		if self._overflow:
+			return False
+		for o in self._options:
+			n = min(len(o), len(self._head))
+			if self._head[:n] == o[:n] and \
+				(len(self._head) <= len(o) or self._head[len(o):].isspace()):
+				return True
+		return False
+	# end def
+# end class
+
+
+
+class _LengthCheck(EarlyCheck):
+	'''Rejects once the output is longer than n characters'''
+	def __init__(self, n):
+		super().__init__()
+		self._n = n
+		# Characters read, and those up to the last one not a whitespace
+		# (trailing whitespace may span several chunks and is stripped)
+		self._count = 0
+		self._content = 0
+	# end def
+
+	def _feed(self, text):
+		stripped = text.rstrip()
+		if stripped:
+			self._content = self._count + len(stripped)
+		self._count+= len(text)
+		return self._content <= self._n
+	# end def
+# end class
+
+
+
+class _NumberCheck(EarlyCheck):
+	'''Rejects once the output holds more than one token (not a number)'''
+	def __init__(self):
+		super().__init__()
+		self._gap = False
+	# end def
+
+	def _feed(self, text):
+		# x stands for the token read so far
+		text = ('x ' if self._gap else 'x') + text
+		if len(text.split()) > 1:
+			return False
+		self._gap = text[-1].isspace()
+		return True
+	# end def
+# end class
+
+
+
+
+class _VectorCheck():
+	'''Element-wise check of an output holding a vector or matrix of numbers.
+	The output is tokenized into a NumPy array in one pass'''
+	def __init__(self):
+		self._np = _numpy()
+	# end def
+
+	def __call__(self, value):
+		return self._mismatch(value) is None
+	# end def
+
+	def explain(self, value):
+		return self._mismatch(value)
+	# end def
+
+	def _mismatch(self, value):
+		'''Returns why value is rejected, or None if it is accepted'''
+		return None
+	# end def
+
+	def _tovector(self, text):
+		try:
+			return self._np.array(text.translate(_SEPARATORS).split(), dtype=float)
+		except (ValueError, AttributeError):
+			return None
+	# end def
+# end class
+
+
+
+class _AllClose(_VectorCheck):
+	'''Accepts outputs whose values are all close to the expected ones, given
+	inline or as the path of a file, within |v - e| <= atol + rtol * |e|.
+	Files are read again whenever they change'''
+	def __init__(self, expected, rtol=1e-5, atol=1e-8):
+		super().__init__()
+		self._path = None
+		self._stamp = None
+		self._expected = self._tovector(expected)
+		if self._expected is None or self._expected.size < 1:
+			self._path = expected
+			self._refresh()
+		self._rtol = rtol
+		self._atol = atol
+	# end def
+
+	def _refresh(self):
+		'''Loads the expected values from the file if it changed since read.
+		The values read last are kept if the file is gone'''
+		try:
+			st = os.stat(self._path)
+		except OSError:
+			if self._stamp is None:
+				raise
+			return
+		stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+		if stamp != self._stamp:
+			self._expected = self._load(self._path)
+			self._stamp = stamp
+	# end def
+
+	def _load(self, path):
+		with open(path, 'r', encoding='utf-8') as f:
+			text = f.read()
+		values = self._tovector(text)
+		if values is None:
+			raise ValueError(f'{path} is not a list of numbers')
+		# Keep the shape of matrices written one row per line
+		rows = len([l for l in text.splitlines() if l.strip()])
+		if rows > 1 and values.size % rows == 0:
+			values = values.reshape(rows, values.size // rows)
+		return values
+	# end def
+
+	def _mismatch(self, value):
+		np = self._np
+		if self._path:
+			self._refresh()
+		got = self._tovector(value)
+		if got is None:
+			return 'Not a list of numbers'
+		if got.size != self._expected.size:
+			return f'Expected {self._expected.size} values, got {got.size}'
+		got = got.reshape(self._expected.shape)
+		close = np.isclose(got, self._expected, rtol=self._rtol, atol=self._atol)
+		if close.all():
+			return None
+		i = np.unravel_index(np.argmin(close), close.shape)
+		index = int(i[0]) if len(i) == 1 else tuple(int(n) for n in i)
+		return f'Value at {index} is {got[i]}, expected {self._expected[i]}'
+	# end def
+# end class
+
+
+
+class _AllBetween(_VectorCheck):
+	'''Accepts outputs whose values all lie in the closed interval [lo, hi]'''
+	def __init__(self, lo, hi):
+		super().__init__()
+		self._lo = lo
+		self._hi = hi
+	# end def
+
+	def _mismatch(self, value):
+		np = self._np
+		got = self._tovector(value)
+		if got is None or got.size < 1:
+			return 'Not a list of numbers'
+		inside = (got >= self._lo) & (got <= self._hi)
+		if inside.all():
+			return None
+		i = int(np.argmin(inside))
+		return f'Value at {i} is {got[i]}, not in [{self._lo}, {self._hi}]'
+	# end def
+# end class
+
+
+
+def _numpy():
+	'''Imports NumPy, which is needed only by the vector functions'''
+	try:
+		import numpy
+	except ImportError:
+		raise ImportError('allclose and allbetween require NumPy (pip install numpy).')
+	return numpy
+# end def
+
+
+
+def parse(s, directory=None, intern=True):
+	'''Parses a validation function. Identical expressions yield the same
+	(immutable) VFunc object, so the function is compiled only once, unless
+	intern is False (e.g. for expressions used once). Functions reading
+	files (see VFunc.files) are never interned, the files may change.
+	Relative paths of files (see allclose) are looked up in directory.
+	Raises ValueError if the function cannot be compiled (e.g. an invalid
+	regular expression)'''
+	s = s.strip()
+	key = (s, directory)
+	vfunc = __interned.pop(key, None)
+	if vfunc is None:
+		vfunc = __parse(s, directory)
+		if not intern or (vfunc and vfunc.files):
+			return vfunc
+		if len(__interned) >= INTERN_SIZE:
+			del __interned[next(iter(__interned))]
+	__interned[key] = vfunc
+	return vfunc
+# end def
+
+
+
+def __parse(s, directory):
 	# print(f'parsing: {s}')
-	fname, fargs = __split(s.strip())
+	fname, fargs = __split(s)
 	# print(f'\tfname: {fname}')
 	# print(f'\tfargs: {fargs}')
 
@@ -179,7 +515,8 @@ def parse(s):
 	             'minlength', 'maxlength',
 	             'lt', 'leq', 'gt', 'geq',
 	             'contains', 'anyof', 'in',
-	             'notin', 'noneof', 'matches']
+	             'notin', 'noneof', 'matches',
+	             'allclose', 'allbetween']
 
 	if not fname or not fname in supported:
 		fname = 'equals'
@@ -201,12 +538,28 @@ def parse(s):
 		okfargs = __check_fargs(fargs, argstype=str, num=-1)
 	elif fname in ['contains', 'matches']:
 		okfargs = __check_fargs(fargs, argstype=str, num=1)
+	elif fname == 'allbetween':
+		okfargs = __check_fargs(fargs, argstype=float, num=2)
+	elif fname == 'allclose':
+		# expected values (or file), rtol and atol
+		expected, tolerances = fargs[:1], fargs[1:]
+		okfargs = len(fargs) <= 3 and \
+			__check_fargs(expected, argstype=str, num=1) and \
+			__check_fargs(tolerances, argstype=float, num=-1)
+		fargs = expected + tolerances
+		if okfargs and directory and os.path.isfile(os.path.join(directory, fargs[0])):
+			fargs[0] = os.path.join(directory, fargs[0])
 
 	if not okfargs:
 		return None
 	# print(f'fname: {fname}')
 	# print(f'fargs: {fargs}')
-	return VFunc(fname, fargs)
+	try:
+		return VFunc(fname, fargs, source=(s, directory))
+	except re.error as err:
+		raise ValueError(f'Invalid regular expression in {s}: {err}.')
+	except OSError as err:
+		raise ValueError(f'Cannot read {fargs[0]} in {s}: {err.strerror}.')
 # end def
 
 
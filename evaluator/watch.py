@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ## ###############################################################
+# evaluator/watch.py
+#
+# Author:  Mauricio Matamoros
+# License: MIT
+#
+# ## ###############################################################
+
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+from .reporters import PdfReporter
+from . import batch
+
+# Seconds a file must stay unchanged before it is considered written
+DEFAULT_DEBOUNCE = 2
+# Seconds between scans of the directory when inotify is unavailable
+POLL_INTERVAL = 1
+# Seconds between checks for completed evaluations while watching
+WAKEUP_INTERVAL = 0.25
+
+# inotify(7)
+IN_MODIFY      = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_NONBLOCK    = 0o4000
+IN_CLOEXEC     = 0o2000000
+IN_EVENT = struct.Struct('iIII')
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+
+class Watcher():
+	'''Reports the files of directory (with one of the given extensions) which
+	are created or changed, once they have been left unchanged for debounce
+	seconds so files are not taken while being written.
+	Uses inotify when available and scans the directory otherwise (e.g. on
+	network filesystems, whose changes inotify does not see, set poll)'''
+	def __init__(self, directory, extensions=None, debounce=DEFAULT_DEBOUNCE, poll=False):
+		self._dir = directory
+		self._extensions = [ e.lower() for e in extensions ] if extensions else None
+		self._debounce = debounce
+		self._pending = {}
+		# Stamps of the files when last reported, and when last scanned
+		self._stamps = { f: _stamp(f) for f in self._scan() }
+		self._seen = dict(self._stamps)
+		self._fd = None if poll else _inotify(directory)
+	# end def
+
+	@property
+	def directory(self):
+		return self._dir
+	# end def
+
+	@property
+	def polling(self):
+		return self._fd is None
+	# end def
+
+	def close(self):
+		if self._fd is not None:
+			os.close(self._fd)
+			self._fd = None
+	# end def
+
+	def wait(self, timeout=None):
+		'''Waits up to timeout seconds (forever if None) for changed files to
+		settle. Returns their paths, possibly none'''
+		deadline = None if timeout is None else time.monotonic() + timeout
+		while True:
+			now = time.monotonic()
+			ready = self._settled(now)
+			if ready:
+				return ready
+			delay = [ self._debounce - (now - t) for t in self._pending.values() ]
+			if deadline is not None:
+				delay.append(deadline - now)
+			delay = max(0, min(delay)) if delay else None
+			if deadline is not None and now >= deadline:
+				return []
+			self._collect(delay)
+	# end def
+
+	def _settled(self, now):
+		ready = []
+		for path, t in list(self._pending.items()):
+			if now - t < self._debounce:
+				continue
+			del self._pending[path]
+			stamp = _stamp(path)
+			# Deleted, or closed with no changes
+			if stamp is None or stamp == self._stamps.get(path):
+				continue
+			self._stamps[path] = stamp
+			ready.append(path)
+		return sorted(ready)
+	# end def
+
+	def _collect(self, timeout):
+		'''Records the changes occurring within timeout seconds'''
+		if self._fd is None:
+			time.sleep(POLL_INTERVAL if timeout is None else min(timeout, POLL_INTERVAL))
+			now = time.monotonic()
+			for path in self._scan():
+				stamp = _stamp(path)
+				if stamp != self._seen.get(path):
+					self._seen[path] = stamp
+					self._pending[path] = now
+			return
+
+		if not select.select([self._fd], [], [], timeout)[0]:
+			return
+		try:
+			data = os.read(self._fd, 65536)
+		except OSError as ex:
+			if ex.errno in [errno.EAGAIN, errno.EINTR]:
+				return
+			raise
+		now = time.monotonic()
+		offset = 0
+		while offset + IN_EVENT.size <= len(data):
+			wd, mask, cookie, length = IN_EVENT.unpack_from(data, offset)
+			offset+= IN_EVENT.size
+			name = data[offset:offset + length].rstrip(b'\0')
+			offset+= length
+			if mask & IN_Q_OVERFLOW:
+				# Events were lost
+				for path in self._scan():
+					self._pending[path] = now
+			elif mask & IN_IGNORED:
+				# The directory is gone or unmounted
+				self.close()
+			elif name:
+				path = os.path.join(self._dir, os.fsdecode(name))
+				if self._matches(path):
+					self._pending[path] = now
+	# end def
+
+	def _scan(self):
+		try:
+			names = sorted(os.listdir(self._dir))
+		except OSError:
+			return []
+		paths = [ os.path.join(self._dir, f) for f in names ]
+		return [ p for p in paths if self._matches(p) and os.path.isfile(p) ]
+	# end def
+
+	def _matches(self, path):
+		if self._extensions is None:
+			return True
+		return os.path.splitext(path)[1].lower() in self._extensions
+	# end def
+# end class
+
+
+
+def _stamp(path):
+	try:
+		st = os.stat(path)
+	except OSError:
+		return None
+	return (st.st_mtime_ns, st.st_size)
+# end def
+
+
+
+def _inotify(directory):
+	'''Returns an inotify descriptor watching directory, or None if inotify
+	is not available'''
+	try:
+		libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+		fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+	except (OSError, AttributeError):
+		return None
+	if fd < 0:
+		return None
+	if libc.inotify_add_watch(fd, os.fsencode(directory), WATCH_MASK) < 0:
+		os.close(fd)
+		return None
+	return fd
+# end def
+
+
+
+def watch(specs, directory, outdir='.', jobs=None, options=None,
+	debounce=DEFAULT_DEBOUNCE, poll=False):
+	'''Evaluates the submissions arriving at (or changing in) directory in a
+	batch.worker_pool as soon as they are written, until interrupted.
+	Submissions already in directory are evaluated unless their report in
+	outdir is newer. Reports and the scores.csv summary are written to
+	outdir as they complete. Returns the (source, score, report) tuples'''
+	if not os.path.exists(outdir):
+		os.makedirs(outdir)
+	summary = os.path.join(outdir, 'scores.csv')
+	reporter = (options or {}).get('reporter')
+	extension = reporter.extension if reporter else PdfReporter.extension
+	watcher = Watcher(directory, batch.SOURCE_EXTENSIONS.get(specs.language), debounce, poll)
+	results = {}
+	running = {}
+	again = set()
+	with batch.worker_pool(specs, jobs, options) as pool:
+		def start(source):
+			if source in running.values():
+				# Evaluated again once the running evaluation completes
+				again.add(source)
+				return
+			print(f'Evaluating {source}', flush=True)
+			running[batch.schedule(pool, source, outdir)] = source
+
+		for source in batch.find_sources(directory, specs.language):
+			if not _uptodate(source, outdir, extension):
+				start(source)
+		print(f'Watching {directory}' + (' (polling)' if watcher.polling else ''), flush=True)
+		try:
+			while True:
+				for source in watcher.wait(WAKEUP_INTERVAL if running else None):
+					start(source)
+				for f in [ f for f in running if f.done() ]:
+					source = running.pop(f)
+					results[source] = f.result()
+					score = results[source][1]
+					print(f'{source}: ' + ('ERROR' if score is None else f'{score:0.1f}'), flush=True)
+					batch.write_summary(sorted(results.values()), summary)
+					if source in again:
+						again.discard(source)
+						start(source)
+		except KeyboardInterrupt:
+			for f in running:
+				f.cancel()
+		finally:
+			watcher.close()
+	return sorted(results.values())
+# end def
+
+
+
+def _uptodate(source, outdir, extension):
+	name = os.path.splitext(os.path.basename(source))[0]
+	report = os.path.join(outdir, f'{name}{extension}')
+	try:
+		return os.path.getmtime(report) >= os.path.getmtime(source)
+	except OSError:
+		return False
+# end def
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-from distutils.core import setup
+from setuptools import setup
 
 setup(name='Distutils',
       version='0.1',
@@ -9,4 +9,6 @@ setup(name='Distutils',
       author_email='kyordhel@gmail.com',
       url='https://github.com/kyordhel/progeval',
       packages=['progeval'],
+      # allclose and allbetween (see evaluator/vfuncs.py)
+      extras_require={ 'numpy': ['numpy'] },
      )
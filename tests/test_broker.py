@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ## ###############################################################
+# tests/test_broker.py
+#
+# Author:  Mauricio Matamoros
+# License: MIT
+#
+# ## ###############################################################
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from evaluator import broker
+
+
+class TestLease(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.now = 1000.0
+		patch = mock.patch.object(broker.time, 'time', lambda: self.now)
+		patch.start()
+		self.addCleanup(patch.stop)
+		self.broker = broker.Broker(os.path.join(self.dir, 'jobs.db'))
+	# end def
+
+	def tearDown(self):
+		self.broker.close()
+		shutil.rmtree(self.dir)
+	# end def
+
+	def test_lease_held(self):
+		self.broker.enqueue('specs.xml', 'a.c')
+		job = self.broker.lease('w1', duration=60)
+		self.now+= 30
+		self.assertIsNone(self.broker.lease('w2', duration=60))
+		self.assertTrue(self.broker.renew(job, 'w1', duration=60))
+		self.now+= 45
+		# Renewed, so not expired yet
+		self.assertIsNone(self.broker.lease('w2', duration=60))
+		self.assertTrue(self.broker.complete(job, 'w1', 10))
+		self.assertEqual(self.broker.counts()[broker.DONE], 1)
+	# end def
+
+	def test_lease_expired(self):
+		self.broker.enqueue('specs.xml', 'a.c')
+		job = self.broker.lease('w1', duration=60)
+		self.now+= 61
+		again = self.broker.lease('w2', duration=60)
+		self.assertEqual((again.id, again.attempts), (job.id, 2))
+		# The first worker lost the job
+		self.assertFalse(self.broker.renew(job, 'w1'))
+		self.assertFalse(self.broker.complete(job, 'w1', 10))
+		self.assertTrue(self.broker.complete(again, 'w2', 5))
+		self.assertEqual([ r[2] for r in self.broker.results() ], [5])
+	# end def
+
+	def test_attempts_exhausted(self):
+		self.broker.enqueue('specs.xml', 'a.c', maxtries=2)
+		for worker in ['w1', 'w2']:
+			self.assertIsNotNone(self.broker.lease(worker, duration=60))
+			self.now+= 61
+		counts = self.broker.counts()
+		self.assertEqual((counts[broker.QUEUED], counts[broker.FAILED]), (0, 1))
+		error = list(self.broker.results())[0][4]
+		self.assertEqual(error, 'Worker w2 lost the job')
+	# end def
+# end class
+
+
+if __name__ == '__main__':
+	unittest.main()
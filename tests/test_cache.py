@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ## ###############################################################
+# tests/test_cache.py
+#
+# Author:  Mauricio Matamoros
+# License: MIT
+#
+# ## ###############################################################
+
+import os
+import shutil
+import tempfile
+import unittest
+from evaluator.cache import BuildCache, ResultStore, ReportIndex
+from evaluator.common import Completed
+
+
+class TempDir(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+	# end def
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+	# end def
+
+	def write(self, name, text):
+		path = os.path.join(self.dir, name)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		with open(path, 'w') as f:
+			f.write(text)
+		return path
+	# end def
+# end class
+
+
+
+class TestBuildCacheKey(TempDir):
+	def setUp(self):
+		super().setUp()
+		self.cache = BuildCache(os.path.join(self.dir, 'cache'))
+	# end def
+
+	def test_python_keyed_on_content(self):
+		alice = self.write('alice/hw.py', 'print(1)\n')
+		bob = self.write('bob/hw.py', 'print(1)\n')
+		carol = self.write('carol/hw.py', 'print(2)\n')
+		key = lambda f: self.cache.key(f, 'Python', [], 'python3')
+		self.assertEqual(key(alice), key(bob))
+		self.assertNotEqual(key(alice), key(carol))
+	# end def
+
+	def test_compiled_keyed_on_path(self):
+		# __FILE__ would tell the path of another submission
+		alice = self.write('alice/hw.c', 'int main(){return 0;}\n')
+		bob = self.write('bob/hw.c', 'int main(){return 0;}\n')
+		key = lambda f: self.cache.key(f, 'C', [], 'gcc')
+		self.assertEqual(key(alice), key(alice))
+		self.assertNotEqual(key(alice), key(bob))
+	# end def
+
+	def test_flags_and_language(self):
+		src = self.write('hw.c', 'int main(){return 0;}\n')
+		self.assertNotEqual(self.cache.key(src, 'C', [], 'gcc'),
+			self.cache.key(src, 'C', ['-O2'], 'gcc'))
+		self.assertNotEqual(self.cache.key(src, 'C', [], 'gcc'),
+			self.cache.key(src, 'C++', [], 'gcc'))
+	# end def
+# end class
+
+
+
+class TestStoreEviction(TempDir):
+	def age(self, store, *keys):
+		'''Makes the entries of keys the least recently used, in order'''
+		for i, key in enumerate(keys):
+			os.utime(store._path(key), (i + 1, i + 1))
+	# end def
+
+	def test_report_index(self):
+		index = ReportIndex(os.path.join(self.dir, 'reports'), maxsize=2500)
+		events = [ ['message', ['info', 'x' * 1000], {}] ]
+		for key in ['aa1', 'bb2']:
+			index.store(key, 1, None, events)
+		self.age(index, 'aa1', 'bb2')
+		self.assertIsNotNone(index.fetch('aa1'))
+		index.store('cc3', 1, None, events)
+		self.assertIsNotNone(index.fetch('aa1'))
+		self.assertIsNone(index.fetch('bb2'))
+		self.assertIsNotNone(index.fetch('cc3'))
+	# end def
+
+	def test_result_store(self):
+		store = ResultStore(os.path.join(self.dir, 'results'), maxsize=2500)
+		for key in ['aa1', 'bb2']:
+			store.store(key, 'x' * 1000, '', Completed(0))
+		self.age(store, 'aa1', 'bb2')
+		store.store('cc3', 'x' * 1000, '', Completed(0))
+		self.assertIsNone(store.fetch('aa1'))
+		self.assertEqual(store.fetch('bb2')[0], 'x' * 1000)
+		self.assertIsNotNone(store.fetch('cc3'))
+	# end def
+
+	def test_unbounded(self):
+		index = ReportIndex(os.path.join(self.dir, 'reports'))
+		for i in range(20):
+			index.store(f'{i:02}', i, None, [])
+		self.assertEqual([ index.fetch(f'{i:02}')[0] for i in range(20) ], list(range(20)))
+	# end def
+# end class
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ## ###############################################################
+# tests/test_common.py
+#
+# Author:  Mauricio Matamoros
+# License: MIT
+#
+# ## ###############################################################
+
+import os
+import sys
+import shutil
+import asyncio
+import signal
+import resource
+import tempfile
+import unittest
+from unittest import mock
+from evaluator import common, specs, reporters
+from evaluator.evaluator import from_specs
+
+# Forks two children, printing how many could be started
+FORKS = '''import os
+n = 0
+for i in range(2):
+	try:
+		pid = os.fork()
+	except OSError:
+		continue
+	if pid == 0:
+		os._exit(0)
+	n+= 1
+	os.waitpid(pid, 0)
+print(n)
+'''
+
+SPECS = '''<?xml version="1.0" encoding="UTF-8"?>
+<testconf language="Python">
+	<testbeds>
+		<testbed score="1" onerror="continue" proclimit="3">
+			<testrun args="x" cout="2" /><testrun args="x" cout="2" /><testrun args="x" cout="2" /><testrun args="x" cout="2" />
+			<testrun args="x" cout="2" /><testrun args="x" cout="2" /><testrun args="x" cout="2" /><testrun args="x" cout="2" />
+		</testbed>
+	</testbeds>
+</testconf>
+'''
+
+NPROC_ENFORCED = os.getuid() != 0
+
+
+def loadspecs(directory):
+	xml = os.path.join(directory, 'specs.xml')
+	with open(xml, 'w') as f:
+		f.write(SPECS)
+	return specs.from_xml(xml, cache=False)
+# end def
+
+
+class TestResourceLimits(unittest.TestCase):
+	def nproc(self, limits):
+		return dict(common.resourcelimits(limits))[resource.RLIMIT_NPROC][0]
+	# end def
+
+	def test_processes_of_the_user_added(self):
+		with mock.patch.object(common, 'userprocesses', return_value=40):
+			self.assertEqual(self.nproc({ common.LIMIT_PROCESSES: 3 }), 43)
+	# end def
+
+	def test_userprocesses(self):
+		# The test runner itself, at least
+		self.assertGreaterEqual(common.userprocesses(), 1)
+	# end def
+
+	def test_concurrent_testruns(self):
+		directory = tempfile.mkdtemp()
+		try:
+			s = loadspecs(directory)
+		finally:
+			shutil.rmtree(directory)
+		testset = s.testbeds[0].testruns[0]
+		limit = lambda **kwargs: from_specs(s, **kwargs)._spawnLimits(testset)[common.LIMIT_PROCESSES]
+		self.assertEqual(limit(), 3)
+		self.assertEqual(limit(workers=4), 12)
+		self.assertEqual(limit(parallel=True, jobs=8, workers=2), 48)
+	# end def
+# end class
+
+
+
+class TestReapAsync(unittest.TestCase):
+	def execute(self, code, timeout=15):
+		return asyncio.run(common.execute_async(sys.executable, ['-c', code],
+			timeout=timeout, addpath=False))
+	# end def
+
+	def test_reaped_with_usage(self):
+		fds = len(os.listdir('/proc/self/fd'))
+		o, e, p = self.execute('import time; time.sleep(0.2); print(1)')
+		self.assertEqual((o.strip(), p.returncode), ('1', 0))
+		self.assertGreater(p.usage.cputime, 0)
+		self.assertGreaterEqual(p.usage.walltime, 0.2)
+		self.assertEqual(len(os.listdir('/proc/self/fd')), fds)
+	# end def
+
+	def test_polled_without_pidfd(self):
+		with mock.patch.object(common, '_exitfd', return_value=(None, False)):
+			o, e, p = self.execute('raise SystemExit(3)')
+		self.assertEqual(p.returncode, 3)
+	# end def
+
+	def test_timeout(self):
+		o, e, p = self.execute('import time; time.sleep(5)', timeout=0.2)
+		self.assertIsNone(p)
+	# end def
+# end class
+
+
+
+class TestLimitVerdict(unittest.TestCase):
+	LIMITS = { common.LIMIT_CPU: 1, common.LIMIT_MEMORY: 64 << 20, common.LIMIT_FILESIZE: 1024 }
+
+	def verdict(self, returncode, usage=None):
+		return common._rlimitverdict(returncode, usage, self.LIMITS)
+	# end def
+
+	def test_signals(self):
+		self.assertEqual(self.verdict(-signal.SIGXCPU), common.LIMIT_CPU)
+		self.assertEqual(self.verdict(-signal.SIGXFSZ), common.LIMIT_FILESIZE)
+		self.assertIsNone(self.verdict(-signal.SIGTERM))
+	# end def
+
+	def test_exit_status_not_blamed(self):
+		# e.g. a MemoryError handled by the interpreter
+		self.assertIsNone(self.verdict(1, common.Usage(maxrss=64 << 20)))
+		self.assertIsNone(self.verdict(0))
+		self.assertIsNone(self.verdict(None))
+	# end def
+
+	def test_sigkill_blamed_by_usage(self):
+		self.assertEqual(self.verdict(-signal.SIGKILL, common.Usage(utime=1.5)), common.LIMIT_CPU)
+		self.assertEqual(self.verdict(-signal.SIGKILL, common.Usage(maxrss=60 << 20)), common.LIMIT_MEMORY)
+		self.assertIsNone(self.verdict(-signal.SIGKILL, common.Usage(utime=0.1, maxrss=1 << 20)))
+	# end def
+
+	def test_no_limits(self):
+		self.assertIsNone(common._rlimitverdict(-signal.SIGXCPU, None, {}))
+		self.assertIsNone(common._rlimitverdict(-signal.SIGSEGV, common.Usage(maxrss=1 << 30),
+			{ common.LIMIT_CPU: 1 }))
+	# end def
+# end class
+
+
+
+class TestLimitExceeded(unittest.TestCase):
+	def run_python(self, code, rlimits):
+		return common.execute(sys.executable, ['-c', code], addpath=False, rlimits=rlimits)
+	# end def
+
+	def test_cpu(self):
+		o, e, p = self.run_python('while True: pass', { common.LIMIT_CPU: 1 })
+		self.assertEqual(p.verdict, common.LIMIT_CPU)
+	# end def
+
+	def test_filesize(self):
+		# Not Python, whose interpreter ignores SIGXFSZ
+		with tempfile.TemporaryDirectory() as directory:
+			script = f'exec head -c 4096 /dev/zero > {os.path.join(directory, "out")}'
+			o, e, p = common.execute('/bin/sh', ['-c', script], addpath=False,
+				rlimits={ common.LIMIT_FILESIZE: 1024 })
+		self.assertEqual(p.verdict, common.LIMIT_FILESIZE)
+	# end def
+
+	def test_within_limits(self):
+		o, e, p = self.run_python('print(1)', { common.LIMIT_CPU: 5, common.LIMIT_FILESIZE: 1024 })
+		self.assertEqual((o.strip(), p.returncode, p.verdict), ('1', 0, None))
+	# end def
+# end class
+
+
+
+@unittest.skipUnless(NPROC_ENFORCED, 'RLIMIT_NPROC is not enforced for root')
+class TestProcessLimit(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.script = os.path.join(self.dir, 'forks.py')
+		with open(self.script, 'w') as f:
+			f.write(FORKS)
+	# end def
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+	# end def
+
+	def forks(self, processes):
+		o, e, p = common.execute(sys.executable, [self.script], addpath=False,
+			rlimits={ common.LIMIT_PROCESSES: processes })
+		return o.strip()
+	# end def
+
+	def test_limit(self):
+		self.assertEqual(self.forks(3), '2')
+		self.assertEqual(self.forks(1), '0')
+	# end def
+
+	def test_parallel_tests(self):
+		# Concurrent testruns do not eat up the processes of each other
+		reporter = reporters.JsonReporter()
+		e = from_specs(loadspecs(self.dir), parallel=True, jobs=8, workers=2, reporter=reporter)
+		e.evaluate(self.script)
+		events = [ line for line in reporter._events if '"event": "pass"' in line ]
+		self.assertEqual(len(events), 8)
+	# end def
+# end class
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ## ###############################################################
+# tests/test_evaluator.py
+#
+# Author:  Mauricio Matamoros
+# License: MIT
+#
+# ## ###############################################################
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from evaluator import specs, reporters
+from evaluator.cache import ReportIndex
+from evaluator.evaluator import Evaluator, from_specs
+
+# Prints its argument
+ECHO = '''import sys
+print(sys.argv[1])
+'''
+
+# Prints its first argument repeated as many times as the second one
+REPEAT = '''import sys
+print(' '.join([sys.argv[1]] * int(sys.argv[2])))
+'''
+
+OUTPUTS = '''<?xml version="1.0" encoding="UTF-8"?>
+<testconf language="Python">
+	<testbeds>
+		<testbed score="6" type="proportional" onerror="continue">
+			<testrun args="hello 1" cout="hello" />
+			<testrun args="hello 100000" cout="hello" />
+			<testrun args="7 1" cout="between(1, 10)" />
+			<testrun args="7 100000" cout="between(1, 10)" />
+			<testrun args="yes 1" cout="anyof(yes, no)" />
+			<testrun args="ab 100000" cout="maxlength(5)" />
+		</testbed>
+	</testbeds>
+</testconf>
+'''
+
+PERFORMANCE = '''<?xml version="1.0" encoding="UTF-8"?>
+<testconf language="Python">
+	<testbeds>
+		<testbed score="1" type="performance" onerror="continue" reference="{reference}">
+			<testrun args="1" cout="1" />
+			<testrun args="2" cout="2" />
+		</testbed>
+	</testbeds>
+</testconf>
+'''
+
+
+class EvaluatorTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+	# end def
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+	# end def
+
+	def write(self, name, text):
+		path = os.path.join(self.dir, name)
+		with open(path, 'w') as f:
+			f.write(text)
+		return path
+	# end def
+
+	def evaluate(self, xml, source, **kwargs):
+		'''Returns the score and the events reported evaluating source'''
+		reporter = reporters.JsonReporter()
+		e = from_specs(specs.from_xml(self.write('specs.xml', xml), cache=False),
+			reporter=reporter, **kwargs)
+		score = e.evaluate(self.write(source[0], source[1]))
+		return score, [ json.loads(line) for line in reporter._events ]
+	# end def
+# end class
+
+
+
+class TestEarlyReject(EvaluatorTest):
+	def verdicts(self, events):
+		return [ (e['testrun'], e['event'], e.get('stream')) for e in events
+			if e['event'] in ['pass', 'fail', 'reject'] ]
+	# end def
+
+	def test_same_verdicts(self):
+		early, eevents = self.evaluate(OUTPUTS, ('repeat.py', REPEAT), early=True)
+		late, levents = self.evaluate(OUTPUTS, ('repeat.py', REPEAT), early=False)
+		self.assertEqual(early, late)
+		self.assertEqual(early, 3)
+		self.assertEqual(self.verdicts(eevents), self.verdicts(levents))
+	# end def
+# end class
+
+
+
+class TestReportReuse(EvaluatorTest):
+	def setUp(self):
+		super().setUp()
+		self.index = ReportIndex(os.path.join(self.dir, 'index'))
+		# Outputs may name the script (e.g. tracebacks)
+		self.script = 'import sys\nif sys.argv[1] == "path": print(__file__)\n' + REPEAT
+		self.xml = OUTPUTS.replace('</testbed>', '\t<testrun args="path 0" cout="none" />\n\t\t</testbed>')
+	# end def
+
+	def evaluate(self, source, text):
+		os.makedirs(os.path.join(self.dir, os.path.dirname(source)), exist_ok=True)
+		return super().evaluate(self.xml, (source, text), index=self.index)
+	# end def
+
+	def verdicts(self, events):
+		return [ e for e in events if e['event'] not in ['begin', 'usage'] and
+			'usage' not in e ]
+	# end def
+
+	def test_identical_source_reused(self):
+		score, first = self.evaluate('alice/repeat.py', self.script)
+		with mock.patch.object(Evaluator, '_build') as build:
+			again, second = self.evaluate('bob/repeat.py', self.script)
+		build.assert_not_called()
+		self.assertEqual(score, again)
+		self.assertEqual(second[0]['source'], 'repeat.py')
+		text = json.dumps(self.verdicts(second))
+		self.assertIn(os.path.join('bob', 'repeat.py'), text)
+		self.assertNotIn('alice', text)
+		self.assertEqual(self.verdicts(first), json.loads(text.replace('bob', 'alice')))
+	# end def
+
+	def test_different_source_evaluated(self):
+		self.evaluate('alice/repeat.py', self.script)
+		with mock.patch.object(Evaluator, '_build', autospec=True, side_effect=Evaluator._build) as build:
+			self.evaluate('bob/repeat.py', self.script + '# bob\n')
+		build.assert_called_once()
+	# end def
+# end class
+
+
+
+class TestTimeReference(EvaluatorTest):
+	def messages(self, events):
+		return [ (e['level'], e['text']) for e in events if e['event'] == 'message' ]
+	# end def
+
+	def test_missing_reference(self):
+		score, events = self.evaluate(PERFORMANCE.format(reference='missing.py'), ('echo.py', ECHO))
+		self.assertIn(('warning', 'Reference implementation missing.py not found'), self.messages(events))
+	# end def
+
+	def test_reference(self):
+		self.write('reference.py', ECHO)
+		score, events = self.evaluate(PERFORMANCE.format(reference='reference.py'), ('echo.py', ECHO))
+		self.assertEqual([ m for m in self.messages(events) if m[0] == 'warning' ], [])
+	# end def
+# end class
+
+
+if __name__ == '__main__':
+	unittest.main()
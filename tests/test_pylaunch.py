@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ## ###############################################################
+# tests/test_pylaunch.py
+#
+# Author:  Mauricio Matamoros
+# License: MIT
+#
+# ## ###############################################################
+
+import os
+import shutil
+import tempfile
+import unittest
+import py_compile
+from evaluator import pylaunch
+
+SCRIPT = '''def f():
+	return lambda: 1
+f()
+'''
+
+
+class TestLoad(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.alice = os.path.join(self.dir, 'alice.py')
+		self.bob = os.path.join(self.dir, 'bob.py')
+		for path in [self.alice, self.bob]:
+			with open(path, 'w') as f:
+				f.write(SCRIPT)
+		self.pycfile = os.path.join(self.dir, 'alice.pyc')
+		py_compile.compile(self.alice, self.pycfile, doraise=True)
+	# end def
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+	# end def
+
+	def filenames(self, code):
+		names = { code.co_filename }
+		for c in code.co_consts:
+			if hasattr(c, 'co_filename'):
+				names|= self.filenames(c)
+		return names
+	# end def
+
+	def test_shared_bytecode_renamed(self):
+		# Bytecode compiled from alice.py running bob.py tells bob.py only
+		code = pylaunch.load(self.pycfile, self.bob)
+		self.assertEqual(self.filenames(code), { self.bob })
+	# end def
+
+	def test_source_fallback(self):
+		code = pylaunch.load(os.path.join(self.dir, 'missing.pyc'), self.bob)
+		self.assertEqual(self.filenames(code), { self.bob })
+	# end def
+# end class
+
+
+if __name__ == '__main__':
+	unittest.main()
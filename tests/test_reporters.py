@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ## ###############################################################
+# tests/test_reporters.py
+#
+# Author:  Mauricio Matamoros
+# License: MIT
+#
+# ## ###############################################################
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+from evaluator import reporters
+from evaluator.reporters import MAX_VALUE
+
+
+class TestRejectedValue(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+	# end def
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+	# end def
+
+	def report(self, reporter, value):
+		'''Returns the report of a testrun whose output value was rejected'''
+		reporter.begin('/tmp/a.c', 'sha1', 'author', 'date')
+		reporter.testbed('Testset 1')
+		reporter.testrun(1, 1, './a 1')
+		reporter.rejected('Output', value)
+		reporter.testbedEnd(0, 1, 0, 1)
+		reporter.end(0)
+		output = os.path.join(self.dir, 'report' + reporter.extension)
+		reporter.build(output)
+		with open(output, 'r', encoding='utf-8') as f:
+			return f.read()
+	# end def
+
+	def rejected(self, value):
+		report = self.report(reporters.JsonReporter(), value)
+		events = [ json.loads(line) for line in report.splitlines() ]
+		return [ e for e in events if e['event'] == 'reject' ][0]
+	# end def
+
+	def test_json_short(self):
+		event = self.rejected('x' * MAX_VALUE)
+		self.assertEqual(event['value'], 'x' * MAX_VALUE)
+		self.assertNotIn('length', event)
+		self.assertEqual(self.rejected(3)['value'], 3)
+	# end def
+
+	def test_json_clipped(self):
+		event = self.rejected('x' * MAX_VALUE + 'y' * 100000)
+		self.assertEqual(event['value'], 'x' * MAX_VALUE)
+		self.assertEqual(event['length'], MAX_VALUE + 100000)
+	# end def
+
+	def test_junit_clipped(self):
+		report = self.report(reporters.JUnitReporter(), 'x' * MAX_VALUE + 'y' * 100000)
+		text = ET.fromstring(report).find('.//failure').text
+		self.assertTrue(text.startswith('x' * MAX_VALUE + '\n'))
+		self.assertNotIn('y', text)
+		self.assertIn(str(MAX_VALUE + 100000), text)
+	# end def
+
+	def test_html_clipped(self):
+		report = self.report(reporters.HtmlReporter(), 'x' * MAX_VALUE + 'y' * 100000)
+		self.assertIn('x' * MAX_VALUE + '</pre>', report)
+		self.assertIn(str(MAX_VALUE + 100000), report)
+	# end def
+# end class
+
+
+if __name__ == '__main__':
+	unittest.main()
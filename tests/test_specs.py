@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ## ###############################################################
+# tests/test_specs.py
+#
+# Author:  Mauricio Matamoros
+# License: MIT
+#
+# ## ###############################################################
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from importlib.util import find_spec
+from evaluator import specs
+
+SPECS = '''<?xml version="1.0" encoding="UTF-8"?>
+<testconf language="Python">
+	<testbeds>
+		<testbed score="1">
+			<testrun args="1 2" cout="allclose(expected.txt)" />
+			<testgen args="{n}" cout="allclose(expected{n}.txt)">
+				<param name="n" values="1 2"/>
+			</testgen>
+		</testbed>
+	</testbeds>
+</testconf>
+'''
+
+
+class TestErrors(unittest.TestCase):
+	def test_invalid_regex(self):
+		with tempfile.NamedTemporaryFile('w', suffix='.xml') as f:
+			f.write(SPECS.replace('allclose(expected.txt)', 'matches([a-)'))
+			f.flush()
+			with self.assertRaises(SystemExit):
+				specs.from_xml(f.name, cache=False)
+	# end def
+
+	def test_missing_numpy(self):
+		with tempfile.NamedTemporaryFile('w', suffix='.xml') as f:
+			f.write(SPECS.replace('allclose(expected.txt)', '3'))
+			f.flush()
+			with mock.patch.dict('sys.modules', { 'numpy': None }):
+				with self.assertRaises(SystemExit):
+					specs.from_xml(f.name, cache=False)
+	# end def
+# end class
+
+
+@unittest.skipUnless(find_spec('numpy'), 'allclose requires NumPy')
+class TestDigest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.write('specs.xml', SPECS)
+		for name, text in [('expected.txt', '1 2'), ('expected1.txt', '1'), ('expected2.txt', '2')]:
+			self.write(name, text)
+	# end def
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+	# end def
+
+	def write(self, name, text):
+		with open(os.path.join(self.dir, name), 'w') as f:
+			f.write(text)
+	# end def
+
+	def digest(self):
+		return specs.from_xml(os.path.join(self.dir, 'specs.xml'), cache=False).digest
+	# end def
+
+	def test_files(self):
+		s = specs.from_xml(os.path.join(self.dir, 'specs.xml'), cache=False)
+		names = [ os.path.basename(f) for f in s.files ]
+		self.assertEqual(names, ['expected.txt', 'expected1.txt', 'expected2.txt'])
+	# end def
+
+	def test_referenced_files_change_digest(self):
+		digest = self.digest()
+		self.assertEqual(digest, self.digest())
+		self.write('expected2.txt', '3')
+		self.assertNotEqual(digest, self.digest())
+		self.write('expected2.txt', '2')
+		self.assertEqual(digest, self.digest())
+	# end def
+# end class
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ## ###############################################################
+# tests/test_vfuncs.py
+#
+# Author:  Mauricio Matamoros
+# License: MIT
+#
+# ## ###############################################################
+
+import os
+import shutil
+import tempfile
+import unittest
+from importlib.util import find_spec
+from evaluator import vfuncs
+from evaluator.vfuncs import parse
+
+
+class TestLengthCheck(unittest.TestCase):
+	def feed(self, expr, chunks):
+		check = parse(expr).early()
+		return all([ check.feed(c) for c in chunks ])
+	# end def
+
+	def test_trailing_whitespace_in_chunks(self):
+		self.assertTrue(parse('maxlength(3)')('abc'))
+		self.assertTrue(self.feed('maxlength(3)', ['abc ', '  ', '\n']))
+		self.assertTrue(self.feed('maxlength(3)', ['ab', 'c', ' \n', '\t']))
+	# end def
+
+	def test_content_after_whitespace(self):
+		self.assertFalse(self.feed('maxlength(3)', ['abc ', '  ', 'd']))
+		self.assertFalse(self.feed('maxlength(3)', ['ab', ' c']))
+		self.assertTrue(self.feed('maxlength(4)', ['ab', ' c ', ' ']))
+	# end def
+# end class
+
+
+class TestEarlyReject(unittest.TestCase):
+	'''Early checks must never reject an output the function accepts,
+	however it is split in chunks'''
+	EXPRESSIONS = ['hello', '42', '3.5', 'anyof(yes, no, maybe)', 'in(ab, abc)',
+		'maxlength(3)', 'between(1, 10)', 'around(5, 0.5)', 'lt(3)', 'geq(-2)']
+	OUTPUTS = ['', '   ', 'hello', 'hello\n', ' hello world', 'hell', 'help', '42', '42.0',
+		' 42 \n', '4 2', '3.5', 'yes', 'no\n\n', 'mayb', 'maybe ', 'abc', 'ab c', 'abcd',
+		'5', '5.4', '-1e3', 'x', '1\n2', '\t1 ']
+
+	def chunkings(self, text):
+		'''Every split of text in up to three chunks'''
+		yield [text]
+		for i in range(len(text) + 1):
+			for j in range(i, len(text) + 1):
+				yield [text[:i], text[i:j], text[j:]]
+	# end def
+
+	def rejected(self, check, chunks):
+		for chunk in chunks:
+			if not check.feed(chunk):
+				return True
+		return False
+	# end def
+
+	def test_accepted_never_rejected(self):
+		for expr in self.EXPRESSIONS:
+			vfunc = parse(expr)
+			self.assertIsNotNone(vfunc.early(), expr)
+			for output in self.OUTPUTS:
+				if not vfunc(output.strip()):
+					continue
+				for chunks in self.chunkings(output):
+					with self.subTest(expr=expr, chunks=chunks):
+						self.assertFalse(self.rejected(vfunc.early(), chunks))
+	# end def
+
+	def test_rejected_early(self):
+		for expr, output in [('hello', 'help'), ('42', '4 2'), ('anyof(yes, no)', 'nope'),
+			('maxlength(3)', 'abcd'), ('lt(3)', '1 1')]:
+			with self.subTest(expr=expr, output=output):
+				self.assertFalse(parse(expr)(output))
+				self.assertTrue(self.rejected(parse(expr).early(), [output]))
+	# end def
+
+	def test_not_supported(self):
+		for expr in ['contains(x)', 'matches(a+)', 'minlength(3)', 'different(x)']:
+			self.assertIsNone(parse(expr).early(), expr)
+	# end def
+# end class
+
+
+class TestParse(unittest.TestCase):
+	def test_invalid_regex(self):
+		with self.assertRaises(ValueError):
+			parse('matches([a-)')
+	# end def
+
+	def test_interned(self):
+		self.assertIs(parse('contains(x)'), parse('contains(x)'))
+		self.assertIsNot(parse('contains(y)', intern=False), parse('contains(y)', intern=False))
+	# end def
+
+	def test_interned_bounded(self):
+		first = parse('contains(first)')
+		for i in range(vfuncs.INTERN_SIZE):
+			parse(f'contains({i})')
+		self.assertIsNot(first, parse('contains(first)'))
+	# end def
+# end class
+
+
+
+@unittest.skipUnless(find_spec('numpy'), 'allclose requires NumPy')
+class TestAllCloseFile(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.write('1 2')
+	# end def
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+	# end def
+
+	def write(self, text):
+		with open(os.path.join(self.dir, 'exp.txt'), 'w') as f:
+			f.write(text)
+	# end def
+
+	def test_not_interned(self):
+		first = parse('allclose(exp.txt)', self.dir)
+		self.assertIsNot(first, parse('allclose(exp.txt)', self.dir))
+		self.write('3 4')
+		self.assertTrue(parse('allclose(exp.txt)', self.dir)('3 4'))
+		self.assertFalse(parse('allclose(exp.txt)', self.dir)('1 2'))
+	# end def
+
+	def test_reloaded(self):
+		vfunc = parse('allclose(exp.txt)', self.dir)
+		self.assertTrue(vfunc('1 2'))
+		self.write('3 4 5')
+		self.assertFalse(vfunc('1 2'))
+		self.assertTrue(vfunc('3 4 5'))
+	# end def
+# end class
+
+
+if __name__ == '__main__':
+	unittest.main()